@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+"""
+Compare the latency of operations made via the CLI wrappers (a rucio subprocess
+per call) with the in-process wrappers that return the same results.
+
+A fake Rucio server (see fakes.py) is started in this process and both backends
+are pointed at it with a generated rucio.cfg. Each operation is then made
+<repeats> times with each backend:
+
+  - addDataset: create a dataset,
+  - attach: attach a file to a dataset,
+  - addRule: add a replication rule for a file,
+  - upload: upload a file,
+  - listDIDs: list the collections in the scope.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from fakes import FakeRucio  # noqa: E402
+from offline import writeRucioConfig  # noqa: E402
+
+SCOPE = "bench"
+RSES = ["BENCH_A", "BENCH_B"]
+
+
+def operations(rucio, fake, idx, fileSize):
+    """ Get the operations to time for iteration, <idx>, as (name, fn) tuples. """
+    from utility import generateRandomFile
+
+    datasetDID = "{}:dataset_{}_{}".format(SCOPE, type(rucio).__name__, idx)
+    fileName = "file_{}_{}".format(type(rucio).__name__, idx)
+    fake.addDID(SCOPE, fileName, bytes=fileSize)
+    fake.replicas.setdefault((SCOPE, fileName), {})[RSES[0]] = "AVAILABLE"
+    f = generateRandomFile(fileSize, prefix="bench")
+
+    def upload():
+        try:
+            rucio.upload(rse=RSES[0], scope=SCOPE, filePath=f.name, lifetime=3600)
+        finally:
+            os.remove(f.name)
+
+    return [
+        ("addDataset", lambda: rucio.addDataset(datasetDID)),
+        ("attach", lambda: rucio.attach(todid=datasetDID, dids="{}:{}".format(SCOPE, fileName))),
+        ("addRule", lambda: rucio.addRule("{}:{}".format(SCOPE, fileName), 1, RSES[1], lifetime=3600)),
+        ("upload", upload),
+        ("listDIDs", lambda: rucio.listDIDs(SCOPE))
+    ]
+
+
+def benchmark(rucio, fake, repeats, fileSize):
+    """ Time each operation <repeats> times with backend, <rucio>, returning the results. """
+    durations = {}
+    failures = {}
+    for idx in range(repeats):
+        for name, fn in operations(rucio, fake, idx, fileSize):
+            st = time.perf_counter()
+            try:
+                fn()
+            except Exception:
+                failures[name] = failures.get(name, 0) + 1
+            durations.setdefault(name, []).append(time.perf_counter() - st)
+    return {
+        name: {
+            "count": len(values),
+            "failed": failures.get(name, 0),
+            "mean_ms": statistics.mean(values) * 1000,
+            "p50_ms": sorted(values)[len(values) // 2] * 1000
+        } for name, values in durations.items()
+    }
+
+
+def report(results):
+    """ Print the results for each backend side by side. """
+    backends = list(results)
+    print("{:<12}".format("operation") + "".join(
+        " {:>22}".format("{} p50 (ms)".format(backend)) for backend in backends))
+    for name in results[backends[0]]:
+        row = "{:<12}".format(name)
+        for backend in backends:
+            stats = results[backend][name]
+            row += " {:>22}".format("{:.1f}{}".format(
+                stats["p50_ms"], " [{} FAILED]".format(stats["failed"]) if stats["failed"] else ""))
+        print(row)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backends', help="backends to benchmark", nargs='+', choices=["cli", "inprocess"],
+                        default=["cli", "inprocess"])
+    parser.add_argument('--repeats', help="number of times to make each operation", default=5, type=int)
+    parser.add_argument('--rucio-latency', help="latency added to each Rucio request (ms)", default=0,
+                        type=float)
+    parser.add_argument('--file-size', help="size of uploaded files (bytes)", default=1000, type=int)
+    parser.add_argument('--json', help="write the results to this path", type=str)
+    iargs = parser.parse_args()
+
+    fake = FakeRucio(latency=iargs.rucio_latency / 1000).start()
+    configDir = tempfile.mkdtemp(prefix="bench-rucio-cfg-")
+    os.environ["RUCIO_CONFIG"] = os.path.join(configDir, "rucio.cfg")
+    writeRucioConfig(fake, os.environ["RUCIO_CONFIG"])
+    for rse in RSES:
+        fake.addRSE(rse)
+    fake.addScope(SCOPE)
+
+    from common.rucio.wrappers import RucioWrappersCLI, RucioWrappersInProcess
+
+    backends = {"cli": RucioWrappersCLI, "inprocess": RucioWrappersInProcess}
+    results = {}
+    try:
+        for backend in iargs.backends:
+            results[backend] = benchmark(backends[backend](), fake, iargs.repeats, iargs.file_size)
+    finally:
+        fake.stop()
+    report(results)
+
+    if iargs.json:
+        with open(iargs.json, "w") as f:
+            json.dump(results, f, indent=2)
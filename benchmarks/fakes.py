@@ -0,0 +1,824 @@
+"""
+Local stand-ins for the Rucio REST API and an Elasticsearch endpoint.
+
+Each stand-in is an HTTP server running in a background thread that keeps its
+state in memory, adds a configurable latency to every request and records the
+time spent handling each operation. A stand-in can be given a capacity, the
+number of requests it handles at once, beyond which it responds with 503 as an
+overloaded server (or the proxy in front of it) would. Only the parts of each API used by the
+tasks in this repository are implemented.
+"""
+from datetime import datetime, timedelta
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qs, unquote, urlparse
+import uuid
+
+
+class NDJSON(list):
+    """ A list of objects to be sent as newline delimited JSON. """
+
+
+class HTTPError(Exception):
+    """ An error to be returned to the client with status code, <status>. """
+
+    def __init__(self, status, body):
+        super().__init__(status)
+        self.status = status
+        self.body = body
+        self.operation = None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """ Request handler that passes each request to the server's stand-in. """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle_one_request(self):
+        try:
+            super().handle_one_request()
+        except ConnectionError:
+            self.close_connection = True
+
+    def _handle(self):
+        self.server.fake._handle(self)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _handle
+
+
+class _Server(ThreadingHTTPServer):
+    # Accept many concurrent connections, as from an asyncio client, without
+    # making clients wait to retry the connection.
+    #
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class FakeServer():
+    """ Base class for an HTTP stand-in running in a background thread. """
+
+    # Headers added to every response.
+    #
+    headers = {}
+
+    def __init__(self, latency=0, host="127.0.0.1", port=0, capacity=None):
+        self.latency = latency
+        self.capacity = capacity
+        self.host = host
+        self.port = port
+        self.stats = {}
+        self._statsLock = threading.Lock()
+        self._lock = threading.RLock()
+        self._active = 0
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        """ Get the base URL of the server. """
+        return "http://{}:{}".format(self.host, self.port)
+
+    def start(self):
+        """ Start serving requests from a background thread. """
+        self._server = _Server((self.host, self.port), _Handler)
+        self._server.fake = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stop serving requests. """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def resetStats(self):
+        """ Clear the per-operation timings. """
+        with self._statsLock:
+            self.stats = {}
+
+    def _handle(self, handler):
+        """ Handle a request to a handler, <handler>, recording the time taken under its operation name. """
+        st = time.perf_counter()
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else b""
+        parsed = urlparse(handler.path)
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        if not self._admit():
+            self._send(handler, 503, {"error": "overloaded"}, {})
+            self._record("overloaded", time.perf_counter() - st)
+            return
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            operation = "{} {}".format(handler.command, parsed.path)
+            try:
+                operation, status, rtn, headers = self._route(
+                    handler.command, unquote(parsed.path), query, handler.headers, body)
+            except HTTPError as e:
+                operation = e.operation or operation
+                status, rtn, headers = e.status, e.body, {}
+            except Exception as e:
+                status, rtn, headers = 500, {"error": repr(e)}, {}
+        finally:
+            with self._statsLock:
+                self._active -= 1
+        self._send(handler, status, rtn, headers)
+        self._record(operation, time.perf_counter() - st)
+
+    def _admit(self):
+        """ Count a request in, returning False if the server is at capacity. """
+        with self._statsLock:
+            if self.capacity is not None and self._active >= self.capacity:
+                return False
+            self._active += 1
+            return True
+
+    def _record(self, operation, duration):
+        with self._statsLock:
+            self.stats.setdefault(operation, []).append(duration)
+
+    def _send(self, handler, status, body, headers):
+        if isinstance(body, NDJSON):
+            payload = "".join(json.dumps(item, default=_serialise) + "\n" for item in body).encode("UTF-8")
+            contentType = "application/x-json-stream"
+        elif isinstance(body, bytes):
+            payload = body
+            contentType = "application/octet-stream"
+        else:
+            payload = json.dumps(body, default=_serialise).encode("UTF-8")
+            contentType = "application/json"
+        handler.send_response(status)
+        handler.send_header("Content-Type", contentType)
+        handler.send_header("Content-Length", str(len(payload)))
+        for key, value in {**self.headers, **headers}.items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        if handler.command != "HEAD":
+            handler.wfile.write(payload)
+
+    def _route(self, method, path, query, headers, body):
+        """
+        Handle a request, returning a tuple of the operation name, status code,
+        response body and extra response headers.
+        """
+        raise NotImplementedError
+
+
+class FakeRucio(FakeServer):
+    """
+    Stand-in for a Rucio server (including the authentication and trace
+    endpoints). RSEs are backed by local directories accessed with the posix
+    protocol, so uploads are real file copies.
+    """
+
+    def __init__(self, latency=0, host="127.0.0.1", port=0, account="root", capacity=None):
+        super().__init__(latency=latency, host=host, port=port, capacity=capacity)
+        self.account = account
+        self.storage = tempfile.mkdtemp(prefix="fake-rucio-")
+        self.tokens = set()
+        self.reset()
+
+    def stop(self):
+        super().stop()
+        shutil.rmtree(self.storage, ignore_errors=True)
+
+    def reset(self):
+        """ Remove all state other than the account. """
+        with self._lock:
+            self.rses = {}
+            self.scopes = set()
+            self.dids = {}
+            self.contents = {}
+            self.replicas = {}
+            self.rules = {}
+            for entry in os.scandir(self.storage):
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def addRSE(self, rse):
+        """ Add an RSE, <rse>, backed by a local directory. """
+        prefix = os.path.join(self.storage, rse) + "/"
+        os.makedirs(prefix, exist_ok=True)
+        with self._lock:
+            self.rses[rse] = {
+                "id": uuid.uuid4().hex,
+                "rse": rse,
+                "rse_type": "DISK",
+                "vo": "def",
+                "deterministic": True,
+                "volatile": False,
+                "staging_area": False,
+                "verify_checksum": True,
+                "availability_read": True,
+                "availability_write": True,
+                "availability_delete": True,
+                "lfn2pfn_algorithm": "hash",
+                "credentials": None,
+                "sign_url": None,
+                "qos_class": None,
+                "domain": ["lan", "wan"],
+                "protocols": [{
+                    "scheme": "file",
+                    "hostname": "",
+                    "port": 0,
+                    "prefix": prefix,
+                    "impl": "rucio.rse.protocols.posix.Default",
+                    "domains": {
+                        "lan": {"read": 1, "write": 1, "delete": 1},
+                        "wan": {"read": 1, "write": 1, "delete": 1,
+                                "third_party_copy_read": 1, "third_party_copy_write": 1}
+                    },
+                    "extended_attributes": None
+                }]
+            }
+
+    def addScope(self, scope):
+        """ Add a scope, <scope>. """
+        with self._lock:
+            self.scopes.add(scope)
+
+    def addDID(self, scope, name, type="FILE", **meta):
+        """ Add a DID, <scope>:<name>, of type, <type>. """
+        with self._lock:
+            if (scope, name) in self.dids:
+                raise HTTPError(409, _exception("DataIdentifierAlreadyExists", "{}:{}".format(scope, name)))
+            self.dids[(scope, name)] = {
+                "scope": scope,
+                "name": name,
+                "type": type,
+                "account": self.account,
+                "bytes": meta.get("bytes"),
+                "adler32": meta.get("adler32"),
+                "md5": meta.get("md5"),
+                "created_at": _now()
+            }
+            return self.dids[(scope, name)]
+
+    def addRule(self, scope, name, rse, state="REPLICATING", src=None, lifetime=None, activity=None):
+        """ Add a replication rule for <scope>:<name> at <rse>, returning its ID. """
+        with self._lock:
+            ruleID = uuid.uuid4().hex
+            now = _now()
+            self.rules[ruleID] = {
+                "id": ruleID,
+                "scope": scope,
+                "name": name,
+                "account": self.account,
+                "rse_expression": rse,
+                "source_replica_expression": src,
+                "activity": activity,
+                "copies": 1,
+                "state": state,
+                "error": None,
+                "created_at": now,
+                "updated_at": now,
+                "expires_at": None if lifetime is None else now + timedelta(seconds=int(lifetime))
+            }
+            self.replicas.setdefault((scope, name), {}).setdefault(rse, "AVAILABLE" if state == "OK" else "COPYING")
+            return ruleID
+
+    def revokeTokens(self):
+        """ Reject all tokens issued so far, as if they had expired. """
+        with self._lock:
+            self.tokens = set()
+
+    def _route(self, method, path, query, headers, body):
+        parts = [part for part in path.split("/") if part]
+        data = json.loads(body) if body else None
+        with self._lock:
+            if parts and parts[0] not in ("auth", "ping", "traces") and \
+                    headers.get("X-Rucio-Auth-Token") not in self.tokens:
+                error = HTTPError(401, _exception("CannotAuthenticate", "Cannot authenticate with given credentials"))
+                error.operation = "unauthenticated"
+                raise error
+            for pattern, routeMethod, name, fn in self._routes():
+                if method != routeMethod:
+                    continue
+                match = re.fullmatch(pattern, "/".join(parts))
+                if match:
+                    try:
+                        status, rtn, extraHeaders = fn(*match.groups(), query=query, headers=headers, data=data)
+                    except HTTPError as e:
+                        e.operation = name
+                        raise
+                    return name, status, rtn, extraHeaders
+        raise HTTPError(404, _exception("RucioException", "No route for {} {}".format(method, path)))
+
+    def _routes(self):
+        return [
+            (r"auth/userpass", "GET", "auth", self._auth),
+            (r"auth/validate", "GET", "auth-validate", self._authValidate),
+            (r"ping", "GET", "ping", lambda **kw: (200, {"version": "fake"}, {})),
+            (r"traces", "POST", "trace", lambda **kw: (201, b"", {})),
+            (r"accounts/whoami", "GET", "whoami", self._whoami),
+            (r"accounts/([^/]+)", "GET", "get-account", lambda account, **kw: self._whoami()),
+            (r"accounts/([^/]+)/scopes", "GET", "list-scopes", self._listScopes),
+            (r"scopes", "GET", "list-scopes", self._listScopes),
+            (r"rses", "GET", "list-rses", self._listRSEs),
+            (r"rses/([^/]+)", "GET", "get-rse", self._getRSE),
+            (r"rses/([^/]+)/attr", "GET", "list-rse-attributes", self._listRSEAttributes),
+            (r"rses/([^/]+)/protocols", "GET", "get-protocols", self._getProtocols),
+            (r"dids/([^/]+)/dids/search", "GET", "list-dids", self._listDIDs),
+            (r"dids", "POST", "add-dids", self._addDIDs),
+            (r"dids/attachments", "POST", "attach", self._attachments),
+            (r"dids/([^/]+)/(.+)/dids", "GET", "list-content", self._listContent),
+            (r"dids/([^/]+)/(.+)/dids", "POST", "attach", self._attach),
+            (r"dids/([^/]+)/(.+)/meta", "GET", "get-metadata", self._getMetadata),
+            (r"dids/([^/]+)/(.+)/meta", "POST", "set-metadata", lambda scope, name, **kw: (201, b"", {})),
+            (r"dids/([^/]+)/(.+)", "GET", "get-did", self._getDID),
+            (r"dids/([^/]+)/(.+)", "POST", "add-did", self._addDID),
+            (r"replicas", "POST", "add-replicas", self._addReplicas),
+            (r"replicas", "PUT", "update-replicas", self._updateReplicas),
+            (r"replicas/list", "POST", "list-replicas", self._listReplicas),
+            (r"requests/history/([^/]+)/([^/]+)/([^/]+)", "GET", "get-request-history", self._getRequestHistory),
+            (r"rules", "POST", "add-rule", self._addRules),
+            (r"rules", "GET", "list-rules", self._listRules),
+            (r"rules/([^/]+)", "GET", "get-rule", self._getRule),
+            (r"rules/([^/]+)", "DELETE", "delete-rule", self._deleteRule),
+        ]
+
+    def _auth(self, **kw):
+        token = "{}-fake-{}".format(self.account, uuid.uuid4().hex)
+        self.tokens.add(token)
+        return 200, b"", {
+            "X-Rucio-Auth-Token": token,
+            "X-Rucio-Auth-Token-Expires": (datetime.utcnow() + timedelta(hours=1)).strftime(
+                "%a, %d %b %Y %H:%M:%S UTC")
+        }
+
+    def _authValidate(self, **kw):
+        return 200, {"account": self.account, "lifetime": _now() + timedelta(hours=1)}, {}
+
+    def _whoami(self, **kw):
+        return 200, {"account": self.account, "account_type": "SERVICE", "status": "ACTIVE",
+                     "email": None}, {}
+
+    def _listScopes(self, account=None, **kw):
+        return 200, sorted(self.scopes), {}
+
+    def _listRSEs(self, query, **kw):
+        expression = query.get("expression")
+        rses = [rse for rse in self.rses if expression in (None, "*", rse)]
+        if expression and not rses:
+            raise HTTPError(400, _exception("InvalidRSEExpression", expression))
+        return 200, NDJSON({"rse": rse} for rse in rses), {}
+
+    def _rse(self, rse):
+        if rse not in self.rses:
+            raise HTTPError(404, _exception("RSENotFound", rse))
+        return self.rses[rse]
+
+    def _getRSE(self, rse, **kw):
+        return 200, self._rse(rse), {}
+
+    def _getProtocols(self, rse, **kw):
+        return 200, self._rse(rse), {}
+
+    def _listRSEAttributes(self, rse, **kw):
+        self._rse(rse)
+        return 200, {rse: True, "fts": "https://fts.example:8446"}, {}
+
+    def _did(self, scope, name):
+        if (scope, name) not in self.dids:
+            raise HTTPError(404, _exception("DataIdentifierNotFound", "{}:{}".format(scope, name)))
+        return self.dids[(scope, name)]
+
+    def _listDIDs(self, scope, query, **kw):
+        types = {
+            "collection": ("DATASET", "CONTAINER"),
+            "dataset": ("DATASET",),
+            "container": ("CONTAINER",),
+            "file": ("FILE",),
+            "all": ("DATASET", "CONTAINER", "FILE")
+        }[query.get("type", "collection")]
+        dids = [did for (didScope, _), did in self.dids.items() if didScope == scope and did["type"] in types]
+        if query.get("long") in ("True", "true", "1"):
+            return 200, NDJSON({"scope": did["scope"], "name": did["name"], "did_type": did["type"],
+                                "bytes": did.get("bytes"), "length": did.get("length")} for did in dids), {}
+        return 200, NDJSON(did["name"] for did in dids), {}
+
+    def _getDID(self, scope, name, **kw):
+        return 200, self._did(scope, name), {}
+
+    def _getMetadata(self, scope, name, **kw):
+        return 200, self._did(scope, name), {}
+
+    def _addDID(self, scope, name, data, **kw):
+        self.addDID(scope, name, type=data.get("type", "DATASET"))
+        return 201, b"", {}
+
+    def _addDIDs(self, data, **kw):
+        for did in data:
+            self.addDID(did["scope"], did["name"], type=did.get("type", "DATASET"))
+        return 201, b"", {}
+
+    def _attach(self, scope, name, data, **kw):
+        self._did(scope, name)
+        for did in data.get("dids", []):
+            self._attachOne(scope, name, did)
+        return 201, b"", {}
+
+    def _attachments(self, data, **kw):
+        for attachment in data["attachments"]:
+            self._did(attachment["scope"], attachment["name"])
+            for did in attachment["dids"]:
+                self._attachOne(attachment["scope"], attachment["name"], did)
+        return 201, b"", {}
+
+    def _attachOne(self, scope, name, did):
+        child = (did["scope"], did["name"])
+        if child not in self.dids:
+            self.addDID(*child, **did)
+        if did.get("rse"):
+            self.replicas.setdefault(child, {})[did["rse"]] = "AVAILABLE"
+        children = self.contents.setdefault((scope, name), [])
+        if child not in children:
+            children.append(child)
+
+    def _listContent(self, scope, name, **kw):
+        self._did(scope, name)
+        return 200, NDJSON({
+            "scope": childScope,
+            "name": childName,
+            "type": self.dids[(childScope, childName)]["type"],
+            "bytes": self.dids[(childScope, childName)]["bytes"],
+            "adler32": self.dids[(childScope, childName)]["adler32"],
+            "md5": self.dids[(childScope, childName)]["md5"]
+        } for childScope, childName in self.contents.get((scope, name), [])), {}
+
+    def _addReplicas(self, data, **kw):
+        for replica in data["files"]:
+            did = (replica["scope"], replica["name"])
+            if did not in self.dids:
+                self.addDID(*did, bytes=replica.get("bytes"), adler32=replica.get("adler32"),
+                            md5=replica.get("md5"))
+            self.replicas.setdefault(did, {})[data["rse"]] = replica.get("state", "AVAILABLE")
+        return 201, b"", {}
+
+    def _updateReplicas(self, data, **kw):
+        for replica in data["replicas"]:
+            self.replicas.setdefault((replica["scope"], replica["name"]), {})[replica["rse"]] = \
+                {"A": "AVAILABLE", "C": "COPYING", "U": "UNAVAILABLE"}.get(replica.get("state"), "AVAILABLE")
+        return 200, b"", {}
+
+    def _listReplicas(self, data, **kw):
+        expression = data.get("rse_expression")
+        rtn = NDJSON()
+        for did in data["dids"]:
+            key = (did["scope"], did["name"])
+            if key not in self.dids:
+                continue
+            states = {rse: state for rse, state in self.replicas.get(key, {}).items()
+                      if expression in (None, rse) and (data.get("all_states") or state == "AVAILABLE")}
+            pfns = {}
+            rses = {}
+            for rse in states:
+                prefix = self.rses[rse]["protocols"][0]["prefix"] if rse in self.rses else "/"
+                pfn = "file://{}{}/{}".format(prefix, key[0], key[1])
+                rses[rse] = [pfn]
+                pfns[pfn] = {"rse": rse, "rse_id": self.rses.get(rse, {}).get("id"), "type": "DISK",
+                             "domain": "wan", "priority": 1, "volatile": False, "client_extract": False}
+            rtn.append({**self.dids[key], "rses": rses, "pfns": pfns, "states": states})
+        return 200, rtn, {}
+
+    def _getRequestHistory(self, scope, name, rse, **kw):
+        if self.replicas.get((scope, name), {}).get(rse) != "AVAILABLE":
+            raise HTTPError(404, _exception("RequestNotFound", "{}:{} at {}".format(scope, name, rse)))
+        return 200, {"scope": scope, "name": name, "dest_rse": rse, "state": "DONE",
+                     "external_id": uuid.uuid5(uuid.NAMESPACE_URL, "{}:{}@{}".format(scope, name, rse)).hex}, {}
+
+    def _addRules(self, data, **kw):
+        # Like Rucio, reject the whole request if any DID already has an identical
+        # rule.
+        #
+        for did in data["dids"]:
+            if (did["scope"], did["name"]) not in self.dids:
+                raise HTTPError(404, _exception("DataIdentifierNotFound", "{}:{}".format(did["scope"], did["name"])))
+            for rule in self.rules.values():
+                if (rule["scope"], rule["name"], rule["rse_expression"]) == (
+                        did["scope"], did["name"], data["rse_expression"]):
+                    raise HTTPError(409, _exception("DuplicateRule", "{}:{}".format(did["scope"], did["name"])))
+        ruleIDs = []
+        for did in data["dids"]:
+            ruleIDs.append(self.addRule(
+                did["scope"], did["name"], data["rse_expression"], src=data.get("source_replica_expression"),
+                lifetime=data.get("lifetime"), activity=data.get("activity")))
+        return 201, ruleIDs, {}
+
+    def _listRules(self, query, **kw):
+        return 200, NDJSON(rule for rule in self.rules.values()
+                           if all(rule.get(key) == value for key, value in query.items() if key in rule)), {}
+
+    def _getRule(self, ruleID, **kw):
+        if ruleID not in self.rules:
+            raise HTTPError(404, _exception("RuleNotFound", ruleID))
+        return 200, self.rules[ruleID], {}
+
+    def _deleteRule(self, ruleID, **kw):
+        if self.rules.pop(ruleID, None) is None:
+            raise HTTPError(404, _exception("RuleNotFound", ruleID))
+        return 200, b"", {}
+
+
+class FakeElasticsearch(FakeServer):
+    """
+    Stand-in for an Elasticsearch node. Documents are kept in memory, can be
+    written singly or with (optionally gzip compressed) bulk requests, and searches
+    support the bool, term, terms, range and match_all queries, terms and sum
+    aggregations, _source includes, multi-gets, counts and paging with search_after against a
+    point in time. Any POST to
+    /_webhook is accepted and discarded, so it can also stand in for a webhook.
+    """
+
+    headers = {"X-Elastic-Product": "Elasticsearch"}
+
+    def __init__(self, latency=0, host="127.0.0.1", port=0):
+        super().__init__(latency=latency, host=host, port=port)
+        self.reset()
+
+    def reset(self):
+        """ Remove all indices and points in time. """
+        with self._lock:
+            self.indices = {}
+            self.pits = {}
+
+    def addDocument(self, index, documentID, source):
+        """ Add a document, <source>, with ID, <documentID>, to index, <index>. """
+        with self._lock:
+            self.indices.setdefault(index, {})[str(documentID)] = source
+
+    def _route(self, method, path, query, headers, body):
+        path = "/".join(part for part in path.split("/") if part)
+        if headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        with self._lock:
+            for pattern, methods, name, fn in self._routes():
+                match = re.fullmatch(pattern, path)
+                if match and (methods is None or method in methods):
+                    try:
+                        return (name,) + fn(*match.groups(), query=query, body=body)
+                    except HTTPError as e:
+                        e.operation = name
+                        raise
+        raise HTTPError(400, {"error": "no handler for {} {}".format(method, path), "status": 400})
+
+    def _routes(self):
+        return [
+            (r"(?:([^/]+)/)?_bulk", None, "bulk", lambda index, body, **kw: self._bulk(index, body)),
+            (r"", None, "info", lambda **kw: self._info()),
+            (r"_webhook", None, "webhook", lambda **kw: (200, b"", {})),
+            (r"_pit", ("DELETE",), "close-pit", lambda body, **kw: self._closePIT(_loads(body))),
+            (r"_search", ("GET", "POST"), "search",
+             lambda query, body, **kw: self._search(None, query, _loads(body))),
+            (r"([^/]+)/_doc/([^/]+)", ("PUT", "POST"), "index",
+             lambda index, documentID, body, **kw: self._index(index, documentID, _loads(body))),
+            (r"([^/]+)/_doc/([^/]+)", ("GET",), "get",
+             lambda index, documentID, **kw: self._get(index, documentID)),
+            (r"([^/]+)/_update/([^/]+)", ("POST",), "update",
+             lambda index, documentID, body, **kw: self._update(index, documentID, _loads(body))),
+            (r"([^/]+)/_search", ("GET", "POST"), "search",
+             lambda index, query, body, **kw: self._search(index, query, _loads(body))),
+            (r"([^/]+)/_mget", ("GET", "POST"), "mget",
+             lambda index, query, body, **kw: self._mget(index, query, _loads(body))),
+            (r"([^/]+)/_count", ("GET", "POST"), "count",
+             lambda index, body, **kw: self._count(index, _loads(body))),
+            (r"([^/]+)/_pit", ("POST",), "open-pit", lambda index, **kw: self._openPIT(index)),
+        ]
+
+    def _info(self):
+        return 200, {
+            "version": {"number": "7.5.1", "build_flavor": "default"},
+            "tagline": "You Know, for Search"
+        }, {}
+
+    def _bulk(self, index, body):
+        lines = [json.loads(line) for line in body.decode("UTF-8").splitlines() if line.strip()]
+        items = []
+        while lines:
+            action, metadata = next(iter(lines.pop(0).items()))
+            data = lines.pop(0) if action != "delete" else None
+            fn = {"index": self._index, "create": self._index, "update": self._update}.get(action)
+            try:
+                if fn is None:
+                    raise HTTPError(400, {"error": {"type": "illegal_argument_exception"}, "status": 400})
+                status, result, _ = fn(metadata.get("_index", index), str(metadata["_id"]), data)
+            except HTTPError as e:
+                status, result = e.status, {"_id": metadata.get("_id"), **e.body}
+            items.append({action: {**result, "status": status}})
+        return 200, {"took": 0, "errors": any("error" in item[action] for item in items for action in item),
+                     "items": items}, {}
+
+    def _index(self, index, documentID, data):
+        result = "updated" if documentID in self.indices.get(index, {}) else "created"
+        self.addDocument(index, documentID, data)
+        return 200 if result == "updated" else 201, {
+            "_index": index, "_type": "_doc", "_id": documentID, "_version": 1, "result": result,
+            "_shards": {"total": 1, "successful": 1, "failed": 0}}, {}
+
+    def _get(self, index, documentID):
+        if documentID not in self.indices.get(index, {}):
+            return 404, {"_index": index, "_type": "_doc", "_id": documentID, "found": False}, {}
+        return 200, {"_index": index, "_type": "_doc", "_id": documentID, "_version": 1, "found": True,
+                     "_source": self.indices[index][documentID]}, {}
+
+    def _mget(self, index, query, data):
+        includes = query.get("_source_includes")
+        docs = []
+        for documentID in data.get("ids", []):
+            status, doc, _ = self._get(index, str(documentID))
+            if doc["found"] and includes is not None:
+                doc["_source"] = {
+                    field: value for field, value in doc["_source"].items() if field in includes.split(",")}
+            docs.append(doc)
+        return 200, {"docs": docs}, {}
+
+    def _update(self, index, documentID, data):
+        if documentID not in self.indices.get(index, {}):
+            raise HTTPError(404, {"error": {"type": "document_missing_exception"}, "status": 404})
+        self.indices[index][documentID].update(data.get("doc", {}))
+        return 200, {"_index": index, "_type": "_doc", "_id": documentID, "_version": 2, "result": "updated",
+                     "_shards": {"total": 1, "successful": 1, "failed": 0}}, {}
+
+    def _openPIT(self, index):
+        if index not in self.indices:
+            raise HTTPError(404, {"error": {"type": "index_not_found_exception"}, "status": 404})
+        pitID = str(uuid.uuid4())
+        self.pits[pitID] = index
+        return 200, {"id": pitID}, {}
+
+    def _closePIT(self, data):
+        found = self.pits.pop(data.get("id"), None) is not None
+        return 200 if found else 404, {"succeeded": found, "num_freed": 1 if found else 0}, {}
+
+    def _count(self, index, data):
+        if index not in self.indices:
+            raise HTTPError(404, {"error": {"type": "index_not_found_exception"}, "status": 404})
+        count = sum(
+            1 for source in self.indices[index].values() if _matches(data.get("query", {"match_all": {}}), source))
+        return 200, {"count": count, "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0}}, {}
+
+    def _search(self, index, query, data):
+        # Searches against a point in time page through the documents of its index
+        # in the order they were added, by position (as if sorted by _shard_doc).
+        #
+        if "pit" in data:
+            index = self.pits.get(data["pit"]["id"])
+            if index is None:
+                raise HTTPError(404, {"error": {"type": "search_context_missing_exception"}, "status": 404})
+        if index not in self.indices:
+            raise HTTPError(404, {"error": {"type": "index_not_found_exception"}, "status": 404})
+        size = int(query.get("size", data.get("size", 10)))
+        searchAfter = data.get("search_after", [-1])[0]
+        includes = data.get("_source")
+        matched = [
+            {"_index": index, "_type": "_doc", "_id": documentID, "_score": None, "_source": source,
+             **({"sort": [position]} if "pit" in data else {})}
+            for position, (documentID, source) in enumerate(self.indices[index].items())
+            if position > searchAfter and _matches(data.get("query", {"match_all": {}}), source)
+        ]
+        hits = [
+            {**hit, "_source": {field: value for field, value in hit["_source"].items() if field in _asList(includes)}}
+            if includes is not None else hit for hit in matched
+        ]
+        extra = {}
+        aggregations = data.get("aggs", data.get("aggregations"))
+        if aggregations:
+            extra["aggregations"] = _aggregate(aggregations, [hit["_source"] for hit in matched])
+        return 200, {
+            "took": 0,
+            "timed_out": False,
+            **extra,
+            **({"pit_id": data["pit"]["id"]} if "pit" in data else {}),
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"total": {"value": len(hits), "relation": "eq"}, "max_score": None, "hits": hits[:size]}
+        }, {}
+
+
+def _loads(body):
+    """ Parse a JSON request body, <body>, which may be empty. """
+    return json.loads(body) if body else {}
+
+
+def _now():
+    return datetime.utcnow().replace(microsecond=0)
+
+
+def _serialise(value):
+    """ Serialise dates in the same format as a Rucio server. """
+    if isinstance(value, datetime):
+        return value.strftime("%a, %d %b %Y %H:%M:%S UTC")
+    return str(value)
+
+
+def _exception(cls, message):
+    return {"ExceptionClass": cls, "ExceptionMessage": message}
+
+
+def _aggregate(aggregations, sources):
+    """ Compute terms (with <include> and <size>) and sum aggregations, <aggregations>, over documents, <sources>. """
+    results = {}
+    for name, aggregation in aggregations.items():
+        if "terms" in aggregation:
+            terms = aggregation["terms"]
+            buckets = {}
+            for source in sources:
+                for value in _asList(_field(source, terms["field"])):
+                    if value is not None and ("include" not in terms or value in terms["include"]):
+                        buckets.setdefault(value, []).append(source)
+            ordered = sorted(buckets.items(), key=lambda item: -len(item[1]))[:terms.get("size", 10)]
+            results[name] = {
+                "doc_count_error_upper_bound": 0,
+                "sum_other_doc_count": sum(len(docs) for docs in buckets.values()) - sum(
+                    len(docs) for key, docs in ordered),
+                "buckets": [
+                    {"key": key, "doc_count": len(docs), **_aggregate(aggregation.get("aggs", {}), docs)}
+                    for key, docs in ordered
+                ]
+            }
+        elif "sum" in aggregation:
+            field = aggregation["sum"]["field"]
+            results[name] = {"value": float(sum(
+                float(value) for source in sources for value in _asList(_field(source, field)) if value is not None))}
+        else:
+            raise HTTPError(400, {"error": {"type": "parsing_exception"}, "status": 400})
+    return results
+
+
+def _asList(value):
+    return value if isinstance(value, list) else [value]
+
+
+def _field(source, field):
+    if field.endswith(".keyword"):
+        field = field[:-len(".keyword")]
+    return source.get(field)
+
+
+def _coerce(value):
+    """ Convert a date (ISO string, epoch millis or date math relative to now) into a comparable value. """
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        match = re.fullmatch(r"now(?:([+-])(\d+)([smhdw]))?(?:/[smhdw])?", value)
+        if match:
+            now = datetime.utcnow()
+            if match.group(1):
+                units = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+                delta = timedelta(**{units[match.group(3)]: int(match.group(2))})
+                now = now + delta if match.group(1) == "+" else now - delta
+            return now.timestamp() * 1000
+        try:
+            return datetime.fromisoformat(value.replace("Z", "")).timestamp() * 1000
+        except ValueError:
+            return value
+    if isinstance(value, datetime):
+        return value.timestamp() * 1000
+    return value
+
+
+def _matches(clause, source):
+    """ Evaluate a query clause, <clause>, against a document, <source>. """
+    (kind, body), = clause.items()
+    if kind == "match_all":
+        return True
+    if kind == "bool":
+        return all(_matches(sub, source) for key in ("filter", "must") for sub in _asList(body.get(key, []))) \
+            and not any(_matches(sub, source) for sub in _asList(body.get("must_not", []))) \
+            and (not body.get("should") or any(_matches(sub, source) for sub in _asList(body["should"])))
+    if kind == "term":
+        (field, value), = body.items()
+        if isinstance(value, dict):
+            value = value["value"]
+        return _field(source, field) == value
+    if kind == "terms":
+        (field, values), = body.items()
+        return _field(source, field) in values
+    if kind == "range":
+        (field, bounds), = body.items()
+        value = _coerce(_field(source, field))
+        if value is None:
+            return False
+        try:
+            return all([
+                "gte" not in bounds or value >= _coerce(bounds["gte"]),
+                "gt" not in bounds or value > _coerce(bounds["gt"]),
+                "lte" not in bounds or value <= _coerce(bounds["lte"]),
+                "lt" not in bounds or value < _coerce(bounds["lt"])
+            ])
+        except TypeError:
+            return False
+    raise HTTPError(400, {"error": {"type": "parsing_exception", "reason": "unsupported query [{}]".format(kind)},
+                          "status": 400})
@@ -0,0 +1,296 @@
+#!/usr/bin/python3
+"""
+Benchmark tasks end to end against local stand-ins for Rucio and Elasticsearch.
+
+A fake Rucio server and a fake Elasticsearch node (see fakes.py) are started in
+this process, the Rucio client is pointed at them with a generated rucio.cfg, and
+each task is run once per scale after seeding the stand-ins with data. The scale
+is the number of items each task has to process:
+
+  - upload (TestUpload): files uploaded across two RSEs,
+  - upload_replication (TestUploadReplication): files uploaded across two RSEs,
+  - sync (SyncESDatabase): documents synchronised with their replication rules,
+  - report (ReportDaily): documents in the index that the report is built from.
+
+For each run, the throughput (items/s), the wall time of each phase recorded by
+the task and the server-side latency of each operation are reported.
+"""
+import argparse
+import importlib
+import json
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from fakes import FakeElasticsearch, FakeRucio  # noqa: E402
+
+SCOPE = "bench"
+RSES = ["BENCH_A", "BENCH_B"]
+INDEX = "bench"
+TASK_NAME = "bench-upload-replication"
+
+
+def seedDocuments(rucio, es, nDocs):
+    """
+    Add <nDocs> replication rules to the fake Rucio server in a mix of states and
+    a document for each to the fake Elasticsearch node, as if pushed while the
+    rules were replicating.
+    """
+    createdAt = (datetime.utcnow() - timedelta(minutes=30)).replace(microsecond=0)
+    for idx in range(nDocs):
+        src, dst = RSES[idx % 2], RSES[(idx + 1) % 2]
+        name = "file_{}".format(idx)
+        rucio.addDID(SCOPE, name, bytes=1000)
+        state = ("OK", "REPLICATING", "STUCK")[idx % 3]
+        ruleID = rucio.addRule(SCOPE, name, dst, state=state, src=src)
+        es.addDocument(INDEX, ruleID, {
+            "@timestamp": int(createdAt.timestamp()) * 1000,
+            "rule_id": ruleID,
+            "scope": SCOPE,
+            "name": name,
+            "from_rse": src,
+            "to_rse": dst,
+            "created_at": createdAt.isoformat(),
+            "updated_at": createdAt.isoformat(),
+            "state": state,
+            "task_name": TASK_NAME,
+            "file_size": 1000,
+            "is_submitted": 1,
+            "is_done": 1 if state == "OK" else 0,
+            "is_replicating": 1 if state == "REPLICATING" else 0,
+            "is_stuck": 1 if state == "STUCK" else 0
+        })
+
+
+def prepareUpload(rucio, es, scale, options):
+    """ Get the kwargs for TestUpload, returning the number of items. """
+    nFiles = math.ceil(scale / len(RSES))
+    kwargs = {
+        "n_files": nFiles,
+        "rses": RSES,
+        "scope": SCOPE,
+        "lifetime": 3600,
+        "sizes": [options.file_size],
+        "protocols": ["file"],
+        "databases": [{"type": "es", "uri": es.url, "index": INDEX}],
+        "task_name": TASK_NAME,
+        "naming_prefix": "bench",
+        "attach_batch_size": options.attach_batch_size,
+        "n_threads": options.n_threads,
+        "n_threads_per_rse": options.n_threads_per_rse
+    }
+    return kwargs, nFiles * len(RSES)
+
+
+def prepareUploadReplication(rucio, es, scale, options):
+    """ Get the kwargs for TestUploadReplication, returning the number of items. """
+    nFiles = math.ceil(scale / len(RSES))
+    kwargs = {
+        "activity": "User Subscriptions",
+        "n_files": nFiles,
+        "rses": RSES,
+        "scope": SCOPE,
+        "lifetime": 3600,
+        "sizes": [options.file_size],
+        "databases": [{"type": "es", "uri": es.url, "index": INDEX}],
+        "task_name": TASK_NAME,
+        "naming_prefix": "bench",
+        "attach_batch_size": options.attach_batch_size,
+        "rule_batch_size": options.rule_batch_size
+    }
+    return kwargs, nFiles * len(RSES)
+
+
+def prepareSync(rucio, es, scale, options):
+    """ Seed the stand-ins and get the kwargs for SyncESDatabase, returning the number of items. """
+    seedDocuments(rucio, es, scale)
+    kwargs = {
+        "fts_endpoint": None,
+        "task_name_to_update": TASK_NAME,
+        "update_all": True,
+        "database": {
+            "type": "es",
+            "uri": es.url,
+            "index": INDEX,
+            "search_range_lte": "now",
+            "search_range_gte": "now-1h"
+        },
+        "task_name": "bench-sync"
+    }
+    return kwargs, scale
+
+
+def prepareReport(rucio, es, scale, options):
+    """ Seed the stand-ins and get the kwargs for ReportDaily, returning the number of items. """
+    seedDocuments(rucio, es, scale)
+    kwargs = {
+        "database": {
+            "type": "es",
+            "uri": es.url,
+            "index": INDEX,
+            "search_range_lte": "now",
+            "search_range_gte": "now-24h"
+        },
+        "percentage_stuck_warning_threshold": 1,
+        "report_title": "Benchmark",
+        "rses": RSES,
+        "using_task_name": TASK_NAME,
+        "webhooks": [{"type": "slack", "url": "{}/_webhook".format(es.url)}],
+        "task_name": "bench-report"
+    }
+    return kwargs, scale
+
+
+TASKS = {
+    "upload": ("tasks.tests.upload", "TestUpload", prepareUpload),
+    "upload_replication": ("tasks.tests.upload_replication", "TestUploadReplication", prepareUploadReplication),
+    "sync": ("tasks.sync.database", "SyncESDatabase", prepareSync),
+    "report": ("tasks.reports.daily", "ReportDaily", prepareReport)
+}
+
+
+def writeRucioConfig(rucio, path):
+    """ Write a Rucio client configuration, <path>, pointing at the fake Rucio server. """
+    with open(path, "w") as f:
+        f.write("\n".join([
+            "[client]",
+            "rucio_host = {}".format(rucio.url),
+            "auth_host = {}".format(rucio.url),
+            "auth_type = userpass",
+            "username = bench",
+            "password = bench",
+            "account = {}".format(rucio.account),
+            "request_retries = 1",
+            "",
+            "[trace]",
+            "trace_host = {}".format(rucio.url),
+            ""
+        ]))
+
+
+def summarise(durations, wall):
+    """ Summarise a list of operation durations in seconds. """
+    durations = sorted(durations)
+    return {
+        "count": len(durations),
+        "mean_ms": statistics.mean(durations) * 1000,
+        "p50_ms": durations[len(durations) // 2] * 1000,
+        "p95_ms": durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000,
+        "ops_per_s": len(durations) / wall if wall else 0
+    }
+
+
+def benchmark(name, scale, rucio, es, logger, options):
+    """ Run task, <name>, once at scale, <scale>, returning the results. """
+    from common.rucio import cache
+    from common.rucio.helpers import forgetCollections
+
+    moduleName, className, prepare = TASKS[name]
+    rucio.reset()
+    forgetCollections()
+    cache.invalidate()
+    es.reset()
+    for rse in RSES:
+        rucio.addRSE(rse)
+    rucio.addScope(SCOPE)
+    kwargs, nItems = prepare(rucio, es, scale, options)
+    rucio.resetStats()
+    es.resetStats()
+
+    task = getattr(importlib.import_module(moduleName), className)(logger)
+    st = time.perf_counter()
+    rtn = task.run([], kwargs)
+    wall = time.perf_counter() - st
+
+    operations = {}
+    for server, label in ((rucio, "rucio"), (es, "es")):
+        for operation, durations in sorted(server.stats.items()):
+            operations["{}:{}".format(label, operation)] = summarise(durations, wall)
+    return {
+        "task": name,
+        "class_name": className,
+        "scale": scale,
+        "items": nItems,
+        "failed": rtn is False,
+        "wall": wall,
+        "items_per_s": nItems / wall if wall else 0,
+        "phases": task.getProfile(taskName=kwargs["task_name"])["phases"],
+        "operations": operations
+    }
+
+
+def report(result):
+    """ Print the results of a single run. """
+    print("{} @ {}: {} items in {:.3f}s ({:.1f} items/s){}".format(
+        result["task"], result["scale"], result["items"], result["wall"], result["items_per_s"],
+        " [FAILED]" if result["failed"] else ""))
+    if result["phases"]:
+        print("  {:<30} {:>8} {:>10} {:>10}".format("phase", "count", "wall (s)", "cpu (s)"))
+        for phase, stats in result["phases"].items():
+            print("  {:<30} {:>8} {:>10.3f} {:>10.3f}".format(phase, stats["count"], stats["wall"], stats["cpu"]))
+    print("  {:<30} {:>8} {:>10} {:>10} {:>10} {:>10}".format(
+        "operation", "count", "mean (ms)", "p50 (ms)", "p95 (ms)", "ops/s"))
+    for operation, stats in result["operations"].items():
+        print("  {:<30} {:>8} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.1f}".format(
+            operation, stats["count"], stats["mean_ms"], stats["p50_ms"], stats["p95_ms"], stats["ops_per_s"]))
+    print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', help="tasks to benchmark", nargs='+', choices=list(TASKS),
+                        default=list(TASKS))
+    parser.add_argument('--scales', help="number of items for each task to process", nargs='+', type=int,
+                        default=[10, 1000, 100000])
+    parser.add_argument('--rucio-latency', help="latency added to each Rucio request (ms)", default=0,
+                        type=float)
+    parser.add_argument('--rucio-capacity', help="number of requests the Rucio server handles at once", type=int)
+    parser.add_argument('--es-latency', help="latency added to each Elasticsearch request (ms)", default=0,
+                        type=float)
+    parser.add_argument('--file-size', help="size of uploaded files (bytes)", default=1000, type=int)
+    parser.add_argument('--attach-batch-size', help="number of files to attach to datasets at once", default=1,
+                        type=int)
+    parser.add_argument('--rule-batch-size', help="number of files to add replication rules for at once", default=1,
+                        type=int)
+    parser.add_argument('--n-threads', help="number of upload threads", default=1, type=int)
+    parser.add_argument('--n-threads-per-rse', help="number of upload threads per RSE", default=1, type=int)
+    parser.add_argument('--n-workers', help="number of worker processes", default=os.cpu_count(), type=int)
+    parser.add_argument('--json', help="write the results to this path", type=str)
+    parser.add_argument('-v', help="verbose?", action='store_true')
+    iargs = parser.parse_args()
+
+    rucio = FakeRucio(latency=iargs.rucio_latency / 1000, capacity=iargs.rucio_capacity).start()
+    es = FakeElasticsearch(latency=iargs.es_latency / 1000).start()
+    configDir = tempfile.mkdtemp(prefix="bench-rucio-cfg-")
+    os.environ["RUCIO_CONFIG"] = os.path.join(configDir, "rucio.cfg")
+    writeRucioConfig(rucio, os.environ["RUCIO_CONFIG"])
+
+    from logger import Logger
+    import workers
+
+    level = 'DEBUG' if iargs.v else 'WARNING'
+    logger = Logger(name='benchmark', level=level).get()
+    workers.configure(nWorkers=iargs.n_workers, level=level)
+
+    results = []
+    try:
+        for name in iargs.tasks:
+            for scale in iargs.scales:
+                result = benchmark(name, scale, rucio, es, logger, iargs)
+                report(result)
+                results.append(result)
+    finally:
+        workers.shutdown()
+        rucio.stop()
+        es.stop()
+
+    if iargs.json:
+        with open(iargs.json, "w") as f:
+            json.dump(results, f, indent=2)
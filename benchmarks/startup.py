@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+"""
+Benchmark the cold start time of run.py for a task file.
+
+Each sample starts a fresh interpreter, imports run.py and instantiates the tasks
+in the task file without running them. The median over all samples is compared
+against a stored baseline, and the benchmark fails (non-zero exit code) if it
+exceeds the baseline by more than the given tolerance, or if there is no
+baseline and --update was not given.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COLD_START = """
+import logging
+import run
+from session import Session
+logger = logging.getLogger('benchmark')
+run.loadTasks(Session(tasks={tasks!r}, logger=logger), False, logger)
+"""
+
+
+def sample(tasks):
+    """ Time a single cold start of run.py for task file, <tasks>. """
+    st = time.perf_counter()
+    rtn = subprocess.run(
+        [sys.executable, "-c", COLD_START.format(tasks=tasks)],
+        cwd=os.path.join(ROOT, "src"),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    elapsed = time.perf_counter() - st
+    if rtn.returncode != 0:
+        raise Exception("Cold start failed: {}".format(rtn.stderr.decode("UTF-8")))
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-t', help="tasks file path",
+                        default=os.path.join(ROOT, "etc", "tasks", "stubs.yml"),
+                        type=str)
+    parser.add_argument('-n', help="number of samples", default=10, type=int)
+    parser.add_argument('--baseline', help="baseline file path",
+                        default=os.path.join(ROOT, "benchmarks", "baselines.json"),
+                        type=str)
+    parser.add_argument('--tolerance', help="allowed fractional slowdown relative to the baseline",
+                        default=0.2,
+                        type=float)
+    parser.add_argument('--update', help="store the result as the new baseline?", action='store_true')
+    iargs = parser.parse_args()
+
+    sample(iargs.t)     # warm the filesystem cache and bytecode
+    samples = [sample(iargs.t) for _ in range(iargs.n)]
+    median = statistics.median(samples)
+    print("cold start ({}): median {:.3f}s, min {:.3f}s, max {:.3f}s over {} samples".format(
+        os.path.basename(iargs.t), median, min(samples), max(samples), len(samples)))
+
+    baselines = {}
+    if os.path.exists(iargs.baseline):
+        with open(iargs.baseline) as f:
+            baselines = json.load(f)
+    key = "startup:{}".format(os.path.basename(iargs.t))
+
+    # A missing baseline is an error rather than stored, so that the check can't
+    # pass silently on a fresh checkout. Baselines are machine-specific, so are
+    # stored with --update on the machine the benchmark is run on.
+    #
+    if key not in baselines and not iargs.update:
+        print("FAIL: no baseline for {} in {}, run with --update to store one".format(key, iargs.baseline))
+        sys.exit(1)
+    if iargs.update:
+        baselines[key] = median
+        with open(iargs.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print("stored baseline of {:.3f}s".format(median))
+        sys.exit(0)
+
+    limit = baselines[key] * (1 + iargs.tolerance)
+    if median > limit:
+        print("FAIL: cold start regressed from {:.3f}s to {:.3f}s (limit {:.3f}s)".format(
+            baselines[key], median, limit))
+        sys.exit(1)
+    print("OK: within {:.0f}% of baseline ({:.3f}s)".format(iargs.tolerance * 100, baselines[key]))
@@ -85,12 +85,16 @@ echo
 rucio whoami
 echo
 
-# if task has came in as yaml, do template substitution & pipe the result to a file
+# if task has came in as yaml, pipe it to a .j2 file so that template substitution is done when it is parsed
 if [ -v TASK_FILE_YAML ]
 then
-  echo "$TASK_FILE_YAML" > /tmp/task.yaml
-  j2 /tmp/task.yaml > /tmp/task.yaml.j2
+  echo "$TASK_FILE_YAML" > /tmp/task.yaml.j2
   export TASK_FILE_PATH=/tmp/task.yaml.j2
 fi
 
-python3 src/run.py -v -t "$TASK_FILE_PATH"
+if [ -v TASK_DAEMON ]
+then
+  python3 src/run.py -v --daemon -t $TASK_FILE_PATH
+else
+  python3 src/run.py -v -t "$TASK_FILE_PATH" -n "${TASK_CONCURRENCY:-1}"
+fi
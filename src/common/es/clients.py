@@ -0,0 +1,89 @@
+import os
+import threading
+
+
+class ClientRegistry():
+    """
+    Registry of Elasticsearch clients, one per URI per process, that are shared by
+    all the wrappers (and so all the tasks) in a process rather than constructed
+    for every wrapper.
+
+    Clients are thread-safe. Each keeps a pool of up to <maxsize> connections to
+    its node, which are kept alive between requests if <keepAlive>, so that
+    repeated small requests do not each pay for a new connection (and TLS
+    handshake). Requests time out after <timeout> seconds.
+    """
+
+    def __init__(self, maxsize=10, keepAlive=True, timeout=10):
+        self.maxsize = maxsize
+        self.keepAlive = keepAlive
+        self.timeout = timeout
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def client(self, uri):
+        """ Get the client for URI, <uri>, creating it on first use in this process. """
+        key = (uri, os.getpid())
+        if key not in self._clients:
+            with self._lock:
+                # Connections inherited from a parent process must not be shared
+                # with it, so clients are only used by the process that made them.
+                #
+                self._clients = {k: v for k, v in self._clients.items() if k[1] == os.getpid()}
+                if key not in self._clients:
+                    self._clients[key] = self._create(uri)
+        return self._clients[key]
+
+    def clear(self):
+        """ Close and discard all clients. """
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for (uri, pid), client in clients.items():
+            if pid == os.getpid():
+                client.transport.close()
+
+    def _create(self, uri):
+        from elasticsearch import Elasticsearch
+
+        return Elasticsearch(
+            [uri], maxsize=self.maxsize, timeout=self.timeout,
+            headers=None if self.keepAlive else {"Connection": "close"})
+
+
+_registry = None
+_settings = {"maxsize": 10, "keepAlive": True, "timeout": 10}
+_lock = threading.Lock()
+
+
+def configure(maxsize=None, keepAlive=None, timeout=None):
+    """
+    Set the connection pool size, <maxsize>, keep-alive, <keepAlive>, and timeout,
+    <timeout>, of clients in the process-wide registry, replacing it if it has
+    already been created.
+    """
+    global _registry
+    with _lock:
+        for key, value in (("maxsize", maxsize), ("keepAlive", keepAlive), ("timeout", timeout)):
+            if value is not None:
+                _settings[key] = value
+        _registry = None
+
+
+def getSettings():
+    """ Get the settings of the process-wide registry as a dictionary of kwargs for configure(). """
+    return dict(_settings)
+
+
+def getClientRegistry():
+    """ Get the process-wide client registry, creating it on first use. """
+    global _registry
+    if _registry is None:
+        with _lock:
+            if _registry is None:
+                _registry = ClientRegistry(**_settings)
+    return _registry
+
+
+def getClient(uri):
+    """ Get the process-wide client for URI, <uri>. """
+    return getClientRegistry().client(uri)
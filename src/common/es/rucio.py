@@ -1,10 +1,11 @@
 from datetime import datetime
 import json
-import numpy as np
 import uuid
 
 from common.es.wrappers import Wrappers
+from common.rucio.helpers import ReplicaResolver
 from common.rucio.wrappers import RucioWrappersAPI
+from metrics import getMetrics
 
 
 class Rucio(Wrappers):
@@ -13,94 +14,167 @@ class Rucio(Wrappers):
         ElasticSearch index.
     """
 
-    def pushRulesForDID(self, did, index, baseEntry={}):
+    def pushRulesForDID(self, did, index, baseEntry={}, replicas=None):
         """
         Create documents in the database corresponding to replication rules for
         a given DID <did> and add to index <index>. <baseEntry> key/value
         pairs will be appended to all entries prior to submission.
+
+        Replica endpoints are looked up with <replicas>, a ReplicaResolver that
+        may already have resolved this DID along with others.
         """
         rucio = RucioWrappersAPI()
-        rules = rucio.listReplicationRules(did) if did is not None else []
+        if replicas is None:
+            replicas = ReplicaResolver()
+        rules = rucio.iterReplicationRules(did) if did is not None else []
         entries = []
-        if len(rules) > 0:              # if this DID has replication rules ...
-            for rule in rules:
-                entry = {
-                    '@timestamp': int(datetime.now().strftime("%s"))*1000,
-                    'rule_id': rule['id'],
-                    'scope': rule['scope'],
-                    'name': rule['name'],
-                    'from_rse': rule['source_replica_expression'],
-                    'to_rse': rule['rse_expression'],
-                    'created_at': rule['created_at'],
-                    'updated_at': rule['updated_at'],
-                    'expires_at': rule['expires_at'],
-                    'state': rule['state'],
-                    'error': rule['error'],
-                }
-
-                # Append protocol and endpoint details to entry using result from
-                # a separate call to list file replicas for this particular DID.
-                #
-                try:
-                    replica = rucio.listFileReplicas(did, rse=entry['to_rse'])
-                    protocol = replica[0]['rses'][entry['to_rse']][0].split(':')[0]
-                    endpoint = replica[0]['rses'][entry['to_rse']][0]
-                except Exception:    # if the rule doesn't exist
-                    endpoint = None
-                    protocol = None
-                entry['endpoint'] = endpoint
-                entry['protocol'] = protocol
-
-                # FTS attribute placeholders
-                entry['fts_throughput'] = None
-
-                entries.append(entry)
-        else:   # otherwise, create entry with timestamp and "spoofed" rule_id
+        for rule in rules:              # if this DID has replication rules ...
+            entry = {
+                '@timestamp': int(datetime.now().strftime("%s"))*1000,
+                'rule_id': rule['id'],
+                'scope': rule['scope'],
+                'name': rule['name'],
+                'from_rse': rule['source_replica_expression'],
+                'to_rse': rule['rse_expression'],
+                'created_at': rule['created_at'],
+                'updated_at': rule['updated_at'],
+                'expires_at': rule['expires_at'],
+                'state': rule['state'],
+                'error': rule['error'],
+            }
+
+            # Append protocol and endpoint details to entry using the replicas
+            # listed for this DID.
+            #
+            entry['endpoint'], entry['protocol'] = replicas.get(did, entry['to_rse'])
+
+            # FTS attribute placeholders
+            entry['fts_throughput'] = None
+
+            entries.append(entry)
+
+        if not entries:     # otherwise, create entry with timestamp and "spoofed" rule_id
             now = datetime.now()
             entries.append({
                 '@timestamp': int(now.strftime("%s"))*1000,
                 'rule_id': str(uuid.uuid4())
             })
-        for entry in entries:
-            # The <fullEntry> pushed to the database is the concatenation of the two
-            # dictionaries, <entry>, generated as above, and 'baseEntry', described
-            # in the function definition.
-            #
-            fullEntry = {**entry, **baseEntry}
-            
-            # Add boolean flags for state. This makes it easy to use bucket
-            # aggregations in ES queries.
-            #
-            fullEntry['is_done'] = 1 if fullEntry.get('state') == 'OK' else 0
-            fullEntry['is_replicating'] = 1 if fullEntry.get('state') \
-                == 'REPLICATING' else 0
-            fullEntry['is_stuck'] = 1 if fullEntry.get('state') \
-                == 'STUCK' else 0
-            fullEntry['is_upload_failed'] = 1 if fullEntry.get('state') \
-                == 'UPLOAD-FAILED' else 0
-            fullEntry['is_upload_successful'] = 1 if fullEntry.get('state') \
-                == 'UPLOAD-SUCCESSFUL' else 0
+
+        # Send the documents for all of the rules in one bulk request.
+        #
+        with self.bulk():
+            for entry in entries:
+                # The <fullEntry> pushed to the database is the concatenation of the two
+                # dictionaries, <entry>, generated as above, and 'baseEntry', described
+                # in the function definition.
+                #
+                fullEntry = {**entry, **baseEntry}
+
+                # Add boolean flags for state. This makes it easy to use bucket
+                # aggregations in ES queries.
+                #
+                fullEntry['is_done'] = 1 if fullEntry.get('state') == 'OK' else 0
+                fullEntry['is_replicating'] = 1 if fullEntry.get('state') \
+                    == 'REPLICATING' else 0
+                fullEntry['is_stuck'] = 1 if fullEntry.get('state') \
+                    == 'STUCK' else 0
+                fullEntry['is_upload_failed'] = 1 if fullEntry.get('state') \
+                    == 'UPLOAD-FAILED' else 0
+                fullEntry['is_upload_successful'] = 1 if fullEntry.get('state') \
+                    == 'UPLOAD-SUCCESSFUL' else 0
+                try:
+                    self._index(
+                        index=index, documentID=fullEntry['rule_id'], body=fullEntry)
+                except Exception as e:
+                    self.logger.warning("Failed to push rule: {}".format(e))
+                    continue
+
+    def updateRulesWithDIDs(self, ruleIDs, index, ftsEndpoint, extraEntries={}, concurrency=100, previous=None):
+        """
+        Update documents in the database corresponding to rules with IDs,
+        <ruleIDs>, in index <index>, listing the replicas of all of their DIDs at
+        once and sending the updates in bulk. <extraEntries> key/value pairs will
+        be appended to all entries prior to submission.
+
+        If aiohttp is installed, rule information is requested for up to
+        <concurrency> rules at once.
+
+        The current documents of the rules, <previous>, keyed by rule ID, can be
+        given if already fetched (at least their state and updated_at fields);
+        otherwise those of rules that are now OK are fetched at once.
+        """
+        self.logger.debug("Getting rule information...")
+        results = self._ruleInfo(ruleIDs, concurrency)
+        rules = {}
+        for ruleID, result in zip(ruleIDs, results):
+            if isinstance(result, Exception):
+                self.logger.warning("Error getting rule information, " +
+                                    "skipping: {}".format(repr(result)))
+                continue
+            rules[ruleID] = result
+
+        replicas = ReplicaResolver()
+        try:
+            replicas.resolve(["{}:{}".format(rule['scope'], rule['name']) for rule in rules.values()])
+        except Exception as e:
+            self.logger.warning("Error listing replicas: {}".format(repr(e)))
+        if previous is None:
+            previous = self._mget(
+                index, [ruleID for ruleID, rule in rules.items() if rule['state'] == 'OK'],
+                source=["state", "updated_at"])
+        with self.bulk():
+            for ruleID, rule in rules.items():
+                self.updateRuleWithDID(
+                    ruleID, index, ftsEndpoint, extraEntries=extraEntries, rule=rule, replicas=replicas,
+                    previous=previous.get(ruleID, {}))
+
+    @staticmethod
+    def _ruleInfo(ruleIDs, concurrency):
+        """
+        Get information for each rule in <ruleIDs>, or the exception raised getting
+        it, concurrently if aiohttp is installed.
+        """
+        # aiohttp is imported here rather than with this module, as most tasks
+        # that use this module don't need it.
+        #
+        try:
+            from common.rucio import aio
+        except ImportError:     # aiohttp is not installed
+            aio = None
+
+        if aio is not None:
+            return aio.gather([("ruleInfo", ruleID) for ruleID in ruleIDs], concurrency=concurrency)
+        rucio = RucioWrappersAPI()
+        results = []
+        for ruleID in ruleIDs:
             try:
-                self._index(
-                    index=index, documentID=fullEntry['rule_id'], body=fullEntry)
+                results.append(rucio.ruleInfo(ruleID))
             except Exception as e:
-                self.logger.warning("Failed to push rule: {}".format(e))
-                continue
+                results.append(e)
+        return results
 
-    def updateRuleWithDID(self, ruleID, index, ftsEndpoint, extraEntries={}):
+    def updateRuleWithDID(self, ruleID, index, ftsEndpoint, extraEntries={}, rule=None, replicas=None,
+                          previous=None):
         """
         Update documents in the database corresponding to a rule with a given
         DID <ruleID> in index <index>. <extraEntries> key/value pairs will
         be appended to all entries prior to submission.
+
+        The rule's information, <rule>, a ReplicaResolver, <replicas>, and the
+        rule's current document, <previous>, can be given if already fetched for
+        a batch of rules.
         """
         rucio = RucioWrappersAPI()
-        try:
-            self.logger.debug("Getting rule information...")
-            rule = rucio.ruleInfo(ruleID)
-        except Exception as e:
-            self.logger.warning("Error getting rule information, " +
-                                "skipping: {}".format(repr(e)))
-            return
+        if rule is None:
+            try:
+                self.logger.debug("Getting rule information...")
+                rule = rucio.ruleInfo(ruleID)
+            except Exception as e:
+                self.logger.warning("Error getting rule information, " +
+                                    "skipping: {}".format(repr(e)))
+                return
+        if replicas is None:
+            replicas = ReplicaResolver()
 
         # Form JSON to inject as update body.
         #
@@ -126,11 +200,13 @@ class Rucio(Wrappers):
         # of the rucio rules evalulator.
         #
         if fullEntry['state'] == 'OK':
-            rtn = self._get(index, ruleID)
-            if rtn['_source']['state'] == 'REPLICATING':
+            if previous is None:
+                rtn = self._get(index, ruleID)
+                previous = rtn['_source'] if rtn else {}
+            if previous.get('state') == 'REPLICATING':
                 doneAt = fullEntry['updated_at']
                 startedReplicationAt = datetime.strptime(
-                    rtn['_source']['updated_at'], "%Y-%m-%dT%H:%M:%S")
+                    previous['updated_at'], "%Y-%m-%dT%H:%M:%S")
                 fullEntry['replication_duration'] = (
                     doneAt-startedReplicationAt).total_seconds()
 
@@ -142,18 +218,21 @@ class Rucio(Wrappers):
                     self.logger.info("Attempting to get throughput from FTS...")
 
                     import fts3.rest.client.easy as fts3
+                    import numpy as np
 
-                    DIDs = rucio.listContent(scope=entry['scope'], name=entry['name'])
-                    if DIDs:    # container, so recurse into it.
-                        while True:
-                            startIterationNumberOfDIDs = len(DIDs)
-                            for DID in DIDs:
-                                recursedDIDs = rucio.listContent(scope=DID['scope'], name=DID['name'])
-                                if recursedDIDs:
-                                    DIDs = DIDs + recursedDIDs
-                            if startIterationNumberOfDIDs == len(DIDs):     # i.e. all DIDs are files.
-                                break
-                    else:
+                    # Recurse into collections to get the files they contain (or the
+                    # DID itself if it has no content, i.e. it is a file).
+                    #
+                    DIDs = []
+                    collections = [{'scope': entry['scope'], 'name': entry['name']}]
+                    while collections:
+                        collection = collections.pop()
+                        for DID in rucio.iterContent(scope=collection['scope'], name=collection['name']):
+                            if DID.get('type', '').upper() == 'FILE':
+                                DIDs.append(DID)
+                            else:
+                                collections.append(DID)
+                    if not DIDs:
                         DIDs = [{
                             'scope': entry['scope'],
                             'name': entry['name']
@@ -198,30 +277,36 @@ class Rucio(Wrappers):
         fullEntry['is_replicating'] = 1 if fullEntry['state'] == 'REPLICATING' else 0
         fullEntry['is_stuck'] = 1 if fullEntry['state'] == 'STUCK' else 0
 
-        # Append protocol and endpoint details to entry using result from
-        # a separate call to list file replicas for this particular DID.
+        # Append protocol and endpoint details to entry using the replicas
+        # listed for this DID.
         #
         did = "{}:{}".format(fullEntry['scope'], fullEntry['name'])
-        try:
-            replica = rucio.listFileReplicas(did, rse=fullEntry['to_rse'])
-            protocol = replica[0]['rses'][fullEntry['to_rse']][0].split(':')[0]
-            endpoint = replica[0]['rses'][fullEntry['to_rse']][0]
-        except Exception:    # if the rule doesn't exist
-            endpoint = None
-            protocol = None
-        fullEntry['endpoint'] = endpoint
-        fullEntry['protocol'] = protocol
+        fullEntry['endpoint'], fullEntry['protocol'] = replicas.get(did, fullEntry['to_rse'])
 
         self.logger.info("Updating rule ({})...".format(ruleID))
         self._update(index=index, documentID=ruleID, body={"doc": fullEntry})
         self.logger.info("Update complete")
 
     def _update(self, index, documentID, body):
-        """ Update an existing document with id, <documentID>, in index, <index>. """
+        """
+        Update an existing document with id, <documentID>, in index, <index>, or add
+        the update to the bulk request buffer if within bulk().
+        """
+        if self._bulkIndexer is not None:
+            self._bulkIndexer.add("update", index, documentID, body)
+            return
         try:
             self.es.update(index=index, id=documentID, body=body)
+            getMetrics().esWrites.labels(operation="update", outcome="ok").inc()
         except Exception as e:
+            getMetrics().esWrites.labels(operation="update", outcome="error").inc()
             self.logger.warning("Failed to update database: {}".format(e))
 
     def search(self, index, body, maxRows=10000):
         return self._search(index, body, maxRows)
+
+    def scan(self, index, body, source=None, maxRows=None):
+        return self._scan(index, body, source=source, maxRows=maxRows)
+
+    def count(self, index, body):
+        return self._count(index, body)
@@ -1,14 +1,114 @@
-from elasticsearch import Elasticsearch
+import contextlib
+import gzip
+import threading
+import time
+
+from common.es.clients import getClient
+from metrics import getMetrics
+from utility import chunk
+
+
+class BulkIndexer():
+    """
+    Buffer of index and update actions that are sent to an Elasticsearch client,
+    <es>, in gzip compressed bulk requests.
+
+    The buffer is flushed when it holds <maxActions> actions or <maxBytes> bytes
+    (before compression), when an action is added more than <flushInterval>
+    seconds after the first action in the buffer, and when flush() is called.
+    Actions that fail are logged and counted per document.
+    """
+
+    def __init__(self, es, logger, maxActions=500, maxBytes=5*1024*1024, flushInterval=5):
+        self.es = es
+        self.logger = logger
+        self.maxActions = maxActions
+        self.maxBytes = maxBytes
+        self.flushInterval = flushInterval
+        self._lines = []
+        self._actions = []
+        self._nBytes = 0
+        self._firstAddedAt = None
+        self._lock = threading.RLock()
+
+    def add(self, action, index, documentID, body):
+        """ Add an action, <action> ("index" or "update"), for document, <documentID>, in index, <index>. """
+        serializer = self.es.transport.serializer
+        lines = [serializer.dumps({action: {"_index": index, "_id": documentID}}), serializer.dumps(body)]
+        with self._lock:
+            if self._firstAddedAt is None:
+                self._firstAddedAt = time.monotonic()
+            self._lines.extend(lines)
+            self._actions.append((action, documentID))
+            self._nBytes += sum(len(line) + 1 for line in lines)
+            if len(self._actions) >= self.maxActions or self._nBytes >= self.maxBytes or \
+                    time.monotonic() - self._firstAddedAt >= self.flushInterval:
+                self.flush()
+
+    def flush(self):
+        """
+        Send the buffered actions, returning a list of (document ID, error) tuples
+        for those that failed.
+        """
+        with self._lock:
+            if not self._actions:
+                return []
+            payload = gzip.compress(("\n".join(self._lines) + "\n").encode("UTF-8"))
+            actions = self._actions
+            self._lines, self._actions, self._nBytes, self._firstAddedAt = [], [], 0, None
+
+            metrics = getMetrics()
+            try:
+                res = self.es.transport.perform_request(
+                    "POST", "/_bulk", body=payload,
+                    headers={"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"})
+            except Exception as e:
+                for action, documentID in actions:
+                    metrics.esWrites.labels(operation=action, outcome="error").inc()
+                self.logger.critical("Failed to send bulk request of {} actions: {}".format(len(actions), e))
+                return [(documentID, e) for action, documentID in actions]
+
+            failed = []
+            for (action, documentID), item in zip(actions, res["items"]):
+                result = item.get(action, {})
+                if "error" in result:
+                    metrics.esWrites.labels(operation=action, outcome="error").inc()
+                    self.logger.warning("Failed to {} document {}: {}".format(action, documentID, result["error"]))
+                    failed.append((documentID, result["error"]))
+                else:
+                    metrics.esWrites.labels(operation=action, outcome="ok").inc()
+            return failed
 
 
 class Wrappers():
     """
     Common functionality for interaction with ElasticSearch backends.
+
+    Wrappers for the same URI share the process's client for it (see
+    common.es.clients), so they are cheap to construct.
     """
 
     def __init__(self, uri, logger):
-        self.es = Elasticsearch([uri])
+        self.es = getClient(uri)
         self.logger = logger
+        self._bulkIndexer = None
+
+    @contextlib.contextmanager
+    def bulk(self, **kwargs):
+        """
+        Send the documents indexed or updated via this instance in bulk requests
+        for the duration of the context, flushing any that remain on exit. See
+        BulkIndexer for <kwargs>. Within an enclosing bulk(), its buffer is used.
+        """
+        if self._bulkIndexer is not None:
+            yield self._bulkIndexer
+            return
+        self._bulkIndexer = BulkIndexer(self.es, self.logger, **kwargs)
+        try:
+            yield self._bulkIndexer
+        finally:
+            bulkIndexer, self._bulkIndexer = self._bulkIndexer, None
+            bulkIndexer.flush()
 
     def _get(self, index, documentID):
         """ Get a document from index, <index>, with document ID, <documentID>. """
@@ -17,14 +117,131 @@ class Wrappers():
         except Exception as e:
             self.logger.warning("Failed to get document: {}".format(e))
 
+    def _mget(self, index, documentIDs, source=None, chunkSize=1000):
+        """
+        Get documents with IDs, <documentIDs>, from index, <index>, in requests of
+        up to <chunkSize> documents, returning the <source> fields (all if None) of
+        each document found by ID.
+        """
+        sources = {}
+        for documentIDsChunk in chunk(documentIDs, chunkSize):
+            try:
+                res = self.es.mget(body={"ids": documentIDsChunk}, index=index, _source_includes=source)
+            except Exception as e:
+                self.logger.warning("Failed to get documents: {}".format(e))
+                continue
+            for doc in res["docs"]:
+                if doc.get("found"):
+                    sources[doc["_id"]] = doc["_source"]
+        return sources
+
     def _index(self, index, documentID, body):
-        """ Create new document with id, <documentID>, in index, <index>. """
+        """
+        Create new document with id, <documentID>, in index, <index>, or add it to
+        the bulk request buffer if within bulk().
+        """
+        if self._bulkIndexer is not None:
+            self._bulkIndexer.add("index", index, documentID, body)
+            return
         try:
             res = self.es.index(index=index, id=documentID, body=body)
+            getMetrics().esWrites.labels(operation="index", outcome="ok").inc()
         except Exception as e:
+            getMetrics().esWrites.labels(operation="index", outcome="error").inc()
             self.logger.critical("Failed to index: {}".format(e))
             return False
 
+    def _count(self, index, body):
+        """ Count the documents in index, <index>, matching the query in <body>. """
+        try:
+            return self.es.count(index=index, body={"query": body["query"]} if "query" in body else {})["count"]
+        except Exception as e:
+            self.logger.critical("Failed to count documents: {}".format(e))
+            exit()
+
+    def _scan(self, index, body, source=None, pageSize=1000, keepAlive="1m", maxRows=None):
+        """
+        Search an index, <index>, yielding every matching hit (up to <maxRows> if
+        not None) with only the <source> fields of each document if not None.
+
+        Hits are fetched <pageSize> at a time against a point in time with
+        search_after, so that the number of hits is not capped by the index's
+        maximum result window and only a page is held in memory at once. Servers
+        that do not support points in time, or sorting by shard document within
+        them, are scrolled instead.
+        """
+        body = {key: value for key, value in body.items() if key not in ("size", "from", "sort")}
+        if source is not None:
+            body["_source"] = source
+        try:
+            pitID = self.es.transport.perform_request(
+                "POST", "/{}/_pit".format(index), params={"keep_alive": keepAlive})["id"]
+        except Exception as e:
+            self.logger.debug("Failed to open point in time, scrolling instead: {}".format(e))
+            pitID = None
+        if pitID is not None and (yield from self._searchAfter(pitID, body, pageSize, keepAlive, maxRows)):
+            return
+        yield from self._scroll(index, body, pageSize, keepAlive, maxRows)
+
+    def _searchAfter(self, pitID, body, pageSize, keepAlive, maxRows):
+        """
+        Page through the hits of a search against a point in time, <pitID>, as
+        _scan, closing the point in time once done.
+
+        Returns False, having yielded nothing, if the first page is rejected, as
+        sorting by shard document needs a later server version than points in time
+        themselves. Returns True otherwise.
+        """
+        nRows = 0
+        searchAfter = None
+        try:
+            while maxRows is None or nRows < maxRows:
+                size = pageSize if maxRows is None else min(pageSize, maxRows - nRows)
+                page = {
+                    **body,
+                    "size": size,
+                    "pit": {"id": pitID, "keep_alive": keepAlive},
+                    "sort": [{"_shard_doc": "asc"}]
+                }
+                if searchAfter is not None:
+                    page["search_after"] = searchAfter
+                try:
+                    res = self.es.transport.perform_request("POST", "/_search", body=page)
+                except Exception as e:
+                    if searchAfter is None:
+                        self.logger.debug("Failed to search point in time, scrolling instead: {}".format(e))
+                        return False
+                    self.logger.critical("Failed to complete search: {}".format(e))
+                    exit()
+                pitID = res.get("pit_id", pitID)
+                hits = res["hits"]["hits"]
+                yield from hits
+                nRows += len(hits)
+                if len(hits) < size:
+                    break
+                searchAfter = hits[-1]["sort"]
+        finally:
+            try:
+                self.es.transport.perform_request("DELETE", "/_pit", body={"id": pitID})
+            except Exception as e:
+                self.logger.warning("Failed to close point in time: {}".format(e))
+        return True
+
+    def _scroll(self, index, body, pageSize, keepAlive, maxRows):
+        """ Scroll through the hits of a search of index, <index>, as _scan. """
+        from elasticsearch.helpers import scan
+
+        try:
+            hits = scan(self.es, query=body, index=index, size=pageSize, scroll=keepAlive)
+            for nRows, hit in enumerate(hits):
+                if maxRows is not None and nRows >= maxRows:
+                    hits.close()
+                    break
+                yield hit
+        except Exception as e:
+            self.logger.critical("Failed to complete search: {}".format(e))
+            exit()
+
     def _search(self, index, body, maxRows):
         """ Search an index, <index>. """
         try:
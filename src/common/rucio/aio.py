@@ -0,0 +1,169 @@
+import asyncio
+import json
+import ssl
+import time
+from urllib.parse import quote_plus
+
+import aiohttp
+from rucio.client.client import Client
+from rucio.common.utils import parse_response
+
+from common.rucio.clients import pooledClient
+from common.rucio.limiter import OVERLOAD_ERRORS, AsyncLimiter, backoff, getLimiter, isOverload
+from metrics import getMetrics
+
+
+class AsyncClient():
+    """
+    Asyncio client for the read APIs of a Rucio server used by ESRucio and
+    SyncESDatabase: rule information, replicas, content and request history.
+
+    The host, account, VO, certificate settings and token are taken from a client
+    checked out of the process's Rucio client pool for the duration of the
+    session, so that configuration and authentication are shared with the
+    synchronous wrappers. If the server rejects the token, the pooled client
+    re-authenticates and the request is retried once.
+
+    Use as an async context manager. Requests are made through the process-wide
+    adaptive limiter, "aio-<concurrency>", which allows up to <concurrency> requests
+    in flight at once while the server stays healthy. Requests that fail with an overload error
+    are retried up to <retries> times with a jittered exponential backoff.
+    """
+
+    def __init__(self, concurrency=100, retries=3):
+        self.concurrency = concurrency
+        self.retries = retries
+        self._client = None
+        self._pooled = None
+        self._limiter = None
+        self._session = None
+        self._tokenLock = None
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        self._pooled = pooledClient(Client)
+        self._client = await loop.run_in_executor(None, self._pooled.__enter__)
+        self._limiter = getLimiter(
+            "aio-{}".format(self.concurrency), AsyncLimiter, errors=OVERLOAD_ERRORS + (aiohttp.ClientConnectionError,),
+            initial=self.concurrency, maximum=self.concurrency)
+        self._tokenLock = asyncio.Lock()
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency, ssl=self._ssl()),
+            timeout=aiohttp.ClientTimeout(total=self._client.timeout))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+        self._pooled.__exit__(*exc)
+
+    def _ssl(self):
+        """ Get the SSL setting for the session from the CA certificate setting of the pooled client. """
+        caCert = self._client.ca_cert
+        if not caCert:
+            return False
+        if caCert is True:
+            return None
+        return ssl.create_default_context(cafile=caCert)
+
+    def _headers(self):
+        headers = {
+            'X-Rucio-Auth-Token': self._client.auth_token,
+            'X-Rucio-VO': self._client.vo,
+            'User-Agent': self._client.user_agent,
+            'X-Rucio-Script': self._client.script_id
+        }
+        if self._client.account is not None:
+            headers['X-Rucio-Account'] = self._client.account
+        return headers
+
+    async def _reauthenticate(self, token):
+        """ Get a new token if the current token is still <token>, the one the server rejected. """
+        async with self._tokenLock:
+            if self._client.auth_token == token:
+                # The pooled client gets a new token when the server rejects the
+                # one it has, i.e. on its next request.
+                #
+                await asyncio.get_running_loop().run_in_executor(None, self._client.whoami)
+
+    async def _request(self, name, method, path, params=None, data=None, headers={}):
+        """
+        Make a request, <name>, returning the objects in the (JSON or JSON stream)
+        response, or raising the corresponding Rucio exception.
+        """
+        for attempt in range(1, self.retries + 2):
+            try:
+                return await self._limiter.call(name, self._send, name, method, path, params, data, headers)
+            except Exception as e:
+                if attempt > self.retries or not isOverload(e, self._limiter.errors):
+                    raise
+            getMetrics().limiterRetries.labels(limiter=self._limiter.name, method=name).inc()
+            await asyncio.sleep(backoff(attempt))
+
+    async def _send(self, name, method, path, params, data, headers):
+        """ Make a single attempt at request, <name>. """
+        st = time.perf_counter()
+        outcome = "error"
+        try:
+            for retry in range(2):
+                requestHeaders = {**self._headers(), **headers}
+                async with self._session.request(
+                        method, self._client.host + path, params=params, data=data,
+                        headers=requestHeaders) as response:
+                    body = await response.read()
+                    if response.status == 401 and retry == 0:
+                        await self._reauthenticate(requestHeaders['X-Rucio-Auth-Token'])
+                        continue
+                    if response.status not in (200, 201):
+                        excCls, excMsg = self._client._get_exception(
+                            headers=response.headers, status_code=response.status, data=body)
+                        raise excCls(excMsg)
+                    outcome = "ok"
+                    if response.headers.get('content-type') == 'application/x-json-stream':
+                        return [parse_response(line) for line in body.splitlines() if line.strip()]
+                    return [parse_response(body)] if body else []
+        finally:
+            metrics = getMetrics()
+            metrics.rucioCalls.labels(backend="aio", method=name, outcome=outcome).inc()
+            metrics.rucioCallDuration.labels(backend="aio", method=name).observe(time.perf_counter() - st)
+
+    async def ruleInfo(self, ruleID):
+        """ Get replication rule information for rule id, <ruleID>. """
+        return (await self._request("ruleInfo", "GET", "/rules/{}".format(ruleID)))[0]
+
+    async def listFileReplicas(self, dids, rse=None):
+        """ List file replicas for DIDs, <dids>, at RSEs matching <rse> if not None. """
+        payload = {
+            'dids': [{'scope': did.split(":")[0], 'name': did.split(":")[1]} for did in dids],
+            'ignore_availability': True,
+            'all_states': False,
+            'rse_expression': rse,
+            'resolve_archives': True
+        }
+        return await self._request(
+            "listFileReplicas", "POST", "/replicas/list", data=json.dumps(payload),
+            headers={'Accept': 'application/x-json-stream'})
+
+    async def listContent(self, scope, name):
+        """ List content of DID, <scope>:<name>. """
+        return await self._request(
+            "listContent", "GET", "/dids/{}/{}/dids".format(quote_plus(scope), quote_plus(name)))
+
+    async def getRequestHistory(self, did, rse):
+        """ Get the latest request in the history for a DID, <did>, to rse, <rse>. """
+        tokens = did.split(":")
+        return (await self._request(
+            "getRequestHistory", "GET",
+            "/requests/history/{}/{}/{}".format(quote_plus(tokens[0]), quote_plus(tokens[1]), rse)))[0]
+
+
+def gather(calls, concurrency=100):
+    """
+    Make calls, <calls>, each a tuple of the name of an AsyncClient method and its
+    arguments, concurrently on one event loop, returning the result of each (or
+    the exception it raised) in the same order.
+    """
+    async def run():
+        async with AsyncClient(concurrency=concurrency) as client:
+            return await asyncio.gather(
+                *(getattr(client, name)(*args) for name, *args in calls), return_exceptions=True)
+    return asyncio.run(run())
@@ -0,0 +1,150 @@
+import copy
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+
+from metrics import getMetrics
+
+
+class TTLCache():
+    """
+    Cache of the results of read-mostly Rucio calls (e.g. RSEs, their protocols
+    and attributes, and the RSEs an expression resolves to), each kept for <ttl>
+    seconds after it was fetched.
+
+    If <path> is given, results are also written to that file as they are fetched
+    and read from it when the cache is created, so that they are kept between runs
+    and shared with worker processes. Results must be JSON serialisable.
+    """
+
+    def __init__(self, ttl=300, path=None):
+        self.ttl = ttl
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        if path is not None:
+            self._load()
+
+    def get(self, key, fetch):
+        """ Get the result for key, <key>, calling <fetch> to get it if it is not cached or has expired. """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.time():
+            return copy.deepcopy(entry[1])
+        value = fetch()
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+        if self.path is not None:
+            self._save()
+        return copy.deepcopy(value)
+
+    def invalidate(self, method=None):
+        """ Discard the cached results for calls to <method>, or all results if None. """
+        with self._lock:
+            if method is None:
+                self._entries = {}
+            else:
+                self._entries = {
+                    key: entry for key, entry in self._entries.items() if json.loads(key)[0] != method
+                }
+        if self.path is not None:
+            self._save()
+
+    def _load(self):
+        """ Read unexpired results from the cache file, if any. """
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        with self._lock:
+            for key, (expiresAt, value) in entries.items():
+                if expiresAt > now:
+                    self._entries.setdefault(key, (expiresAt, value))
+
+    def _save(self):
+        """ Write the results to the cache file, replacing it atomically. """
+        with self._lock:
+            try:
+                payload = json.dumps(self._entries)
+            except TypeError:
+                return
+        try:
+            fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), prefix=".rucio-cache-")
+            with os.fdopen(fd, "w") as f:
+                f.write(payload)
+            os.replace(tmpPath, self.path)
+        except OSError:
+            pass
+
+
+_cache = None
+_settings = {"ttl": 300, "path": None}
+_lock = threading.Lock()
+
+
+def configure(ttl=None, path=None):
+    """
+    Set the TTL, <ttl>, and file, <path>, of the process-wide cache, replacing it if
+    it has already been created.
+    """
+    global _cache
+    with _lock:
+        if ttl is not None:
+            _settings["ttl"] = ttl
+        if path is not None:
+            _settings["path"] = path
+        _cache = None
+
+
+def getSettings():
+    """ Get the settings of the process-wide cache as a dictionary of kwargs for configure(). """
+    return dict(_settings)
+
+
+def getCache():
+    """ Get the process-wide cache, creating it on first use. """
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = TTLCache(**_settings)
+    return _cache
+
+
+def invalidate(method=None):
+    """ Discard the cached results for calls to wrapper method, <method>, or all results if None. """
+    getCache().invalidate(method)
+
+
+def cacheRucioCalls(methods):
+    """
+    Class decorator that serves calls to each of the static methods in <methods> of
+    a Rucio wrappers class from the process-wide cache, keyed by method and
+    arguments. Calls that raise are not cached.
+    """
+    def cache(method, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = json.dumps([method, args, kwargs], sort_keys=True, default=str)
+            fetched = []
+
+            def fetch():
+                fetched.append(True)
+                return fn(*args, **kwargs)
+            value = getCache().get(key, fetch)
+            getMetrics().rucioCacheLookups.labels(method=method, outcome="miss" if fetched else "hit").inc()
+            return value
+        return wrapper
+
+    def decorator(cls):
+        for method in methods:
+            attr = vars(cls).get(method)
+            if isinstance(attr, staticmethod):
+                setattr(cls, method, staticmethod(cache(method, attr.__func__)))
+        return cls
+    return decorator
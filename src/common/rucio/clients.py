@@ -0,0 +1,94 @@
+import contextlib
+import os
+import threading
+import time
+
+from metrics import getMetrics
+
+
+class ClientPool():
+    """
+    Pool of Rucio clients, keyed by client class and account, that are reused
+    across calls rather than constructed for every call.
+
+    A client is only used by one thread at a time: it is checked out of the pool
+    for the duration of a call and checked back in afterwards, keeping its HTTP
+    session (and so its connections) alive for the next call. Clients whose token
+    is known to be close to expiry are discarded rather than reused, so that a new
+    client refreshes the token; otherwise clients re-authenticate themselves when
+    the server reports their token has expired.
+    """
+
+    def __init__(self, refreshBefore=300):
+        self.refreshBefore = refreshBefore
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    @contextlib.contextmanager
+    def client(self, cls, account=None):
+        """
+        Check out a client of class, <cls>, for account, <account> (the account in
+        the Rucio configuration if None), for the duration of the context.
+        """
+        client = self._checkout(cls, account)
+        try:
+            yield client
+        finally:
+            self._checkin(cls, account, client)
+
+    def clear(self):
+        """ Discard all idle clients. """
+        with self._lock:
+            self._idle = {}
+
+    def _checkout(self, cls, account):
+        key = (cls, account)
+        with self._lock:
+            # Connections inherited from a parent process must not be shared with
+            # it, so start again with an empty pool after a fork.
+            #
+            if os.getpid() != self._pid:
+                self._idle = {}
+                self._pid = os.getpid()
+            idle = self._idle.setdefault(key, [])
+            reason = "new"
+            while idle:
+                client = idle.pop()
+                if not self._isExpiring(client):
+                    getMetrics().rucioClientReuses.labels(client=cls.__name__).inc()
+                    return client
+                reason = "expiring"
+        getMetrics().rucioClientConstructions.labels(client=cls.__name__, reason=reason).inc()
+        if account is None:
+            return cls()
+        return cls(account=account)
+
+    def _checkin(self, cls, account, client):
+        with self._lock:
+            if os.getpid() == self._pid:
+                self._idle.setdefault((cls, account), []).append(client)
+
+    def _isExpiring(self, client):
+        """ Is the token of client, <client>, known to expire within <refreshBefore> seconds? """
+        expiresAt = getattr(client, 'token_exp_epoch', None)
+        return expiresAt is not None and time.time() > expiresAt - self.refreshBefore
+
+
+_pool = None
+_lock = threading.Lock()
+
+
+def getClientPool():
+    """ Get the process-wide Rucio client pool, creating it on first use. """
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _pool = ClientPool()
+    return _pool
+
+
+def pooledClient(cls, account=None):
+    """ Check out a client of class, <cls>, for account, <account>, from the process-wide pool. """
+    return getClientPool().client(cls, account)
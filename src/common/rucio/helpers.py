@@ -1,8 +1,21 @@
 from datetime import datetime
 import logging
+import threading
+import time
 
+from rucio.common.exception import DataIdentifierAlreadyExists, DataIdentifierNotFound, DuplicateContent
+
+from common.rucio import cache
 from common.rucio.wrappers import RucioWrappersAPI
 
+# Collections that this process has created or found to exist, with the times at
+# which they need checking again. Collections are confirmed for as long as other
+# read-mostly Rucio results are cached, as they may be erased or expire outside
+# this process.
+#
+_confirmedCollections = {}
+_confirmedCollectionsLock = threading.Lock()
+
 
 def createCollection(loggerName, scope, name=None, collectionType="DATASET"):
     """ Create a new collection in scope, <scope>. """
@@ -22,14 +35,23 @@ def createCollection(loggerName, scope, name=None, collectionType="DATASET"):
     #
     did = "{}:{}".format(scope, name)
 
+    # Collections recently known to exist by this process don't need checking
+    # again.
+    #
+    with _confirmedCollectionsLock:
+        if _confirmedCollections.get(did, 0) > time.time():
+            logger.debug("DID {} already exists. Skipping.".format(did))
+            return did
+
     logger.info("Checking to see if DID ({}) already exists...".format(did))
     try:
         # Check to see if DID already exists, and if not, add.
-        dids = rucio.listDIDs(scope=scope)
-        if did not in dids:
+        if rucio.getDID(did) is None:
             logger.debug("Adding DID {} of type {}".format(did, collectionType))
             try:
                 rucio.addDID(did, collectionType)
+            except DataIdentifierAlreadyExists:     # added since it was checked for
+                logger.debug("DID already exists. Skipping.")
             except Exception as e:
                 logger.critical("Error adding did.")
                 logger.critical(repr(e))
@@ -38,8 +60,256 @@ def createCollection(loggerName, scope, name=None, collectionType="DATASET"):
             logger.debug("DID already exists. Skipping.")
 
     except Exception as e:
-        logger.critical("Error listing collection.")
+        logger.critical("Error getting collection.")
         logger.critical(repr(e))
         return False
 
+    with _confirmedCollectionsLock:
+        _confirmedCollections[did] = time.time() + cache.getSettings()["ttl"]
+
     return did
+
+
+def forgetCollections(dids=None):
+    """
+    Forget that collections, <dids>, or all collections if None, have been created
+    or found to exist by this process, e.g. if they may have been erased.
+    """
+    with _confirmedCollectionsLock:
+        if dids is None:
+            _confirmedCollections.clear()
+        for did in dids or []:
+            _confirmedCollections.pop(did, None)
+
+
+def _unwrap(error):
+    """ Get the Rucio exception, if any, that a wrapper's exception, <error>, wraps. """
+    # The API wrappers re-raise some Rucio exceptions wrapped in an Exception.
+    #
+    if type(error) is Exception and error.args and isinstance(error.args[0], BaseException):
+        return error.args[0]
+    return error
+
+
+def isNotFound(error):
+    """ Is an exception, <error>, raised by a wrapper because a DID was not found? """
+    return isinstance(_unwrap(error), DataIdentifierNotFound)
+
+
+class AttachmentBuffer():
+    """
+    Buffer DIDs to be attached to collections, attaching them in batches of
+    <batchSize> DIDs rather than one request per DID.
+
+    As an attachment request either succeeds or fails as a whole, the DIDs of a
+    batch that fails are attached one at a time, so that one bad DID does not
+    leave the rest unattached.
+    """
+
+    def __init__(self, logger, batchSize=1):
+        self.logger = logger
+        self.batchSize = max(1, batchSize)
+        self._pending = {}
+
+    def __len__(self):
+        return sum(len(dids) for dids in self._pending.values())
+
+    def add(self, todid, did):
+        """
+        Buffer a DID, <did>, to be attached to a collection, <todid>, attaching all
+        buffered DIDs once there are <batchSize> of them.
+
+        Returns the DIDs that could not be attached if a flush was attempted (see
+        flush), or an empty list otherwise.
+        """
+        self._pending.setdefault(todid, []).append(did)
+        if len(self) >= self.batchSize:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """
+        Attach all buffered DIDs to their collections.
+
+        Returns the DIDs that could not be attached. DIDs that were already attached
+        are not included.
+        """
+        rucio = RucioWrappersAPI()
+        failed = []
+        for todid, dids in self._pending.items():
+            if len(dids) > 1:
+                self.logger.debug("Attaching {} DIDs to {}".format(len(dids), todid))
+                try:
+                    rucio.attach(todid=todid, dids=dids)
+                    continue
+                except Exception as e:
+                    self.logger.warning("Failed to attach {} DIDs to {}, attaching one at a time: {}".format(
+                        len(dids), todid, repr(e)))
+            failed += self._attachEach(rucio, todid, dids)
+        self._pending = {}
+        return failed
+
+    def _attachEach(self, rucio, todid, dids):
+        """ Attach DIDs, <dids>, to a collection, <todid>, one at a time, returning those that failed. """
+        failed = []
+        for did in dids:
+            try:
+                rucio.attach(todid=todid, dids=[did])
+            except Exception as e:
+                if isinstance(_unwrap(e), DuplicateContent):
+                    self.logger.debug("DID {} already attached to {}".format(did, todid))
+                    continue
+                self.logger.warning("Failed to attach {} to {}: {}".format(did, todid, repr(e)))
+                if isNotFound(e):       # e.g. the collection has been erased, so must be created again
+                    forgetCollections([todid])
+                failed.append(did)
+        return failed
+
+
+class RuleBuffer():
+    """
+    Buffer replication rules to be added, adding them in batches of <batchSize>
+    DIDs rather than one request per DID and RSE.
+    """
+
+    def __init__(self, logger, batchSize=1):
+        self.logger = logger
+        self.batchSize = max(1, batchSize)
+        self._dids = []
+        self._rules = []
+
+    def __len__(self):
+        return len(self._dids)
+
+    def add(self, did, copies, dsts, lifetime=None, activity=None, src=None):
+        """
+        Buffer rules for <copies> copies of a DID, <did>, at each of RSEs, <dsts>,
+        adding all buffered rules once there are <batchSize> DIDs.
+
+        Returns the DIDs whose rules were all added if a flush was attempted (see
+        flush), or an empty list otherwise.
+        """
+        self._dids.append(did)
+        for dst in dsts:
+            self._rules.append({
+                "did": did,
+                "copies": copies,
+                "dst": dst,
+                "lifetime": lifetime,
+                "activity": activity,
+                "src": src,
+            })
+        if len(self) >= self.batchSize:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """
+        Add all buffered rules, logging the ID of each rule or why it could not be
+        added.
+
+        Returns the buffered DIDs, in the order they were added, except those for
+        which any rule could not be added.
+        """
+        dids, rules = self._dids, self._rules
+        self._dids, self._rules = [], []
+        if not rules:
+            return dids
+        self.logger.debug("Adding {} replication rules for {} DIDs".format(len(rules), len(dids)))
+        try:
+            results = RucioWrappersAPI().addRules(rules)
+        except Exception as e:
+            results = [e] * len(rules)
+        failed = set()
+        for rule, result in zip(rules, results):
+            if isinstance(result, Exception):
+                self.logger.warning("Failed to add rule for {} at {}: {}".format(rule["did"], rule["dst"], repr(result)))
+                failed.add(rule["did"])
+            else:
+                self.logger.debug("Rule ID: {}".format(result))
+        return [did for did in dids if did not in failed]
+
+
+class ReplicaResolver():
+    """
+    Resolve the endpoints of replicas of many DIDs at once, indexed by (scope,
+    name, RSE), so that a batch of rules needs one request to list replicas rather
+    than one per rule. The endpoint of a collection at an RSE is that of the first
+    of its files with a replica there.
+
+    Where a DID has no available replica at an RSE, e.g. while it is still being
+    replicated, only the protocol is resolved, as the preferred scheme for reading
+    from that RSE.
+    """
+
+    def __init__(self, chunkSize=1000):
+        self.chunkSize = chunkSize
+        self._endpoints = {}
+        self._resolved = set()
+        self._schemes = {}
+
+    def resolve(self, dids):
+        """ List replicas for any DIDs, <dids>, that have not already been resolved. """
+        dids = [did for did in dict.fromkeys(dids) if did not in self._resolved]
+        if not dids:
+            return
+        rucio = RucioWrappersAPI()
+        listed = set()
+        for replica in rucio.iterFileReplicasBulk(dids, chunkSize=self.chunkSize):
+            listed.add("{}:{}".format(replica['scope'], replica['name']))
+            self._add(replica['scope'], replica['name'], replica)
+
+        # Replicas of a collection are listed per file, so collections are listed
+        # again one at a time to index the endpoint of their first file at each
+        # RSE under the collection itself.
+        #
+        for did in dids:
+            if did in listed:
+                continue
+            tokens = did.split(":")
+            try:
+                for replica in rucio.iterFileReplicas(did):
+                    self._add(tokens[0], tokens[1], replica)
+            except Exception:   # if the DID doesn't exist
+                pass
+        self._resolved.update(dids)
+
+    def _add(self, scope, name, replica):
+        """ Index the first endpoint of a replica, <replica>, at each RSE under DID <scope>:<name>, if not already. """
+        for rse, pfns in replica['rses'].items():
+            if pfns:
+                self._endpoints.setdefault((scope, name, rse), pfns[0])
+
+    def get(self, did, rse):
+        """
+        Get the endpoint and protocol of the replica of a DID, <did>, at RSE, <rse>,
+        as a tuple, resolving the DID first if necessary.
+
+        The endpoint is None if there is no such replica, as is the protocol if the
+        RSE's protocols cannot be found either.
+        """
+        tokens = did.split(":")
+        try:
+            self.resolve([did])
+            endpoint = self._endpoints.get((tokens[0], tokens[1], rse))
+        except Exception:
+            endpoint = None
+        if endpoint is not None:
+            return endpoint, endpoint.split(':')[0]
+        return None, self._scheme(rse)
+
+    def _scheme(self, rse):
+        """ Get the scheme of the protocol with the highest WAN read priority at RSE, <rse>. """
+        if rse not in self._schemes:
+            scheme = None
+            try:
+                protocols = [
+                    protocol for protocol in RucioWrappersAPI().getRSEProtocols(rse)['protocols']
+                    if (protocol.get('domains', {}).get('wan', {}).get('read') or 0) > 0
+                ]
+                if protocols:
+                    scheme = min(protocols, key=lambda protocol: protocol['domains']['wan']['read'])['scheme']
+            except Exception:   # if the RSE doesn't exist, e.g. <rse> is an expression
+                pass
+            self._schemes[rse] = scheme
+        return self._schemes[rse]
@@ -0,0 +1,265 @@
+import asyncio
+import functools
+import inspect
+import random
+import threading
+import time
+
+import requests
+from rucio.common.exception import (DatabaseException, ResourceTemporaryUnavailable, RucioException,
+                                    ServerConnectionException, ServiceUnavailable)
+
+from metrics import getMetrics
+
+# Errors that indicate that a server is overloaded or unreachable, rather than
+# that the call itself was bad.
+#
+OVERLOAD_ERRORS = (
+    DatabaseException,
+    ResourceTemporaryUnavailable,
+    ServerConnectionException,
+    ServiceUnavailable,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    ConnectionError,
+    TimeoutError
+)
+
+# Prefixes of the names of wrapper methods that only read, and so can be retried.
+#
+IDEMPOTENT_PREFIXES = ("get", "list", "ping", "ruleInfo", "whoAmI")
+
+
+def isOverload(error, errors=OVERLOAD_ERRORS):
+    """ Is an exception, <error>, one of <errors> or a server error response with no Rucio exception? """
+    # The API wrappers re-raise Rucio exceptions wrapped in an Exception.
+    #
+    if type(error) is Exception and error.args and isinstance(error.args[0], BaseException):
+        error = error.args[0]
+    if isinstance(error, errors):
+        return True
+    return type(error) is RucioException and "http status code: 5" in str(error)
+
+
+def backoff(attempt, base=0.1, cap=10):
+    """ Get a delay (s) before retry, <attempt> (from 1), drawn uniformly from zero to an exponential cap. """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class AIMDLimit():
+    """
+    Concurrency limit that is increased additively while calls are healthy and
+    decreased multiplicatively when they are not.
+
+    A call is unhealthy if it failed with an overload error or took more than
+    <tolerance> times the moving average latency of calls to the same method. For
+    each healthy call made while the limit was reached, the limit is increased by
+    1/limit (i.e. by about one per round of calls) up to <maximum>. For an
+    unhealthy call, it is multiplied by <factor> down to <minimum>, at most once
+    per <cooldown> seconds so that the calls of a single round that all fail
+    together only count once.
+    """
+
+    def __init__(self, name, initial=8, minimum=1, maximum=64, factor=0.5, tolerance=2, cooldown=1, warmup=10,
+                 alpha=0.1):
+        self.name = name
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.tolerance = tolerance
+        self.cooldown = cooldown
+        self.warmup = warmup
+        self.alpha = alpha
+        self.inFlight = 0
+        self._latencies = {}
+        self._lastDecrease = 0
+        self._lock = threading.Lock()
+        self._report()
+
+    def _isFree(self):
+        return self.inFlight < int(self.limit)
+
+    def _take(self):
+        """ Take a slot, returning whether the limit has been reached with it taken. """
+        with self._lock:
+            self.inFlight += 1
+            saturated = self.inFlight >= int(self.limit)
+        self._report()
+        return saturated
+
+    def _release(self, method, latency, overloaded, saturated):
+        """ Return a slot taken for a call to <method> and adjust the limit from its outcome. """
+        reason = None
+        with self._lock:
+            self.inFlight -= 1
+            average, count = self._latencies.get(method, (latency, 0))
+            if overloaded:
+                reason = "error"
+            elif count >= self.warmup and latency > self.tolerance * average:
+                reason = "latency"
+            self._latencies[method] = (average + self.alpha * (latency - average), count + 1)
+
+            if reason is None:
+                if saturated:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            elif time.monotonic() - self._lastDecrease >= self.cooldown:
+                self.limit = max(self.minimum, self.limit * self.factor)
+                self._lastDecrease = time.monotonic()
+            else:
+                reason = None
+        if reason is not None:
+            getMetrics().limiterDecreases.labels(limiter=self.name, reason=reason).inc()
+        self._report()
+
+    def _report(self):
+        metrics = getMetrics()
+        metrics.limiterLimit.labels(limiter=self.name).set(self.limit)
+        metrics.limiterInFlight.labels(limiter=self.name).set(self.inFlight)
+
+
+class Limiter(AIMDLimit):
+    """ Adaptive limit on the number of calls made concurrently from threads. """
+
+    def __init__(self, name, **kwargs):
+        super().__init__(name, **kwargs)
+        self._condition = threading.Condition()
+
+    def call(self, method, fn, *args, **kwargs):
+        """ Call <fn> with <args> and <kwargs> once a slot is free, as a call to <method>. """
+        with self._condition:
+            self._condition.wait_for(self._isFree)
+            saturated = self._take()
+        st = time.perf_counter()
+        overloaded = False
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            overloaded = isOverload(e)
+            raise
+        finally:
+            self._release(method, time.perf_counter() - st, overloaded, saturated)
+            with self._condition:
+                self._condition.notify_all()
+
+
+class AsyncLimiter(AIMDLimit):
+    """
+    Adaptive limit on the number of calls made concurrently from coroutines. The
+    limit is kept between event loops.
+    """
+
+    def __init__(self, name, errors=OVERLOAD_ERRORS, **kwargs):
+        super().__init__(name, **kwargs)
+        self.errors = errors
+        self._condition = None
+        self._loop = None
+
+    async def call(self, method, fn, *args, **kwargs):
+        """ Await coroutine function, <fn>, with <args> and <kwargs> once a slot is free, as a call to <method>. """
+        if self._loop is not asyncio.get_running_loop():
+            self._loop = asyncio.get_running_loop()
+            self._condition = asyncio.Condition()
+        condition = self._condition
+        async with condition:
+            await condition.wait_for(self._isFree)
+            saturated = self._take()
+        st = time.perf_counter()
+        overloaded = False
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            overloaded = isOverload(e, self.errors)
+            raise
+        finally:
+            self._release(method, time.perf_counter() - st, overloaded, saturated)
+            async with condition:
+                condition.notify_all()
+
+
+_limiters = {}
+_lock = threading.Lock()
+
+
+def getLimiter(name, cls=Limiter, **kwargs):
+    """
+    Get the process-wide limiter, <name>, creating it as an instance of <cls> with
+    <kwargs> on first use.
+
+    Raises ValueError if the limiter has already been created with a different
+    class or kwargs.
+    """
+    if name not in _limiters:
+        with _lock:
+            if name not in _limiters:
+                _limiters[name] = (cls, kwargs, cls(name, **kwargs))
+    existingCls, existingKwargs, limiter = _limiters[name]
+    if (existingCls, existingKwargs) != (cls, kwargs):
+        raise ValueError("Limiter {} already exists with different settings: {} {}".format(
+            name, existingCls.__name__, existingKwargs))
+    return limiter
+
+
+def isIdempotent(method):
+    """ Can calls to wrapper method, <method>, be retried, i.e. do they only read? """
+    return method.startswith(IDEMPOTENT_PREFIXES)
+
+
+_local = threading.local()
+
+
+def _callLimited(name, method, fn, args, kwargs):
+    """
+    Call <fn> with <args> and <kwargs> through the limiter, <name>, as a call to
+    <method>, so that calls it makes on the same thread are not limited again.
+    """
+    def call():
+        _local.depth = 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.depth = 0
+    return getLimiter(name).call(method, call)
+
+
+def _callWithRetries(name, method, fn, args, kwargs, retries):
+    """ As _callLimited, retrying up to <retries> times after an overload error with a jittered backoff. """
+    for attempt in range(1, retries + 2):
+        try:
+            return _callLimited(name, method, fn, args, kwargs)
+        except Exception as e:
+            if attempt > retries or not isOverload(e):
+                raise
+        getMetrics().limiterRetries.labels(limiter=name, method=method).inc()
+        time.sleep(backoff(attempt))
+
+
+def limitRucioCalls(name="rucio", exempt=(), retries=3):
+    """
+    Class decorator that makes calls to each of the static methods of a Rucio
+    wrappers class through the process-wide limiter, <name>. Calls to methods that
+    only read are retried up to <retries> times after an overload error, with a
+    jittered exponential backoff.
+
+    Generator functions, the methods in <exempt> (those that make their calls via
+    other limited methods on other threads) and calls made from within a limited
+    call on the same thread are not limited.
+    """
+    def limit(method, fn):
+        if inspect.isgeneratorfunction(fn) or method in exempt:
+            return fn
+        methodRetries = retries if isIdempotent(method) else 0
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if getattr(_local, "depth", 0):
+                return fn(*args, **kwargs)
+            return _callWithRetries(name, method, fn, args, kwargs, methodRetries)
+        return wrapper
+
+    def decorator(cls):
+        for method, attr in list(vars(cls).items()):
+            if isinstance(attr, staticmethod):
+                setattr(cls, method, staticmethod(limit(method, attr.__func__)))
+        return cls
+    return decorator
@@ -1,14 +1,21 @@
 import abc
+from itertools import islice, zip_longest
+import os
 import subprocess
+import threading
+import time
 
-from gfal2 import Gfal2Context
 from rucio.client.accountclient import AccountClient
 from rucio.client.client import Client
 from rucio.client.rseclient import RSEClient
-from rucio.client.downloadclient import DownloadClient
 from rucio.client.pingclient import PingClient
-from rucio.client.uploadclient import UploadClient
-from rucio.common.exception import AccountNotFound, RucioException
+from rucio.common.exception import AccountNotFound, DataIdentifierAlreadyExists, DataIdentifierNotFound, RucioException
+
+from common.rucio.cache import cacheRucioCalls
+from common.rucio.clients import pooledClient
+from common.rucio.limiter import limitRucioCalls
+from metrics import getMetrics, instrumentRucioCalls
+from utility import chunk
 
 
 class RucioWrappers:
@@ -24,10 +31,18 @@ class RucioWrappers:
     def addDataset():
         raise NotImplementedError
 
+    @abc.abstractstaticmethod
+    def addDIDs():
+        raise NotImplementedError
+
     @abc.abstractstaticmethod
     def addRule():
         raise NotImplementedError
 
+    @abc.abstractstaticmethod
+    def addRules():
+        raise NotImplementedError
+
     @abc.abstractstaticmethod
     def attach():
         raise NotImplementedError
@@ -48,6 +63,10 @@ class RucioWrappers:
     def getAccount(account):
         raise NotImplementedError
 
+    @abc.abstractstaticmethod
+    def getDID(did):
+        raise NotImplementedError
+
     @abc.abstractstaticmethod
     def getMetadata():
         raise NotImplementedError
@@ -80,18 +99,38 @@ class RucioWrappers:
     def listAccounts():
         raise NotImplementedError
 
+    @abc.abstractstaticmethod
+    def iterContent():
+        raise NotImplementedError
+
     @abc.abstractstaticmethod
     def listContent():
         raise NotImplementedError
 
+    @abc.abstractstaticmethod
+    def iterDIDs():
+        raise NotImplementedError
+
     @abc.abstractstaticmethod
     def listDIDs():
         raise NotImplementedError
 
+    @abc.abstractstaticmethod
+    def iterFileReplicas():
+        raise NotImplementedError
+
+    @abc.abstractstaticmethod
+    def iterFileReplicasBulk():
+        raise NotImplementedError
+
     @abc.abstractstaticmethod
     def listFileReplicas():
         raise NotImplementedError
 
+    @abc.abstractstaticmethod
+    def iterReplicationRules():
+        raise NotImplementedError
+
     @abc.abstractstaticmethod
     def listReplicationRules():
         raise NotImplementedError
@@ -100,10 +139,18 @@ class RucioWrappers:
     def listReplicationRulesFull():
         raise NotImplementedError
 
+    @abc.abstractstaticmethod
+    def iterRequests():
+        raise NotImplementedError
+
     @abc.abstractstaticmethod
     def listRequests():
         raise NotImplementedError
 
+    @abc.abstractstaticmethod
+    def iterRequestsHistory():
+        raise NotImplementedError
+
     @abc.abstractstaticmethod
     def listRequestsHistory():
         raise NotImplementedError
@@ -124,6 +171,10 @@ class RucioWrappers:
     def upload():
         raise NotImplementedError
 
+    @abc.abstractstaticmethod
+    def uploadMany():
+        raise NotImplementedError
+
     @abc.abstractstaticmethod
     def uploadDir():
         raise NotImplementedError
@@ -133,6 +184,8 @@ class RucioWrappers:
         raise NotImplementedError
 
 
+@limitRucioCalls()
+@instrumentRucioCalls("cli")
 class RucioWrappersCLI(RucioWrappers):
     """ Talk to a Rucio instance via subprocessed CLI commands. """
 
@@ -168,8 +221,10 @@ class RucioWrappersCLI(RucioWrappers):
 
     @staticmethod
     def attach(todid, dids):
-        """ Attach DIDs, <dids>, to DID <todid>. """
-        rtn = subprocess.run(["rucio", "attach", todid, dids], stdout=subprocess.PIPE)
+        """ Attach DIDs, <dids> (a list or space-separated string), to DID <todid>. """
+        if isinstance(dids, str):
+            dids = dids.split(" ")
+        rtn = subprocess.run(["rucio", "attach", todid] + dids, stdout=subprocess.PIPE)
         if rtn.returncode != 0:
             raise Exception("Non-zero return code")
         return rtn
@@ -267,6 +322,7 @@ class RucioWrappersCLI(RucioWrappers):
         )
         if rtn.returncode != 0:
             raise Exception("Non-zero return code")
+        getMetrics().uploadedBytes.labels(rse=rse).inc(os.path.getsize(filePath))
         return rtn
 
     @staticmethod
@@ -293,9 +349,169 @@ class RucioWrappersCLI(RucioWrappers):
         )
         if rtn.returncode != 0:
             raise Exception("Non-zero return code")
+        getMetrics().uploadedBytes.labels(rse=rse).inc(
+            sum(entry.stat().st_size for entry in os.scandir(dirPath) if entry.is_file()))
         return rtn
 
 
+@limitRucioCalls()
+@instrumentRucioCalls("inprocess")
+class RucioWrappersInProcess(RucioWrappersCLI):
+    """
+    Talk to a Rucio instance via the API, in this process and on pooled clients,
+    but return the same results as the CLI commands of RucioWrappersCLI.
+
+    Each result is a CompletedProcess, with the arguments of the equivalent CLI
+    command and, as stdout, what it would print (e.g. the IDs of added rules).
+    Calls that fail raise an exception, as with a non-zero return code.
+    """
+
+    @staticmethod
+    def _completed(cmd, stdout=""):
+        """ Get the result of a command, <cmd>, that printed <stdout>. """
+        return subprocess.CompletedProcess(args=cmd, returncode=0, stdout=stdout.encode("UTF-8"))
+
+    @staticmethod
+    def addDataset(did):
+        RucioWrappersAPI.addDID(did, "DATASET")
+        return RucioWrappersInProcess._completed(["rucio", "add-dataset", did], "Added {}\n".format(did))
+
+    @staticmethod
+    def addRule(did, copies, dst, lifetime=None, activity=None, src=None):
+        """
+        Add rule(s) for <copies> copies of a DID, <did>, at RSE, <rse>, with
+        additional options.
+        """
+        try:
+            ruleIDs = RucioWrappersAPI.addRule(
+                did, copies, dst, lifetime=lifetime, activity=activity, src=src)
+        except RucioException as error:
+            raise Exception(error)
+        return RucioWrappersInProcess._completed(
+            ["rucio", "add-rule", did, str(copies), dst], "".join("{}\n".format(ruleID) for ruleID in ruleIDs))
+
+    @staticmethod
+    def attach(todid, dids):
+        """ Attach DIDs, <dids> (a list or space-separated string), to DID <todid>. """
+        if isinstance(dids, str):
+            dids = dids.split(" ")
+        try:
+            RucioWrappersAPI.attach(todid, dids)
+        except RucioException as error:
+            raise Exception(error)
+        return RucioWrappersInProcess._completed(
+            ["rucio", "attach", todid] + dids, "DIDs successfully attached to {}\n".format(todid))
+
+    @staticmethod
+    def listDIDs(scope, name="*", filters=None):
+        """ List DIDs in scope, <scope>, with name, <name>. """
+        filters_dict = {"name": name}
+        if filters is not None:
+            for pair in filters.split(","):
+                tokens = pair.split("=")
+                filters_dict[tokens[0].strip()] = tokens[1].strip()
+        didType = filters_dict.pop("type", "collection")
+        try:
+            return RucioWrappersAPI.listDIDs(scope, filters=filters_dict, type=didType)
+        except RucioException as error:
+            raise Exception(error)
+
+    @staticmethod
+    def getMetadata(did, plugin="DID_COLUMN"):
+        """
+        Get metadata for did, <did>.
+
+        Args:
+            plugin (`str`): can be DID_COLUMN or JSON
+        """
+        try:
+            metadata = RucioWrappersAPI.getMetadata(did, plugin=plugin)
+        except RucioException as error:
+            raise Exception(error)
+        return RucioWrappersInProcess._completed(
+            ["rucio", "get-metadata", did, "--plugin", plugin],
+            "".join("{}: {}\n".format(key, value) for key, value in metadata.items()))
+
+    @staticmethod
+    def setMetadata(did, key, value):
+        """ Set metadata for did, <did>. """
+        try:
+            RucioWrappersAPI.setMetadata(did, key, value)
+        except RucioException as error:
+            raise Exception(error)
+        return RucioWrappersInProcess._completed(
+            ["rucio", "set-metadata", "--did", did, "--key", key, "--value", value])
+
+    @staticmethod
+    def upload(rse, scope, filePath, lifetime):
+        """ Upload file, <filePath>, to rse, <RSE>, with lifetime <lifetime>. """
+        RucioWrappersAPI.upload(rse, scope, filePath, lifetime)
+        return RucioWrappersInProcess._completed(
+            ["rucio", "upload", "--rse", rse, "--scope", scope, "--lifetime", str(lifetime),
+             "--register-after-upload", filePath])
+
+    @staticmethod
+    def uploadDir(rse, scope, dirPath, lifetime, parentDid):
+        """
+        Upload a directory of files, <dirPath>, with lifetime, <lifetime>, and
+        attach each file to a parent did, <parentDid>.
+        """
+        from rucio.client.uploadclient import UploadClient
+
+        tokens = parentDid.split(":")
+        items = []
+        for entry in os.scandir(dirPath):
+            if entry.is_file():
+                items.append({
+                    "path": entry.path,
+                    "rse": rse,
+                    "did_scope": scope,
+                    "lifetime": lifetime,
+                    "register_after_upload": True,
+                    "dataset_scope": tokens[0],
+                    "dataset_name": tokens[1],
+                })
+        with pooledClient(Client) as rucioClient:
+            client = UploadClient(_client=rucioClient)
+            client.upload(items=items)
+        getMetrics().uploadedBytes.labels(rse=rse).inc(sum(os.path.getsize(item["path"]) for item in items))
+        return RucioWrappersInProcess._completed(
+            ["rucio", "upload", "--rse", rse, "--lifetime", str(lifetime), "--scope", scope,
+             "--register-after-upload", parentDid, dirPath])
+
+
+def _addRulesBulk(client, dids, options):
+    """
+    Add a rule with <options> for each of DIDs, <dids>, in one request with client,
+    <client>, returning the rule IDs in the order of <dids>, or None if it failed.
+    """
+    # Rucio creates one rule per DID, returning their IDs in the order the DIDs
+    # were given.
+    #
+    try:
+        ruleIDs = client.add_replication_rule(dids=dids, **options)
+    except RucioException:
+        return None
+    return ruleIDs if len(ruleIDs) == len(dids) else None
+
+
+def _addRulesEach(client, dids, options):
+    """
+    Add a rule with <options> for each of DIDs, <dids>, one at a time with client,
+    <client>, returning the rule ID or exception raised for each in order.
+    """
+    results = []
+    for did in dids:
+        try:
+            results.append(client.add_replication_rule(dids=[did], **options)[0])
+        except RucioException as error:
+            results.append(Exception(error))
+    return results
+
+
+@cacheRucioCalls(["getRSELimits", "getRSEProtocols", "listRSEAttributes", "listRSEs"])
+@limitRucioCalls(exempt=["uploadMany"])
+@instrumentRucioCalls("api")
 class RucioWrappersAPI(RucioWrappers):
     """ Talk to a Rucio instance via the API. """
 
@@ -303,8 +519,8 @@ class RucioWrappersAPI(RucioWrappers):
     def addAccount(name, type, email):
         """ Create a new account. Types are 'USER', 'GROUP' or 'SERVICE'. """
         try:
-            client = AccountClient()
-            return client.add_account(account=name, type_=type, email=email)
+            with pooledClient(AccountClient) as client:
+                return client.add_account(account=name, type_=type, email=email)
         except RucioException as error:
             raise Exception(error)
 
@@ -312,28 +528,46 @@ class RucioWrappersAPI(RucioWrappers):
     def addDID(did, type):
         """ Add a DID, <did>, of type, <type>. """
         try:
-            client = Client()
+            with pooledClient(Client) as client:
+                tokens = did.split(":")
+                scope = tokens[0]
+                name = tokens[1]
+                client.add_did(scope=scope, name=name, did_type=type)
+        except DataIdentifierAlreadyExists:
+            raise
+        except RucioException as error:
+            raise Exception(error)
+
+    @staticmethod
+    def addDIDs(dids, type, chunkSize=1000):
+        """ Add DIDs, <dids>, of type, <type>, in requests of up to <chunkSize> DIDs. """
+        entries = []
+        for did in dids:
             tokens = did.split(":")
-            scope = tokens[0]
-            name = tokens[1]
-            client.add_did(scope=scope, name=name, did_type=type)
+            entries.append({"scope": tokens[0], "name": tokens[1], "type": type})
+        try:
+            with pooledClient(Client) as client:
+                for entriesChunk in chunk(entries, chunkSize):
+                    client.add_dids(entriesChunk)
         except RucioException as error:
             raise Exception(error)
 
     @staticmethod
     def addReplica(rse, did, pfn):
         """ Add a DID, <did>, of type, <type>. """
+        from gfal2 import Gfal2Context
+
         try:
-            client = Client()
-            gfal = Gfal2Context()
-            tokens = did.split(":")
-            scope = tokens[0]
-            name = tokens[1]
-            size = gfal.stat(pfn).st_size
-            checksum = gfal.checksum(pfn, "adler32")
-            client.add_replica(
-                rse=rse, scope=scope, name=name, bytes=size, adler32=checksum, pfn=pfn
-            )
+            with pooledClient(Client) as client:
+                gfal = Gfal2Context()
+                tokens = did.split(":")
+                scope = tokens[0]
+                name = tokens[1]
+                size = gfal.stat(pfn).st_size
+                checksum = gfal.checksum(pfn, "adler32")
+                client.add_replica(
+                    rse=rse, scope=scope, name=name, bytes=size, adler32=checksum, pfn=pfn
+                )
         except RucioException as error:
             raise Exception(error)
 
@@ -349,80 +583,152 @@ class RucioWrappersAPI(RucioWrappers):
         scope = tokens[0]
         name = tokens[1]
 
-        client = Client()
-        rtn = client.add_replication_rule(
-            dids=[{"scope": scope, "name": name}],
-            copies=copies,
-            rse_expression=dst,
-            lifetime=lifetime,
-            activity=activity,
-            source_replica_expression=src,
-            asynchronous=asynchronous,
-        )
+        with pooledClient(Client) as client:
+            rtn = client.add_replication_rule(
+                dids=[{"scope": scope, "name": name}],
+                copies=copies,
+                rse_expression=dst,
+                lifetime=lifetime,
+                activity=activity,
+                source_replica_expression=src,
+                asynchronous=asynchronous,
+            )
+            return rtn
+
+    @staticmethod
+    def addRules(rules, chunkSize=1000):
+        """
+        Add rules, <rules>, each a dict with keys "did", "copies", "dst" and,
+        optionally, "lifetime", "activity", "src" and "asynchronous" (the arguments
+        of addRule).
+
+        Rules that share all but their DID are added together in requests of up to
+        <chunkSize> DIDs. If a request fails, e.g. because one of its DIDs already
+        has an identical rule, its rules are added one at a time instead so that
+        one bad DID does not fail the rest.
+
+        Returns a list with an entry for each of <rules>, in the same order: the
+        rule ID if the rule was added, or the exception raised otherwise.
+        """
+        groups = {}
+        for idx, rule in enumerate(rules):
+            key = (
+                rule["copies"],
+                rule["dst"],
+                rule.get("lifetime"),
+                rule.get("activity"),
+                rule.get("src"),
+                rule.get("asynchronous", False),
+            )
+            groups.setdefault(key, []).append(idx)
+
+        rtn = [None] * len(rules)
+        with pooledClient(Client) as client:
+            for (copies, dst, lifetime, activity, src, asynchronous), indices in groups.items():
+                options = {
+                    "copies": copies,
+                    "rse_expression": dst,
+                    "lifetime": lifetime,
+                    "activity": activity,
+                    "source_replica_expression": src,
+                    "asynchronous": asynchronous,
+                }
+                for indicesChunk in chunk(indices, chunkSize):
+                    dids = []
+                    for idx in indicesChunk:
+                        tokens = rules[idx]["did"].split(":")
+                        dids.append({"scope": tokens[0], "name": tokens[1]})
+                    results = _addRulesBulk(client, dids, options)
+                    if results is None:
+                        results = _addRulesEach(client, dids, options)
+                    for idx, result in zip(indicesChunk, results):
+                        rtn[idx] = result
         return rtn
 
     @staticmethod
-    def attach(todid, dids):
-        """ Attach DIDs, <dids>, to a DID, <todid>. """
-        client = Client()
+    def attach(todid, dids, chunkSize=1000):
+        """
+        Attach DIDs, <dids> (a list or space-separated string), to a DID, <todid>,
+        in requests of up to <chunkSize> DIDs.
+        """
+        if isinstance(dids, str):
+            dids = dids.split(" ")
         tokens = todid.split(":")
         toScope = tokens[0]
         toName = tokens[1]
 
-        attachment = {"scope": toScope, "name": toName, "dids": []}
-        for did in dids.split(" "):
+        children = []
+        for did in dids:
             tokens = did.split(":")
             scope = tokens[0]
             name = tokens[1]
-            attachment["dids"].append({"scope": scope, "name": name})
-        client.attach_dids_to_dids(attachments=[attachment])
+            children.append({"scope": scope, "name": name})
+        with pooledClient(Client) as client:
+            for childrenChunk in chunk(children, chunkSize):
+                client.attach_dids_to_dids(attachments=[{"scope": toScope, "name": toName, "dids": childrenChunk}])
 
     @staticmethod
     def detach(fromdid, dids):
         """ Attach DIDs, <dids>, from a DID, <fromdid>. """
-        client = Client()
-        tokens = fromdid.split(":")
-        fromScope = tokens[0]
-        fromName = tokens[1]
-
-        detachments = []
-        for did in dids.split(" "):
-            tokens = did.split(":")
-            scope = tokens[0]
-            name = tokens[1]
-            detachments.append({"scope": scope, "name": name})
-        client.detach_dids(scope=fromScope, name=fromName, dids=detachments)
+        with pooledClient(Client) as client:
+            tokens = fromdid.split(":")
+            fromScope = tokens[0]
+            fromName = tokens[1]
+
+            detachments = []
+            for did in dids.split(" "):
+                tokens = did.split(":")
+                scope = tokens[0]
+                name = tokens[1]
+                detachments.append({"scope": scope, "name": name})
+            client.detach_dids(scope=fromScope, name=fromName, dids=detachments)
 
     @staticmethod
     def download(did, baseDir="download", logger=None):
         """ Download a DID, <did>, to directory, <baseDir>. """
-        client = DownloadClient(logger=logger)
+        from rucio.client.downloadclient import DownloadClient
+
         items = [{"did": did, "base_dir": baseDir}]
-        client.download_dids(items=items)
+        with pooledClient(Client) as rucioClient:
+            client = DownloadClient(client=rucioClient, logger=logger)
+            client.download_dids(items=items)
 
     @staticmethod
     def erase(did, purgeReplicas):
         """ Remove replication rueles from a DID, <did>. """
         api = RucioWrappersAPI()
-        rules = api.listReplicationRules(did)
         rids = set()
-        for rule in rules:
+        for rule in api.iterReplicationRules(did):
             rids.add(rule["id"])
-        client = Client()
-        for rid in rids:
-            client.delete_replication_rule(rule_id=rid, purge_replicas=purgeReplicas)
+        with pooledClient(Client) as client:
+            for rid in rids:
+                client.delete_replication_rule(rule_id=rid, purge_replicas=purgeReplicas)
 
     @abc.abstractstaticmethod
     def getAccount(name):
         """ Returns a dictionary with information about an account. """
         try:
-            client = AccountClient()
-            return client.get_account(name)
+            with pooledClient(AccountClient) as client:
+                return client.get_account(name)
         except AccountNotFound:
             return None
         except RucioException as error:
             raise Exception(error)
 
+    @staticmethod
+    def getDID(did):
+        """ Returns a dictionary with information about a DID, <did>, or None if it does not exist. """
+        tokens = did.split(":")
+        scope = tokens[0]
+        name = tokens[1]
+        try:
+            with pooledClient(Client) as client:
+                return client.get_did(scope=scope, name=name)
+        except DataIdentifierNotFound:
+            return None
+        except RucioException as error:
+            raise Exception(error)
+
     @staticmethod
     def getMetadata(did, plugin="DID_COLUMN"):
         """
@@ -431,21 +737,21 @@ class RucioWrappersAPI(RucioWrappers):
         Args:
             plugin (`str`): can be DID_COLUMN or JSON
         """
-        client = Client()
-        tokens = did.split(":")
-        scope = tokens[0]
-        name = tokens[1]
-        metadata = client.get_metadata(scope, name, plugin=plugin)
-        return metadata
+        with pooledClient(Client) as client:
+            tokens = did.split(":")
+            scope = tokens[0]
+            name = tokens[1]
+            metadata = client.get_metadata(scope, name, plugin=plugin)
+            return metadata
 
     @staticmethod
     def setMetadata(did, key, value, recursive=False):
         """ Set DID metadata for did, <did>. """
-        client = Client()
-        tokens = did.split(":")
-        scope = tokens[0]
-        name = tokens[1]
-        client.set_metadata(scope, name, key, value, recursive=recursive)
+        with pooledClient(Client) as client:
+            tokens = did.split(":")
+            scope = tokens[0]
+            name = tokens[1]
+            client.set_metadata(scope, name, key, value, recursive=recursive)
 
     @staticmethod
     def setMetadataBulk(did, meta, recursive=False):
@@ -455,65 +761,69 @@ class RucioWrappersAPI(RucioWrappers):
         Args:
             meta (`dict`): Metadata k-v pairs to be set
         """
-        client = Client()
-        tokens = did.split(":")
-        scope = tokens[0]
-        name = tokens[1]
-        client.set_metadata_bulk(scope, name, meta, recursive=recursive)
+        with pooledClient(Client) as client:
+            tokens = did.split(":")
+            scope = tokens[0]
+            name = tokens[1]
+            client.set_metadata_bulk(scope, name, meta, recursive=recursive)
 
     @staticmethod
     def getRequestHistory(did, rse):
         """ Getfull history of requests for a DID, <did>, to rse, <rse>. """
-        client = Client()
-        tokens = did.split(":")
-        scope = tokens[0]
-        name = tokens[1]
-        requests = client.list_request_history_by_did(scope=scope, name=name, rse=rse)
-        return requests
+        with pooledClient(Client) as client:
+            tokens = did.split(":")
+            scope = tokens[0]
+            name = tokens[1]
+            requests = client.list_request_history_by_did(scope=scope, name=name, rse=rse)
+            return requests
 
     @staticmethod
     def getRSELimits(rse):
         """ Get RSE limits for rse, <rse>. """
-        client = RSEClient()
-        limits = client.get_rse_limits(rse)
-        return limits
+        with pooledClient(RSEClient) as client:
+            limits = client.get_rse_limits(rse)
+            return limits
 
     @staticmethod
     def getRSEProtocols(rse):
         """ Get supported RSE protocols for rse, <rse>. """
-        client = RSEClient()
-        protocols = client.get_protocols(rse)
-        return protocols
+        with pooledClient(RSEClient) as client:
+            protocols = client.get_protocols(rse)
+            return protocols
 
     @staticmethod
     def getRSEUsage(rse):
         """ Get RSE usage for rse, <rse>. """
-        client = RSEClient()
-        usage = client.get_rse_usage(rse)
-        return usage
+        with pooledClient(RSEClient) as client:
+            usage = client.get_rse_usage(rse)
+            return usage
 
     @staticmethod
     def listAccounts():
         """ Returns a dictionary with accounts information. """
         try:
-            client = AccountClient()
-            return client.list_accounts()
+            with pooledClient(AccountClient) as client:
+                return list(client.list_accounts())
         except RucioException as error:
             raise Exception(error)
 
+    @staticmethod
+    def iterContent(scope, name, limit=None):
+        """ Iterate over the content of DID, <scope>:<name>, stopping after <limit> DIDs if not None. """
+        with pooledClient(Client) as client:
+            yield from islice(client.list_content(scope=scope, name=name), limit)
+
     @staticmethod
     def listContent(scope, name):
         """ List content of DID. """
-        client = Client()
-        contents = []
-        for content in client.list_content(scope=scope, name=name):
-            contents.append(content)
-        return contents
+        return list(RucioWrappersAPI.iterContent(scope, name))
 
     @staticmethod
-    def listDIDs(scope, filters=None, type="collection", recursive=False):
-        """ List DIDs in scope, <scope>, with name, <name>. """
-        client = Client()
+    def iterDIDs(scope, filters=None, type="collection", recursive=False, limit=None):
+        """
+        Iterate over DIDs in scope, <scope>, matching filters, <filters>, stopping
+        after <limit> DIDs if not None.
+        """
         filters_dict = {}
         if filters is not None:
             if isinstance(filters, str):
@@ -524,97 +834,118 @@ class RucioWrappersAPI(RucioWrappers):
                     filters_dict[key] = val
             else:
                 filters_dict = filters
-        dids = []
-        for name in client.list_dids(scope=scope, filters=filters_dict, did_type=type, recursive=recursive):
-            dids.append("{}:{}".format(scope, name))
-        return dids
+        with pooledClient(Client) as client:
+            for name in islice(
+                client.list_dids(scope=scope, filters=filters_dict, did_type=type, recursive=recursive), limit
+            ):
+                yield "{}:{}".format(scope, name)
+
+    @staticmethod
+    def listDIDs(scope, filters=None, type="collection", recursive=False):
+        """ List DIDs in scope, <scope>, with name, <name>. """
+        return list(RucioWrappersAPI.iterDIDs(scope, filters=filters, type=type, recursive=recursive))
+
+    @staticmethod
+    def iterFileReplicas(did, rse=None, limit=None):
+        """ Iterate over file replicas for DID, <did>, stopping after <limit> replicas if not None. """
+        tokens = did.split(":")
+        scope = tokens[0]
+        name = tokens[1]
+        with pooledClient(Client) as client:
+            yield from islice(client.list_replicas(dids=[{"scope": scope, "name": name}], rse_expression=rse), limit)
+
+    @staticmethod
+    def iterFileReplicasBulk(dids, rse=None, chunkSize=1000):
+        """ Iterate over file replicas for DIDs, <dids>, in requests of up to <chunkSize> DIDs. """
+        entries = []
+        for did in dids:
+            tokens = did.split(":")
+            entries.append({"scope": tokens[0], "name": tokens[1]})
+        with pooledClient(Client) as client:
+            for entriesChunk in chunk(entries, chunkSize):
+                yield from client.list_replicas(dids=entriesChunk, rse_expression=rse)
 
     @staticmethod
     def listFileReplicas(did, rse=None):
         """ List file replicas for DID, <did>. """
-        client = Client()
+        return list(RucioWrappersAPI.iterFileReplicas(did, rse=rse))
+
+    @staticmethod
+    def iterReplicationRules(did, limit=None):
+        """ Iterate over replication rules for a DID, <did>, stopping after <limit> rules if not None. """
         tokens = did.split(":")
         scope = tokens[0]
         name = tokens[1]
-        replicas = []
-        for replica in client.list_replicas(
-            dids=[{"scope": scope, "name": name}], rse_expression=rse
-        ):
-            replicas.append(replica)
-        return replicas
+        with pooledClient(Client) as client:
+            yield from islice(client.list_replication_rules(filters={"scope": scope, "name": name}), limit)
 
     @staticmethod
     def listReplicationRules(did):
         """ List replication rules for a DID, <did>. """
-        client = Client()
-        tokens = did.split(":")
-        scope = tokens[0]
-        name = tokens[1]
-        rules = []
-        for rule in client.list_replication_rules(
-            filters={"scope": scope, "name": name}
-        ):
-            rules.append(rule)
-        return rules
+        return list(RucioWrappersAPI.iterReplicationRules(did))
 
     @staticmethod
     def listReplicationRulesFull(did):
         """ List full history of replication rules for a DID, <did>. """
-        client = Client()
-        tokens = did.split(":")
-        scope = tokens[0]
-        name = tokens[1]
-        rules = []
-        for rule in client.list_replication_rule_full_history(scope=scope, name=name):
-            rules.append(rule)
-        return rules
-        
+        with pooledClient(Client) as client:
+            tokens = did.split(":")
+            scope = tokens[0]
+            name = tokens[1]
+            rules = []
+            for rule in client.list_replication_rule_full_history(scope=scope, name=name):
+                rules.append(rule)
+            return rules
+
+    @staticmethod
+    def iterRequests(src_rse, dst_rse, request_states, limit=None):
+        """ Iterate over requests, stopping after <limit> requests if not None. """
+        with pooledClient(Client) as client:
+            yield from islice(client.list_requests(
+                src_rse=src_rse, dst_rse=dst_rse, request_states=','.join(request_states)), limit)
+
     @staticmethod
     def listRequests(src_rse, dst_rse, request_states):
         """ List requests. """
-        client = Client()
-        requests = []
-        for request in client.list_requests(
-            src_rse=src_rse, dst_rse=dst_rse, request_states=','.join(request_states)):
-                requests.append(request)
-        return requests
+        return list(RucioWrappersAPI.iterRequests(src_rse, dst_rse, request_states))
+
+    @staticmethod
+    def iterRequestsHistory(src_rse, dst_rse, request_states, limit=None):
+        """ Iterate over requests history, stopping after <limit> requests if not None. """
+        with pooledClient(Client) as client:
+            yield from islice(client.list_requests_history(
+                src_rse=src_rse, dst_rse=dst_rse, request_states=','.join(request_states)), limit)
 
     @staticmethod
     def listRequestsHistory(src_rse, dst_rse, request_states):
         """ List requests history. """
-        client = Client()
-        requests = []
-        for request in client.list_requests_history(
-            src_rse=src_rse, dst_rse=dst_rse, request_states=','.join(request_states)):
-                requests.append(request)
-        return requests
+        return list(RucioWrappersAPI.iterRequestsHistory(src_rse, dst_rse, request_states))
 
     @staticmethod
     def listRSEs(rse=None):
         """ List RSEs. """
-        client = Client()
-        rses = client.list_rses(rse)
-        return rses
+        with pooledClient(Client) as client:
+            rses = list(client.list_rses(rse))
+            return rses
 
     @staticmethod
     def listRSEAttributes(rse):
         """ List RSE attributes for RSE, <rse>. """
-        client = Client()
-        rseDict = client.list_rse_attributes(rse)
-        return rseDict
+        with pooledClient(Client) as client:
+            rseDict = client.list_rse_attributes(rse)
+            return rseDict
 
     @staticmethod
     def ruleInfo(ruleId):
         """ Get replication rule information for rule id, <ruleId>. """
-        client = Client()
-        info = client.get_replication_rule(ruleId)
-        return info
+        with pooledClient(Client) as client:
+            info = client.get_replication_rule(ruleId)
+            return info
 
     @staticmethod
     def ping():
         """ Ping a rucio server. """
-        client = PingClient()
-        return client.ping()
+        with pooledClient(PingClient) as client:
+            return client.ping()
 
     @staticmethod
     def upload(
@@ -628,6 +959,8 @@ class RucioWrappersAPI(RucioWrappers):
         logger=None,
     ):
         """ Upload file, <filePath>, to rse, <RSE>, with lifetime <lifetime>. """
+        from rucio.client.uploadclient import UploadClient
+
         items = []
         items.append(
             {
@@ -640,12 +973,55 @@ class RucioWrappersAPI(RucioWrappers):
                 "transfer_timeout": transferTimeout,
             }
         )
-        client = UploadClient(logger=logger)
-        client.upload(items=items)
+        with pooledClient(Client) as rucioClient:
+            client = UploadClient(_client=rucioClient, logger=logger)
+            client.upload(items=items)
+        getMetrics().uploadedBytes.labels(rse=rse).inc(os.path.getsize(filePath))
 
     @staticmethod
-    def whoAmI():
-        client = Client()
-        return client.whoami()
+    def uploadMany(items, nThreads=4, nThreadsPerRSE=2, logger=None):
+        """
+        Upload files, <items>, each a dict of the keyword arguments of upload()
+        (without <logger>), on up to <nThreads> threads with no more than
+        <nThreadsPerRSE> uploads to any one RSE at a time.
 
+        Returns a dict for each of <items>, in the same order, with keys "item",
+        "bytes", "started_at" (epoch), "duration" (s) and "error" (the exception
+        raised, or None if the upload succeeded).
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        semaphores = {}
+        queues = {}
+        for idx, item in enumerate(items):
+            semaphores.setdefault(item["rse"], threading.BoundedSemaphore(nThreadsPerRSE))
+            queues.setdefault(item["rse"], []).append(idx)
+
+        def uploadOne(idx):
+            item = items[idx]
+            result = {"item": item, "bytes": None, "started_at": None, "duration": None, "error": None}
+            with semaphores[item["rse"]]:
+                result["started_at"] = time.time()
+                st = time.perf_counter()
+                try:
+                    RucioWrappersAPI.upload(logger=logger, **item)
+                    result["bytes"] = os.path.getsize(item["filePath"])
+                except Exception as e:
+                    result["error"] = e
+                result["duration"] = time.perf_counter() - st
+            return idx, result
+
+        # Submit uploads to each RSE in turn so that threads are not all left
+        # waiting on the same RSE when the items are grouped by RSE.
+        #
+        order = [idx for idxs in zip_longest(*queues.values()) for idx in idxs if idx is not None]
+        results = [None] * len(items)
+        with ThreadPoolExecutor(max_workers=max(1, nThreads)) as executor:
+            for idx, result in executor.map(uploadOne, order):
+                results[idx] = result
+        return results
 
+    @staticmethod
+    def whoAmI():
+        with pooledClient(Client) as client:
+            return client.whoami()
@@ -0,0 +1,85 @@
+from datetime import datetime
+import threading
+import time
+
+from crontab import CronSlices, CronTab
+
+
+class Daemon():
+    """
+    Run jobs repeatedly according to cron expressions from within a single,
+    long-lived process.
+
+    As the process persists between runs, any clients, tokens and caches held by
+    a job are kept warm. If a job is still running when it is next due, that run
+    is skipped rather than being started alongside it.
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+        self._jobs = {}
+        self._crontab = CronTab(tab='')
+        self._stop = threading.Event()
+
+    def add(self, name, fn, schedule):
+        """ Add a job, <name>, that calls <fn> according to the cron expression, <schedule>. """
+        if not CronSlices.is_valid(schedule):
+            raise ValueError("Invalid cron expression for task {}: {}".format(name, schedule))
+        item = self._crontab.new(command=name)
+        item.setall(schedule)
+        iterator = item.schedule(date_from=datetime.now())
+        self._jobs[name] = {
+            'fn': fn,
+            'schedule': schedule,
+            'iterator': iterator,
+            'next': iterator.get_next(),
+            'thread': None
+        }
+
+    def _execute(self, name, job):
+        """ Target for worker threads. """
+        self.logger.info("Starting scheduled run of task {}".format(name))
+        start = time.time()
+        try:
+            rtn = job['fn']()
+            state = 'FAILED' if rtn is False else 'DONE'
+        except BaseException as e:     # including SystemExit, as tasks exit() on some errors
+            self.logger.critical("Task {} raised an exception.".format(name))
+            self.logger.critical(repr(e))
+            state = 'FAILED'
+        self.logger.info("Scheduled run of task {} finished in {:.3f}s ({})".format(
+            name, time.time() - start, state))
+
+    def run(self):
+        """ Run jobs as they become due until stop() is called. """
+        for name, job in self._jobs.items():
+            self.logger.info("Scheduled task {} ({}), next run at {}".format(
+                name, job['schedule'], job['next'].isoformat()))
+
+        while not self._stop.is_set():
+            now = datetime.now()
+            for name, job in self._jobs.items():
+                if job['next'] > now:
+                    continue
+                if job['thread'] is not None and job['thread'].is_alive():
+                    self.logger.warning("Previous run of task {} is still in progress, skipping.".format(name))
+                else:
+                    job['thread'] = threading.Thread(
+                        target=self._execute, args=(name, job), name=name, daemon=True)
+                    job['thread'].start()
+
+                # Advance to the next run in the future, skipping any that were missed.
+                #
+                while job['next'] <= now:
+                    job['next'] = job['iterator'].get_next()
+
+            if not self._jobs:
+                self.logger.warning("No tasks scheduled.")
+                break
+            nextRun = min(job['next'] for job in self._jobs.values())
+            self._stop.wait(timeout=max(0, (nextRun - datetime.now()).total_seconds()))
+        self.logger.info("Daemon stopped.")
+
+    def stop(self):
+        """ Stop scheduling new runs. """
+        self._stop.set()
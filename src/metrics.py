@@ -0,0 +1,156 @@
+import functools
+import inspect
+import threading
+import time
+
+
+class Metrics():
+    """
+    Registry of counters, gauges and histograms describing task runs and calls to
+    external services.
+    """
+
+    def __init__(self):
+        from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+
+        self.registry = CollectorRegistry()
+
+        # Tasks.
+        #
+        self.taskRuns = Counter(
+            "rucio_analysis_task_runs", "Number of task runs.",
+            ["task_name", "class_name", "state"], registry=self.registry)
+        self.taskDuration = Histogram(
+            "rucio_analysis_task_duration_seconds", "Wall time of task runs.",
+            ["task_name", "class_name"], registry=self.registry,
+            buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, float("inf")))
+        self.taskLastRun = Gauge(
+            "rucio_analysis_task_last_run_timestamp_seconds", "Time at which each task last finished.",
+            ["task_name", "class_name"], registry=self.registry)
+
+        # Rucio.
+        #
+        self.rucioCalls = Counter(
+            "rucio_analysis_rucio_calls", "Number of calls made via the Rucio wrappers.",
+            ["backend", "method", "outcome"], registry=self.registry)
+        self.rucioCallDuration = Histogram(
+            "rucio_analysis_rucio_call_duration_seconds", "Latency of calls made via the Rucio wrappers.",
+            ["backend", "method"], registry=self.registry)
+        self.uploadedBytes = Counter(
+            "rucio_analysis_uploaded_bytes", "Number of bytes successfully uploaded.",
+            ["rse"], registry=self.registry)
+        self.rucioClientConstructions = Counter(
+            "rucio_analysis_rucio_client_constructions", "Number of Rucio clients constructed by the client pool.",
+            ["client", "reason"], registry=self.registry)
+        self.rucioClientReuses = Counter(
+            "rucio_analysis_rucio_client_reuses", "Number of times a pooled Rucio client was reused.",
+            ["client"], registry=self.registry)
+        self.rucioCacheLookups = Counter(
+            "rucio_analysis_rucio_cache_lookups", "Number of calls looked up in the cache of read-mostly Rucio calls.",
+            ["method", "outcome"], registry=self.registry)
+
+        # Adaptive concurrency limiters.
+        #
+        self.limiterLimit = Gauge(
+            "rucio_analysis_limiter_limit", "Current concurrency limit of each adaptive limiter.",
+            ["limiter"], registry=self.registry)
+        self.limiterInFlight = Gauge(
+            "rucio_analysis_limiter_in_flight", "Number of calls in flight through each adaptive limiter.",
+            ["limiter"], registry=self.registry)
+        self.limiterDecreases = Counter(
+            "rucio_analysis_limiter_decreases", "Number of times each adaptive limiter decreased its limit.",
+            ["limiter", "reason"], registry=self.registry)
+        self.limiterRetries = Counter(
+            "rucio_analysis_limiter_retries", "Number of calls retried after an overload error.",
+            ["limiter", "method"], registry=self.registry)
+
+        # Elasticsearch.
+        #
+        self.esWrites = Counter(
+            "rucio_analysis_es_writes", "Number of documents written to Elasticsearch.",
+            ["operation", "outcome"], registry=self.registry)
+
+
+_metrics = None
+_lock = threading.Lock()
+
+
+def getMetrics():
+    """ Get the process-wide metrics registry, creating it on first use. """
+    global _metrics
+    if _metrics is None:
+        with _lock:
+            if _metrics is None:
+                _metrics = Metrics()
+    return _metrics
+
+
+def serve(port):
+    """ Expose the metrics over HTTP on port, <port>, from a background thread. """
+    from prometheus_client import start_http_server
+
+    start_http_server(port, registry=getMetrics().registry)
+
+
+def writeTextfile(path):
+    """ Write the metrics to a file, <path>, for a node exporter's textfile collector. """
+    from prometheus_client import write_to_textfile
+
+    write_to_textfile(path, getMetrics().registry)
+
+
+def _recordRucioCall(backend, method, outcome, start):
+    """ Count a call to <method> of a Rucio wrappers class and time it from <start>, a perf_counter() time. """
+    metrics = getMetrics()
+    metrics.rucioCalls.labels(backend=backend, method=method, outcome=outcome).inc()
+    metrics.rucioCallDuration.labels(backend=backend, method=method).observe(time.perf_counter() - start)
+
+
+def _instrumentGenerator(backend, name, fn):
+    """
+    Wrap a generator function, <fn>, so that calls to it are counted and timed
+    until the generator is exhausted or closed, rather than until it is created.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        st = time.perf_counter()
+        outcome = "error"
+        try:
+            yield from fn(*args, **kwargs)
+            outcome = "ok"
+        except GeneratorExit:
+            outcome = "ok"
+            raise
+        finally:
+            _recordRucioCall(backend, name, outcome, st)
+    return wrapper
+
+
+def _instrumentFunction(backend, name, fn):
+    """ Wrap a function, <fn>, so that calls to it are counted and timed. """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        st = time.perf_counter()
+        outcome = "error"
+        try:
+            rtn = fn(*args, **kwargs)
+            outcome = "ok"
+            return rtn
+        finally:
+            _recordRucioCall(backend, name, outcome, st)
+    return wrapper
+
+
+def instrumentRucioCalls(backend):
+    """
+    Class decorator that counts and times calls to each of the static methods of
+    a Rucio wrappers class, labelled with the backend, <backend>.
+    """
+    def decorator(cls):
+        for name, attr in list(vars(cls).items()):
+            if isinstance(attr, staticmethod):
+                fn = attr.__func__
+                instrument = _instrumentGenerator if inspect.isgeneratorfunction(fn) else _instrumentFunction
+                setattr(cls, name, staticmethod(instrument(backend, name, fn)))
+        return cls
+    return decorator
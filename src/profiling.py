@@ -0,0 +1,168 @@
+import cProfile
+import glob
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+
+# Per-thread state of the task profiler.
+#
+_current = threading.local()
+
+
+class _TimedLoader():
+    """ Proxy for a module loader that times the execution of the module. """
+
+    def __init__(self, loader, profiler):
+        self._loader = loader
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        # Restore the original loader so that the module is indistinguishable from
+        # one imported without profiling.
+        #
+        module.__loader__ = self._loader
+        if getattr(module, '__spec__', None) is not None:
+            module.__spec__.loader = self._loader
+
+        self._profiler._enter(module.__name__)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profiler._exit(module.__name__)
+
+
+class ImportProfiler():
+    """
+    Record the time taken to import each module.
+
+    The cumulative time for a module includes the time taken to import any modules
+    it imports in turn; the self time excludes these.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.total = 0
+        self._stack = []
+        self._started = None
+        self._stopped = None
+
+    def find_spec(self, fullname, path, target=None):
+        """ Find the spec using the remaining finders, wrapping the loader. """
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimedLoader(spec.loader, self)
+                return spec
+        return None
+
+    def _enter(self, name):
+        self._stack.append([name, time.perf_counter(), 0])
+
+    def _exit(self, name):
+        name, start, children = self._stack.pop()
+        cumulative = time.perf_counter() - start
+        self.timings[name] = {
+            'self': cumulative - children,
+            'cumulative': cumulative
+        }
+        if self._stack:
+            self._stack[-1][2] += cumulative
+        else:
+            self.total += cumulative
+
+    def start(self):
+        """ Start recording imports. """
+        self._started = time.perf_counter()
+        sys.meta_path.insert(0, self)
+
+    def stop(self):
+        """ Stop recording imports. """
+        self._stopped = time.perf_counter()
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    @property
+    def elapsed(self):
+        """ Get the time between starting and stopping the profiler. """
+        if self._started is None:
+            return 0
+        return (self._stopped or time.perf_counter()) - self._started
+
+    def report(self, logger, nTop=25):
+        """ Log the <nTop> modules with the largest self import time. """
+        logger.info("Imported {} modules in {:.3f}s ({:.3f}s total startup)".format(
+            len(self.timings), self.total, self.elapsed))
+        logger.info("{:>10} {:>10}  {}".format("self (ms)", "cum. (ms)", "module"))
+        for name, timing in sorted(self.timings.items(), key=lambda item: item[1]['self'], reverse=True)[:nTop]:
+            logger.info("{:>10.1f} {:>10.1f}  {}".format(timing['self'] * 1000, timing['cumulative'] * 1000, name))
+
+
+def getWorkerProfilePrefix():
+    """
+    Get the path prefix for the profiles of work submitted to the worker pool by the
+    task running in this thread, or None if the task is not being profiled.
+    """
+    return getattr(_current, 'workerPrefix', None)
+
+
+class TaskProfiler():
+    """
+    Profile the functions called by each task with cProfile, writing a profile
+    file, <directory>/<task name>.prof, per task.
+
+    Profiles of work that a task submits to the worker pool are written as separate
+    parts by the workers and merged into the task's profile once the task finishes.
+    """
+
+    def __init__(self, directory, nTop=25):
+        self.directory = os.path.abspath(directory)
+        self.nTop = nTop
+        os.makedirs(directory, exist_ok=True)
+
+    def run(self, taskName, logger, fn, *args, **kwargs):
+        """ Call <fn> with <args> and <kwargs>, profiling it as task, <taskName>. """
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:     # only one profiler can be active at a time from Python 3.12
+            logger.warning("Could not profile task {}, running unprofiled: {}".format(taskName, e))
+            return fn(*args, **kwargs)
+        _current.workerPrefix = os.path.join(self.directory, "{}.{}.worker".format(taskName, uuid.uuid4().hex[:8]))
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.disable()
+            self._save(taskName, logger, profile, _current.workerPrefix)
+            _current.workerPrefix = None
+
+    def _save(self, taskName, logger, profile, workerPrefix):
+        """ Merge the profile parts for task, <taskName>, write them out and log a summary. """
+        stream = io.StringIO()
+        stats = pstats.Stats(profile, stream=stream)
+        parts = glob.glob("{}-*.prof".format(glob.escape(workerPrefix)))
+        for part in parts:
+            stats.add(part)
+            os.remove(part)
+        path = os.path.join(self.directory, "{}.prof".format(taskName))
+        stats.dump_stats(path)
+        stats.files = []    # do not list every part in the summary
+
+        stats.sort_stats('tottime').print_stats(self.nTop)
+        logger.info("Wrote profile to {} ({} worker parts merged), top {} functions by self time:".format(
+            path, len(parts), self.nTop))
+        for line in stream.getvalue().splitlines():
+            if line.strip():
+                logger.info(line)
@@ -1,26 +1,213 @@
 #!/usr/bin/python3
 from __future__ import absolute_import
+import sys
 
-from session import Session
-from logger import Logger
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
-import argparse
-import requests
-import importlib
-import urllib3
-import warnings
+# Start the import profiler before anything else is imported so that the full
+# startup cost is captured.
+#
+from profiling import ImportProfiler, TaskProfiler
+importProfiler = ImportProfiler()
+if '--profile-startup' in sys.argv:
+    importProfiler.start()
+
+from session import Session  # noqa: E402
+from logger import Logger  # noqa: E402
+import metrics  # noqa: E402
+import workers  # noqa: E402
+from common.es import clients as esClients  # noqa: E402
+from common.rucio import cache  # noqa: E402
+from scheduler import Scheduler  # noqa: E402
+from requests.packages.urllib3.exceptions import InsecureRequestWarning  # noqa: E402
+import argparse  # noqa: E402
+import functools  # noqa: E402
+import requests  # noqa: E402
+import importlib  # noqa: E402
+import signal  # noqa: E402
+import time  # noqa: E402
+import urllib3  # noqa: E402
+import warnings  # noqa: E402
 
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 
+def loadTasks(session, verbose, logger):
+    """
+    Instantiate the tasks defined in a session, <session>.
+
+    Returns a list of dictionaries, one per task, containing the task instance
+    (None if the task is disabled) and the parameters needed to schedule it.
+    """
+    tasks = []
+    for taskName in session.tasks:
+        try:
+            desc = session.tasks[taskName]['description']
+            module_name = session.tasks[taskName]['module_name']
+            class_name = session.tasks[taskName]['class_name']
+            enabled = session.tasks[taskName]['enabled']
+            args = session.tasks[taskName]['args']
+            kwargs = session.tasks[taskName]['kwargs']
+            kwargs['task_name'] = taskName
+            dependsOn = session.tasks[taskName].get('depends_on')
+            timeout = session.tasks[taskName].get('timeout')
+            schedule = session.tasks[taskName].get('schedule')
+
+            # Remove root logger and create new logger per task.
+            #
+            if verbose:
+                logger = Logger(name='{}'.format(class_name), level='DEBUG').get()
+            else:
+                logger = Logger(name='{}'.format(class_name), level='INFO').get()
+
+            task = None
+            if not enabled:
+                logger.warning("Task is not enabled!")
+            else:
+                try:
+                    # Import module specified in the task definition with the <module_name>
+                    # field, and assign reference to corresponding <class_name> from this
+                    # module to <task>.
+                    #
+                    module = importlib.import_module('{}'.format(module_name))
+                    task = getattr(module, class_name)(logger)
+                except ImportError as e:
+                    logger.critical("Module {} not found.".format(module_name))
+                    logger.critical(repr(e))
+                    exit()
+                except AttributeError as e:
+                    logger.critical("Class {} not found.".format(class_name))
+                    logger.critical(repr(e))
+                    exit()
+            tasks.append({
+                'name': taskName,
+                'description': desc,
+                'task': task,
+                'args': args,
+                'kwargs': kwargs,
+                'depends_on': dependsOn,
+                'timeout': timeout,
+                'schedule': schedule
+            })
+        except KeyError as e:
+            logger.critical("Required key not found in config.")
+            logger.critical(repr(e))
+            exit()
+    return tasks
+
+
+def runTask(task, args, kwargs, profiler=None):
+    """
+    Run a task, <task>, with <args> and <kwargs>, and report its profile and metrics.
+    If a task profiler, <profiler>, is given, the task is run under it.
+    """
+    labels = {'task_name': kwargs.get('task_name'), 'class_name': type(task).__name__}
+    st = time.time()
+    state = 'FAILED'
+    try:
+        if profiler is not None:
+            rtn = profiler.run(kwargs.get('task_name'), task.logger, task.run, args, kwargs)
+        else:
+            rtn = task.run(args, kwargs)
+        if rtn is not False:
+            state = 'DONE'
+        task.reportProfile(kwargs)
+        return rtn
+    finally:
+        registry = metrics.getMetrics()
+        registry.taskRuns.labels(state=state, **labels).inc()
+        registry.taskDuration.labels(**labels).observe(time.time() - st)
+        registry.taskLastRun.labels(**labels).set(time.time())
+
+
+def runOnce(tasks, nWorkers, logger, profiler=None):
+    """ Run each of the tasks in <tasks> once, up to <nWorkers> at a time. """
+    scheduler = Scheduler(logger=logger, nWorkers=nWorkers)
+    for entry in tasks:
+        fn = None
+        if entry['task'] is not None:
+            fn = functools.partial(runTask, entry['task'], entry['args'], entry['kwargs'], profiler)
+        scheduler.add(entry['name'], fn, dependsOn=entry['depends_on'], timeout=entry['timeout'])
+    try:
+        states = scheduler.run()
+    except (KeyError, ValueError) as e:
+        logger.critical("Could not schedule tasks.")
+        logger.critical(repr(e))
+        exit()
+    scheduler.summary()
+
+    # Tasks that timed out are still running, so any work they submitted to the pool
+    # is stopped rather than waited for.
+    #
+    workers.shutdown(terminate='TIMEOUT' in states.values())
+
+
+def runDaemon(tasks, logger, profiler=None):
+    """ Run each of the tasks in <tasks> repeatedly according to their <schedule> field. """
+    from daemon import Daemon
+
+    daemon = Daemon(logger=logger)
+    for entry in tasks:
+        if entry['task'] is None:
+            continue
+        if entry['schedule'] is None:
+            logger.warning("Task {} has no schedule, it will not be run in daemon mode.".format(entry['name']))
+            continue
+        try:
+            daemon.add(entry['name'], functools.partial(runTask, entry['task'], entry['args'], entry['kwargs'],
+                                                        profiler), schedule=entry['schedule'])
+        except ValueError as e:
+            logger.critical("Could not schedule tasks.")
+            logger.critical(repr(e))
+            exit()
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: daemon.stop())
+    try:
+        daemon.run()
+    finally:
+        workers.shutdown()
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument('-t', help="tasks file path",
-                        default="../etc/tasks/stubs.yml",
+    parser.add_argument('-t', help="tasks file path(s)",
+                        default=["../etc/tasks/stubs.yml"],
+                        nargs='+',
                         type=str)
     parser.add_argument('-v', help="verbose?", action='store_true')
+    parser.add_argument('-n', help="maximum number of tasks to run concurrently",
+                        default=1,
+                        type=int)
+    parser.add_argument('--daemon', help="run tasks repeatedly according to their schedule?",
+                        action='store_true')
+    parser.add_argument('--profile-startup', help="report the time taken to import each module?",
+                        action='store_true')
+    parser.add_argument('--profile', help="directory to write a CPU profile for each task to",
+                        default=None,
+                        type=str)
+    parser.add_argument('--profile-top', help="number of functions to list in each task's profile summary",
+                        default=25,
+                        type=int)
+    parser.add_argument('--metrics-port', help="port on which to expose metrics over HTTP (daemon mode)",
+                        default=None,
+                        type=int)
+    parser.add_argument('--metrics-textfile', help="file to write metrics to once all tasks have run",
+                        default=None,
+                        type=str)
+    parser.add_argument('--rucio-cache-ttl', help="seconds for which read-mostly Rucio calls (e.g. RSEs) are cached",
+                        default=300,
+                        type=float)
+    parser.add_argument('--rucio-cache-path', help="file to keep cached read-mostly Rucio calls in between runs",
+                        default=None,
+                        type=str)
+    parser.add_argument('--es-pool-size', help="maximum number of connections to each Elasticsearch node per process",
+                        default=10,
+                        type=int)
+    parser.add_argument('--es-timeout', help="timeout for Elasticsearch requests (s)",
+                        default=10,
+                        type=float)
+    parser.add_argument('--es-no-keep-alive', help="close connections to Elasticsearch after each request?",
+                        action='store_true')
     iargs = parser.parse_args()
 
     # Setup default root loggers for CRITICAL warnings.
@@ -30,47 +217,40 @@ if __name__ == "__main__":
     #
     logger = Logger(name='root', level='INFO').get()
 
-    session = Session(tasks=iargs.t, logger=logger)
-    for task in session.tasks:
-        try:
-            desc = session.tasks[task]['description']
-            module_name = session.tasks[task]['module_name']
-            class_name = session.tasks[task]['class_name']
-            enabled = session.tasks[task]['enabled']
-            args = session.tasks[task]['args']
-            kwargs = session.tasks[task]['kwargs']
-            kwargs['task_name'] = task
+    tasks = []
+    for path in iargs.t:
+        session = Session(tasks=path, logger=logger)
+        for entry in loadTasks(session, iargs.v, logger):
+            if entry['name'] in [existing['name'] for existing in tasks]:
+                logger.critical("Task {} is defined more than once.".format(entry['name']))
+                exit()
+            tasks.append(entry)
 
-            # Remove root logger and create new logger per task.
-            #
-            if iargs.v:
-                logger = Logger(name='{}'.format(class_name), level='DEBUG').get()
-            else:
-                logger = Logger(name='{}'.format(class_name), level='INFO').get()
+    if iargs.profile_startup:
+        importProfiler.stop()
+        importProfiler.report(logger)
 
-            if not enabled:
-                logger.warning("Task is not enabled!")
-                continue
-            try:
-                # Import module specified in the task definition with the <module_name>
-                # field, and assign reference to corresponding <class_name> from this
-                # module to <task>.
-                #
-                module = importlib.import_module('{}'.format(module_name))
-                task = getattr(module, class_name)(logger)
-            except ImportError as e:
-                logger.critical("Module {} not found.".format(module_name))
-                logger.critical(repr(e))
-                exit()
-            except AttributeError as e:
-                logger.critical("Class {} not found.".format(class_name))
-                logger.critical(repr(e))
-                exit()
+    # Size the session-wide pool of worker processes for the most demanding task.
+    #
+    nPoolWorkers = [entry['kwargs'].get('n_workers') for entry in tasks
+                    if entry['task'] is not None and isinstance(entry['kwargs'], dict)]
+    nPoolWorkers = [n for n in nPoolWorkers if n]
+    workers.configure(nWorkers=max(nPoolWorkers) if nPoolWorkers else None, level='DEBUG' if iargs.v else 'INFO')
+    cache.configure(ttl=iargs.rucio_cache_ttl, path=iargs.rucio_cache_path)
+    esClients.configure(maxsize=iargs.es_pool_size, keepAlive=not iargs.es_no_keep_alive, timeout=iargs.es_timeout)
 
-            # Begin task with <args> and <kwargs> as input parameters.
-            #
-            task.run(args, kwargs)
-        except KeyError as e:
-            logger.critical("Required key not found in config.")
-            logger.critical(repr(e))
-            exit()
+    profiler = None
+    if iargs.profile is not None:
+        profiler = TaskProfiler(iargs.profile, nTop=iargs.profile_top)
+
+    # Begin tasks with <args> and <kwargs> as input parameters, either once or
+    # repeatedly on a schedule.
+    #
+    if iargs.daemon:
+        if iargs.metrics_port is not None:
+            metrics.serve(iargs.metrics_port)
+        runDaemon(tasks, logger, profiler)
+    else:
+        runOnce(tasks, iargs.n, logger, profiler)
+    if iargs.metrics_textfile is not None:
+        metrics.writeTextfile(iargs.metrics_textfile)
@@ -0,0 +1,148 @@
+import threading
+import time
+
+
+class Scheduler():
+    """
+    Run a collection of jobs on a bounded pool of worker threads.
+
+    Jobs are started in the order they were added, subject to the concurrency cap
+    and to any dependencies on other jobs. A job is only started once all of the
+    jobs it depends on have completed successfully; otherwise it is skipped.
+    """
+
+    def __init__(self, logger, nWorkers=1):
+        self.logger = logger
+        self.nWorkers = max(1, nWorkers)
+        self._jobs = {}
+        self._cond = threading.Condition()
+
+    def add(self, name, fn, dependsOn=None, timeout=None):
+        """
+        Add a job, <name>, that calls <fn>. The job will only be started once the
+        jobs in <dependsOn> have completed. If <fn> is None, the job is considered
+        disabled.
+        """
+        if isinstance(dependsOn, str):
+            dependsOn = [dependsOn]
+        self._jobs[name] = {
+            'fn': fn,
+            'depends_on': list(dependsOn or []),
+            'timeout': timeout,
+            'state': 'PENDING' if fn is not None else 'DISABLED',
+            'start': None,
+            'end': None
+        }
+
+    def _validate(self):
+        """ Check that all dependencies exist and that there are no cycles. """
+        for name, job in self._jobs.items():
+            for dependency in job['depends_on']:
+                if dependency not in self._jobs:
+                    raise KeyError("Task {} depends on unknown task {}".format(name, dependency))
+
+        done = set()
+
+        def visit(name, path):
+            if name in path:
+                raise ValueError("Circular dependency between tasks: {}".format(
+                    ' -> '.join(path[path.index(name):] + [name])))
+            if name in done:
+                return
+            for dependency in self._jobs[name]['depends_on']:
+                visit(dependency, path + [name])
+            done.add(name)
+
+        for name in self._jobs:
+            visit(name, [])
+
+    def _execute(self, name, job):
+        """ Target for worker threads. """
+        # Tasks exit() on some errors, so SystemExit is caught too, as otherwise the
+        # job would never complete.
+        #
+        try:
+            rtn = job['fn']()
+            state = 'FAILED' if rtn is False else 'DONE'
+        except BaseException as e:
+            self.logger.critical("Task {} raised an exception.".format(name))
+            self.logger.critical(repr(e))
+            state = 'FAILED'
+        with self._cond:
+            if job['state'] == 'RUNNING':   # otherwise it has already timed out
+                job['state'] = state
+                job['end'] = time.time()
+            self._cond.notify_all()
+
+    def _dependencyState(self, job):
+        """ Get whether a pending job is READY to start, should WAIT, or should be SKIPPED. """
+        states = [self._jobs[dependency]['state'] for dependency in job['depends_on']]
+        if any(state not in ('PENDING', 'RUNNING', 'DONE') for state in states):
+            return 'SKIPPED'
+        if all(state == 'DONE' for state in states):
+            return 'READY'
+        return 'WAIT'
+
+    def _timeOut(self, now):
+        """
+        Time out any running jobs that have exceeded their allowance. Note that it's not possible to stop a running
+        thread, so timed out jobs are abandoned and the slot is released for the next job.
+        """
+        for name, job in self._jobs.items():
+            if job['state'] == 'RUNNING' and job['timeout'] is not None and now - job['start'] > job['timeout']:
+                self.logger.critical("Task {} timed out after {}s.".format(name, job['timeout']))
+                job['state'] = 'TIMEOUT'
+                job['end'] = now
+
+    def _skip(self):
+        """ Skip jobs with failed dependencies, repeating until nothing else changes as a skip can cascade. """
+        nSkipped = -1
+        while nSkipped != 0:
+            nSkipped = 0
+            for name, job in self._jobs.items():
+                if job['state'] == 'PENDING' and self._dependencyState(job) == 'SKIPPED':
+                    self.logger.warning("Skipping task {} as a dependency did not complete.".format(name))
+                    job['state'] = 'SKIPPED'
+                    nSkipped += 1
+
+    def _start(self):
+        """ Start as many ready jobs as the concurrency cap allows, returning the number now running. """
+        nRunning = len([job for job in self._jobs.values() if job['state'] == 'RUNNING'])
+        for name, job in self._jobs.items():
+            if nRunning >= self.nWorkers:
+                break
+            if job['state'] == 'PENDING' and self._dependencyState(job) == 'READY':
+                job['state'] = 'RUNNING'
+                job['start'] = time.time()
+                threading.Thread(target=self._execute, args=(name, job), name=name, daemon=True).start()
+                nRunning += 1
+        return nRunning
+
+    def run(self):
+        """ Run all jobs, blocking until each has either finished, failed, timed out or been skipped. """
+        self._validate()
+        with self._cond:
+            while True:
+                self._timeOut(time.time())
+                self._skip()
+                nRunning = self._start()
+                if nRunning == 0 and not any(job['state'] == 'PENDING' for job in self._jobs.values()):
+                    break
+
+                # Wait until a job finishes, or until the next timeout is due.
+                #
+                deadlines = [job['start'] + job['timeout'] for job in self._jobs.values()
+                             if job['state'] == 'RUNNING' and job['timeout'] is not None]
+                self._cond.wait(timeout=max(0, min(deadlines) - time.time()) if deadlines else None)
+
+        return {name: job['state'] for name, job in self._jobs.items()}
+
+    def summary(self):
+        """ Log the state and wall time of each job. """
+        self.logger.info("{:<40} {:<10} {:>10}".format("task", "state", "wall (s)"))
+        for name, job in self._jobs.items():
+            if job['start'] is not None and job['end'] is not None:
+                wall = "{:.3f}".format(job['end'] - job['start'])
+            else:
+                wall = "-"
+            self.logger.info("{:<40} {:<10} {:>10}".format(name, job['state'], wall))
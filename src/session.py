@@ -1,20 +1,174 @@
+import hashlib
+import json
+import os
+
 import requests
 import yaml
 
+from utility import getCacheDir
+
 
 class Session():
     def __init__(self, tasks, logger):
         self.logger = logger
         self._tasks = None
 
+        try:
+            self._cacheDir = getCacheDir("session")
+        except OSError as e:
+            self.logger.warning("Could not create cache directory, caching disabled: {}".format(repr(e)))
+            self._cacheDir = None
+
         self._parseTasksFile(tasks)
 
+    def _cachePath(self, key, extension):
+        """ Get the path of the cache file for a key, <key>, with extension, <extension>, or None if not caching. """
+        if self._cacheDir is None:
+            return None
+        return os.path.join(self._cacheDir, "{}.{}".format(hashlib.sha256(key.encode("UTF-8")).hexdigest(), extension))
+
+    def _readCachedTasksFile(self, url):
+        """
+        Read the cached copy of a remote tasks file, if any, returning its contents
+        and the headers that make a request for it conditional on it having changed.
+        """
+        metadataPath = self._cachePath(url, "json")
+        contentsPath = self._cachePath(url, "yml")
+        if metadataPath is None:
+            return None, {}
+        try:
+            with open(metadataPath) as f:
+                metadata = json.load(f)
+            with open(contentsPath) as f:
+                contents = f.read()
+        except (IOError, ValueError):
+            return None, {}
+        headers = {}
+        if metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata.get("last_modified"):
+            headers["If-Modified-Since"] = metadata["last_modified"]
+        return contents, headers
+
+    def _writeCachedTasksFile(self, url, response):
+        """ Cache the contents of a remote tasks file, <url>, from a response, <response>. """
+        metadataPath = self._cachePath(url, "json")
+        contentsPath = self._cachePath(url, "yml")
+        if metadataPath is None:
+            return
+        try:
+            with open(contentsPath, "w") as f:
+                f.write(response.text)
+            with open(metadataPath, "w") as f:
+                json.dump({
+                    "url": url,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified")
+                }, f)
+        except IOError as e:
+            self.logger.warning("Could not cache tasks file: {}".format(repr(e)))
+
+    def _fetchTasksFile(self, url):
+        """
+        Fetch a remote tasks file. If a copy has been cached previously, the request
+        is made conditional on the file having changed since, and the copy is used
+        if the file can't be fetched.
+        """
+        cachedContents, headers = self._readCachedTasksFile(url)
+        try:
+            response = requests.get(url, headers=headers)
+        except requests.exceptions.RequestException as e:
+            response = None
+            error = repr(e)
+
+        if response is not None and response.status_code == 304 and cachedContents is not None:
+            self.logger.debug("Tasks file not modified, using cached copy.")
+            return cachedContents
+        if response is not None and response.ok:
+            self._writeCachedTasksFile(url, response)
+            return response.text
+
+        if response is not None:
+            error = "status code {}".format(response.status_code)
+        if cachedContents is not None:
+            self.logger.warning("Could not fetch tasks file ({}), using cached copy.".format(error))
+            return cachedContents
+        self.logger.critical("Could not fetch tasks file ({}).".format(error))
+        exit()
+
+    def _renderTasksFile(self, contents):
+        """
+        Render the Jinja2 templating in the tasks file contents, <contents>, using
+        environment variables as the context.
+        """
+        import jinja2
+
+        try:
+            return jinja2.Template(contents).render(**os.environ)
+        except jinja2.TemplateError as e:
+            self.logger.critical("Could not render tasks file template.")
+            self.logger.critical(repr(e))
+            exit()
+
+    def _readParsedTasks(self, parsedPath):
+        """ Read a cached parse of a tasks file from <parsedPath>, returning None if there is none. """
+        try:
+            with open(parsedPath) as f:
+                tasks = json.load(f)
+        except (IOError, ValueError):
+            return None
+        self.logger.debug("Using cached parse of tasks file.")
+        return tasks
+
+    def _writeParsedTasks(self, parsedPath, tasks):
+        """
+        Cache a parse of a tasks file, <tasks>, at <parsedPath>. Parses that JSON
+        can't represent exactly (e.g. with dates or non-string keys) are not cached.
+        As rendered templates may contain secrets, cache files are only readable by
+        the owner.
+        """
+        try:
+            payload = json.dumps(tasks)
+            if json.loads(payload) != tasks:
+                payload = None
+        except (TypeError, ValueError):
+            payload = None
+        if payload is None:
+            self.logger.debug("Parsed tasks file can't be cached as JSON.")
+            return
+        try:
+            fd = os.open(parsedPath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(payload)
+        except IOError as e:
+            self.logger.warning("Could not cache parsed tasks file: {}".format(repr(e)))
+
+    def _loadTasks(self, contents):
+        """
+        Parse the tasks file contents, <contents>. The parsed result is cached on
+        disk as JSON keyed by the hash of the contents so that an unchanged file
+        need not be parsed again.
+        """
+        parsedPath = self._cachePath(contents, "parsed.json")
+        if parsedPath is not None:
+            tasks = self._readParsedTasks(parsedPath)
+            if tasks is not None:
+                return tasks
+
+        tasks = yaml.safe_load(contents)
+        if parsedPath is not None:
+            self._writeParsedTasks(parsedPath, tasks)
+        return tasks
+
     def _parseTasksFile(self, path):
-        """ Parse a configuration yaml file. """
+        """
+        Parse a configuration yaml file. Files with a .j2 extension are rendered as
+        Jinja2 templates first.
+        """
         self.logger.info("Parsing tasks file: {}".format(path))
         contents = None
         if path.startswith('http'):
-            contents = requests.get(path).text
+            contents = self._fetchTasksFile(path)
         else:
             try:
                 with open(path) as f:
@@ -23,8 +177,10 @@ class Session():
                 self.logger.critical("Tasks file not found.")
                 self.logger.critical(repr(e))
                 exit()
+        if path.endswith('.j2'):
+            contents = self._renderTasksFile(contents)
         try:
-            self._tasks = yaml.safe_load(contents)
+            self._tasks = self._loadTasks(contents)
         except (yaml.scanner.ScannerError, yaml.parser.ParserError) as e:
             self.logger.critical("Could not parse yaml.")
             self.logger.critical(repr(e))
@@ -1,7 +1,4 @@
 import datetime
-import dateparser
-from kubernetes import client, config
-import uuid
 
 from common.es.wrappers import Wrappers as ESWrappers
 from tasks.task import Task
@@ -27,6 +24,9 @@ class ProbesDaemons(Task):
             self.logger.critical(repr(e))
             return False
 
+        import dateparser
+        from kubernetes import client, config
+
         config.load_kube_config(config_file=kubeConfigPath)
         v1 = client.CoreV1Api()
 
@@ -1,13 +1,6 @@
 import datetime
-import dateparser
 import json
-from kubernetes import client, config
-import numpy as np
 import requests
-import pytz
-import uuid
-
-import fts3.rest.client.easy as fts3
 
 from common.es.wrappers import Wrappers as ESWrappers
 from tasks.task import Task
@@ -54,15 +47,16 @@ class ProbesFTSTransfers(Task):
                 if database["type"] == "es":
                     self.logger.debug("Injecting information into ES database...")
                     es = ESWrappers(database["uri"], self.logger)
-                    for transfer in transfers:
-                        es._index(
-                            index=database["index"],
-                            documentID=transfer['file_id'],
-                            body={
-                                '@timestamp': int(datetime.datetime.now().strftime("%s"))*1000,
-                                **transfer
-                            }
-                        )
+                    with es.bulk():
+                        for transfer in transfers:
+                            es._index(
+                                index=database["index"],
+                                documentID=transfer['file_id'],
+                                body={
+                                    '@timestamp': int(datetime.datetime.now().strftime("%s"))*1000,
+                                    **transfer
+                                }
+                            )
 
         self.toc()
         self.logger.info("Finished in {}s".format(round(self.elapsed)))
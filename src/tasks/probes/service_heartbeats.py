@@ -1,8 +1,6 @@
 import datetime
-import dateparser
 import json
 import requests
-import uuid
 
 from common.es.wrappers import Wrappers as ESWrappers
 from tasks.task import Task
@@ -1,13 +1,6 @@
 import datetime
-import dateparser
 import json
-from kubernetes import client, config
-import numpy as np
 import requests
-import pytz
-import uuid
-
-import fts3.rest.client.easy as fts3
 
 from common.es.wrappers import Wrappers as ESWrappers
 from tasks.task import Task
@@ -32,6 +25,10 @@ class ProbesServiceMetricsFTS(Task):
             self.logger.critical(repr(e))
             return False
 
+        import dateparser
+        import numpy as np
+        import pytz
+
         metrics = {}
 
         transfers = dict(json.loads(requests.get(
@@ -11,6 +11,64 @@ class ReportDaily(Task):
     def __init__(self, logger):
         super().__init__(logger)
 
+    TERMS = ["is_submitted", "is_stuck", "is_replicating", "is_done"]
+
+    @classmethod
+    def _parseAggregations(cls, res, rses):
+        """
+        Get the number of documents in each state for each RSE as src and as dst
+        from the aggregations in a search response, <res>. RSEs without documents
+        have counts of zero.
+        """
+        nDocsAsSrc = {rse: {term: 0 for term in cls.TERMS} for rse in rses}
+        nDocsAsDst = {rse: {term: 0 for term in cls.TERMS} for rse in rses}
+        for aggregation, nDocs in (("as_src", nDocsAsSrc), ("as_dst", nDocsAsDst)):
+            for bucket in res["aggregations"][aggregation]["buckets"]:
+                for term in cls.TERMS:
+                    nDocs[bucket["key"]][term] = int(bucket[term]["value"])
+        return nDocsAsSrc, nDocsAsDst
+
+    def _countDocuments(self, es, index, usingTaskName, searchRangeGTE, searchRangeLTE, rses):
+        """
+        Count the documents in each state with each RSE as src and as dst, all at
+        once: the documents are bucketed by RSE and the state flags (0 or 1) are
+        summed in each bucket. A terms aggregation needs a size of at least one,
+        even if there are no RSEs.
+        """
+        sums = {term: {"sum": {"field": term}} for term in self.TERMS}
+        res = es.search(
+            index=index,
+            maxRows=0,
+            body={
+                "query": {
+                    "bool": {
+                        "filter": [
+                            {"term": {"task_name.keyword": usingTaskName}},
+                            {
+                                "range": {
+                                    "created_at": {
+                                        "gte": searchRangeGTE,
+                                        "lte": searchRangeLTE,
+                                    }
+                                }
+                            },
+                        ]
+                    }
+                },
+                "aggs": {
+                    "as_src": {
+                        "terms": {"field": "from_rse.keyword", "include": rses, "size": max(1, len(rses))},
+                        "aggs": sums
+                    },
+                    "as_dst": {
+                        "terms": {"field": "to_rse.keyword", "include": rses, "size": max(1, len(rses))},
+                        "aggs": sums
+                    }
+                }
+            },
+        )
+        return self._parseAggregations(res, rses)
+
     def run(self, args, kwargs):
         super().run()
         self.tic()
@@ -21,7 +79,6 @@ class ReportDaily(Task):
             databaseIndex = kwargs["database"]["index"]
             databaseSearchRangeLTE = kwargs["database"]["search_range_lte"]
             databaseSearchRangeGTE = kwargs["database"]["search_range_gte"]
-            databaseMaxRows = kwargs["database"]["max_rows"]
             percentageStuckWarningThreshold = kwargs[
                 "percentage_stuck_warning_threshold"
             ]
@@ -34,89 +91,16 @@ class ReportDaily(Task):
             self.logger.critical(repr(e))
             return False
 
-        # Retrieve data for the report from the database.
+        # Retrieve data for the report from the database. The counts come from a
+        # single aggregation query, so database.max_rows is not used and is
+        # ignored if set.
         #
         if databaseType == "es":
             es = ESRucio(databaseUri, self.logger)
 
-            nDocsAsSrc = {}
-            nDocsAsDst = {}
-            for rse in rses:
-                nDocsAsSrc[rse] = {}
-                nDocsAsDst[rse] = {}
-                # Query the database for the number of documents in each
-                # state.
-                #
-                for term in [
-                    "is_submitted",
-                    "is_stuck",
-                    "is_replicating",
-                        "is_done"]:
-                    # With RSE as src.
-                    res = es.search(
-                        index=databaseIndex,
-                        maxRows=databaseMaxRows,
-                        body={
-                            "query": {
-                                "bool": {
-                                    "filter": [
-                                        {"term": {term: 1}},
-                                        {
-                                            "term": {
-                                                "task_name.keyword":
-                                                    usingTaskName
-                                            }
-                                        },
-                                        {"term": {"from_rse.keyword": rse}},
-                                        {
-                                            "range": {
-                                                "created_at": {
-                                                    "gte":
-                                                        databaseSearchRangeGTE,
-                                                    "lte":
-                                                        databaseSearchRangeLTE,
-                                                }
-                                            }
-                                        },
-                                    ]
-                                }
-                            }
-                        },
-                    )
-                    nDocsAsSrc[rse][term] = len(res["hits"]["hits"])
-
-                    # With RSE as dst.
-                    res = es.search(
-                        index=databaseIndex,
-                        maxRows=databaseMaxRows,
-                        body={
-                            "query": {
-                                "bool": {
-                                    "filter": [
-                                        {"term": {term: 1}},
-                                        {"term": {
-                                                "task_name.keyword":
-                                                    usingTaskName
-                                            }
-                                        },
-                                        {"term": {"to_rse.keyword": rse}},
-                                        {
-                                            "range": {
-                                                "created_at": {
-                                                    "gte":
-                                                        databaseSearchRangeGTE,
-                                                    "lte":
-                                                        databaseSearchRangeLTE,
-                                                }
-                                            }
-                                        },
-                                    ]
-                                }
-                            }
-                        },
-                    )
-                    nDocsAsDst[rse][term] = len(res["hits"]["hits"])
-        
+            nDocsAsSrc, nDocsAsDst = self._countDocuments(
+                es, databaseIndex, usingTaskName, databaseSearchRangeGTE, databaseSearchRangeLTE, rses)
+
         # Format the report depending on the webhook type.
         #
         for webhook in webhooks:
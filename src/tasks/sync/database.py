@@ -1,8 +1,10 @@
-import logging
-from multiprocessing import Pool
+from collections import deque
+import math
 
 from common.es.rucio import Rucio as ESRucio
 from tasks.task import Task
+from utility import chunk
+from workers import WorkerLimit, getESRucio, getLogger
 
 
 class SyncESDatabase(Task):
@@ -12,11 +14,21 @@ class SyncESDatabase(Task):
         super().__init__(logger)
 
     @staticmethod
-    def _async_updateRuleWithDID(loggerName, idx, databaseUri, ruleID, databaseIndex, ftsEndpoint):
-        logger = logging.getLogger(loggerName)
-        logger.info("Processing entry #{}".format(idx))
-        es = ESRucio(databaseUri, logger)
-        es.updateRuleWithDID(ruleID, databaseIndex, ftsEndpoint)
+    def _async_updateRulesWithDIDs(loggerName, idx, databaseUri, previous, databaseIndex, ftsEndpoint, concurrency):
+        logger = getLogger(loggerName)
+        logger.info("Processing entries #{}-{}".format(idx, idx + len(previous) - 1))
+        es = getESRucio(databaseUri, logger)
+        es.updateRulesWithDIDs(
+            list(previous), databaseIndex, ftsEndpoint, concurrency=concurrency, previous=previous)
+
+    def _wait(self, result):
+        """ Wait for the AsyncResult of a batch, <result>, logging it if it failed. """
+        result.wait()
+        if not result.successful():
+            try:
+                result.get()
+            except Exception as e:
+                self.logger.warning("Failed to update entry: {}".format(repr(e)))
 
     def run(self, args, kwargs):
         super().run()
@@ -24,13 +36,15 @@ class SyncESDatabase(Task):
         try:
             ftsEndpoint = kwargs['fts_endpoint']
             taskNameToUpdate = kwargs['task_name_to_update']
-            nWorkers = kwargs['n_workers']
             updateAll = kwargs['update_all']
             databaseUri = kwargs['database']['uri']
             databaseIndex = kwargs['database']['index']
             databaseSearchRangeLTE = kwargs['database']['search_range_lte']
             databaseSearchRangeGTE = kwargs['database']['search_range_gte']
-            databaseMaxRows = kwargs['database']['max_rows']
+            databaseMaxRows = kwargs['database'].get('max_rows')
+            batchSize = kwargs.get('batch_size', 100)
+            rucioConcurrency = kwargs.get('rucio_concurrency', 100)
+            nWorkers = kwargs.get('n_workers')
         except KeyError as e:
             self.logger.critical("Could not find necessary kwarg for task.")
             self.logger.critical(repr(e))
@@ -68,19 +82,38 @@ class SyncESDatabase(Task):
                 }
             )
             
-        res = es.search(index=databaseIndex, maxRows=databaseMaxRows, body=query)
-        nDocs = len(res['hits']['hits'])
+        with self.span("search"):
+            nDocs = es.count(index=databaseIndex, body=query)
+        if databaseMaxRows is not None:
+            nDocs = min(nDocs, databaseMaxRows)
         self.logger.info("Found {} documents".format(nDocs))
 
         # For each of these documents, try to update fields in the ES database.
+        # Documents are updated in batches of up to <batchSize> so that the
+        # replicas for each batch can be listed at once, but with at least as
+        # many batches as the task has workers.
+        #
+        # The rule IDs of the documents, with the fields of each that the update
+        # compares against, are streamed from the database and handed to the
+        # workers a batch at a time, with no more than one batch in flight per
+        # worker and a few per worker outstanding, so that memory use does not grow
+        # with the number of documents.
         #
-        pool = Pool(nWorkers)
-        for idx, hit in enumerate(res['hits']['hits']):
-            ruleID = hit['_source']['rule_id']
-            pool.apply_async(self._async_updateRuleWithDID, args=(
-                self.logger.name, idx, databaseUri, ruleID, databaseIndex, ftsEndpoint))
-        pool.close()
-        pool.join()
+        limit = WorkerLimit(nWorkers)
+        batchSize = max(1, min(batchSize, math.ceil(nDocs / limit.nWorkers)))
+        with self.span("update"):
+            results = deque()
+            hits = es.scan(
+                index=databaseIndex, body=query, source=["rule_id", "state", "updated_at"], maxRows=databaseMaxRows)
+            for idx, hitsBatch in enumerate(chunk(hits, batchSize)):
+                previous = {hit['_source']['rule_id']: hit['_source'] for hit in hitsBatch}
+                results.append(limit.applyAsync(self._async_updateRulesWithDIDs, args=(
+                    self.logger.name, idx * batchSize, databaseUri, previous, databaseIndex, ftsEndpoint,
+                    rucioConcurrency)))
+                while len(results) > limit.nWorkers * 4:
+                    self._wait(results.popleft())
+            while results:
+                self._wait(results.popleft())
 
         self.toc()
         self.logger.info("Finished in {}s".format(round(self.elapsed)))
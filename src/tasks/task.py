@@ -1,6 +1,22 @@
 import abc
-import inspect
+import contextlib
+from datetime import datetime
+import json
 import time
+import uuid
+
+from utility import getRSS
+
+
+class Span():
+    """ Resource usage for a single phase of a task. """
+
+    def __init__(self, name):
+        self.name = name
+        self.bytes = 0
+        self.wall = 0
+        self.cpu = 0
+        self.rssDelta = 0
 
 
 class Task():
@@ -10,6 +26,8 @@ class Task():
         self.logger = logger
         self.start = None
         self.end = None
+        self.runID = None
+        self.spans = []
 
         self.logger.debug("Constructing instance of {}()".format(
             type(self).__name__))
@@ -17,8 +35,9 @@ class Task():
     @ abc.abstractmethod
     def run(self):
         """ Entry point for all derived task classes. """
-        self.logger.info("Executing {}.{}()".format(
-            type(self).__name__, inspect.stack()[0][3]))
+        self.logger.info("Executing {}.run()".format(type(self).__name__))
+        self.runID = str(uuid.uuid4())
+        self.spans = []
 
     def tic(self):
         """ Start a timer. """
@@ -37,3 +56,74 @@ class Task():
             return round(time.time() - self.start, 3)
         else:
             return round(self.end - self.start, 3)
+
+    @contextlib.contextmanager
+    def span(self, name, nBytes=0):
+        """
+        Record the wall time, CPU time, change in RSS and bytes moved for a phase,
+        <name>, of the task. Bytes moved can either be passed as <nBytes> or added
+        to the <bytes> attribute of the yielded span. CPU time is that of the
+        calling thread only, so that concurrently running tasks aren't counted, nor
+        is work done by other threads or worker processes.
+        """
+        span = Span(name)
+        span.bytes = nBytes
+        wallStart = time.perf_counter()
+        cpuStart = time.thread_time()
+        rssStart = getRSS()
+        try:
+            yield span
+        finally:
+            span.wall = time.perf_counter() - wallStart
+            span.cpu = time.thread_time() - cpuStart
+            span.rssDelta = getRSS() - rssStart
+            self.spans.append(span)
+
+    def getProfile(self, taskName=None):
+        """
+        Get the profile for the last run, aggregating spans with the same name
+        into phases.
+        """
+        phases = {}
+        for span in self.spans:
+            phase = phases.setdefault(span.name, {
+                'count': 0,
+                'wall': 0,
+                'cpu': 0,
+                'rss_delta': 0,
+                'bytes': 0
+            })
+            phase['count'] += 1
+            phase['wall'] += span.wall
+            phase['cpu'] += span.cpu
+            phase['rss_delta'] += span.rssDelta
+            phase['bytes'] += span.bytes
+        return {
+            '@timestamp': int(datetime.now().strftime("%s"))*1000,
+            'run_id': self.runID,
+            'task_name': taskName,
+            'class_name': type(self).__name__,
+            'elapsed': self.elapsed,
+            'phases': phases
+        }
+
+    def reportProfile(self, kwargs):
+        """
+        Log the profile for the last run as JSON and push it to any databases in
+        <kwargs> that have a <profile_index> set.
+        """
+        if not self.spans:
+            return
+        profile = self.getProfile(taskName=kwargs.get('task_name'))
+        self.logger.info("Profile: {}".format(json.dumps(profile)))
+
+        databases = kwargs.get('databases') or []
+        if kwargs.get('database'):
+            databases = databases + [kwargs['database']]
+        for database in databases:
+            if database.get('type', 'es') == 'es' and database.get('profile_index'):
+                from common.es.wrappers import Wrappers as ESWrappers
+
+                self.logger.debug("Injecting profile into ES database...")
+                es = ESWrappers(database['uri'], self.logger)
+                es._index(index=database['profile_index'], documentID=self.runID, body=profile)
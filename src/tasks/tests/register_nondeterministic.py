@@ -1,8 +1,6 @@
 import os
-from common.rucio.helpers import createCollection
-
-from gfal2 import Gfal2Context
 
+from common.rucio.helpers import createCollection
 from common.rucio.wrappers import RucioWrappersAPI
 from common.rucio.pfn import PFN
 from tasks.task import Task
@@ -34,6 +32,8 @@ class TestRegisterNondeterministic(Task):
 
         # Set up GFAL2 context.
         #
+        from gfal2 import Gfal2Context
+
         gfal = Gfal2Context()
 
         # Verify the scheme, hostname and prefix (protocol) is supported by this RSE.
@@ -1,4 +1,7 @@
+import contextlib
+
 from common.es.rucio import Rucio as ESRucio
+from common.rucio.helpers import ReplicaResolver
 from common.rucio.wrappers import RucioWrappersAPI
 from tasks.task import Task
 from utility import bcolors
@@ -29,41 +32,66 @@ class TestReplication(Task):
         #
         rucio = RucioWrappersAPI()
 
-        for did in dids:
-            self.logger.debug("Adding replication rules...")
-            for rse in rses:
-                self.logger.debug(
-                    bcolors.OKGREEN + "RSE (dst): {}".format(rse) + bcolors.ENDC
-                )
-                try:
-                    rtn = rucio.addRule(
-                        did, 1, rse, lifetime=lifetime, asynchronous=asynchronous
-                    )
-                    self.logger.debug("Rule ID: {}".format(rtn[0]))
-                except Exception as e:
-                    self.logger.warning(repr(e))
-                    continue
-                self.logger.debug("Replication rules added")
+        # Add replication rules for all DIDs in as few requests as possible.
+        #
+        self.logger.debug("Adding replication rules...")
+        for rse in rses:
+            self.logger.debug(
+                bcolors.OKGREEN + "RSE (dst): {}".format(rse) + bcolors.ENDC
+            )
+        rules = [
+            {"did": did, "copies": 1, "dst": rse, "lifetime": lifetime, "asynchronous": asynchronous}
+            for did in dids for rse in rses
+        ]
+        try:
+            results = rucio.addRules(rules)
+        except Exception as e:
+            results = [e] * len(rules)
+        replicatedDIDs = []
+        for rule, result in zip(rules, results):
+            if isinstance(result, Exception):
+                self.logger.warning(repr(result))
+                continue
+            self.logger.debug("Rule ID: {}".format(result))
+            if rule["did"] not in replicatedDIDs:
+                replicatedDIDs.append(rule["did"])
+        self.logger.debug("Replication rules added")
 
+        # List the replicas of all replicated DIDs at once.
+        #
+        replicas = ReplicaResolver()
+        try:
+            replicas.resolve(replicatedDIDs)
+        except Exception as e:
+            self.logger.warning("Error listing replicas: {}".format(repr(e)))
+
+        # Push corresponding rules to databases, sending the documents for all
+        # DIDs in bulk requests.
+        #
+        esDatabases = [
+            (ESRucio(database["uri"], self.logger), database) for database in databases if database["type"] == "es"
+        ]
+        with contextlib.ExitStack() as stack:
+            for es, database in esDatabases:
+                stack.enter_context(es.bulk())
+            for did in replicatedDIDs:
                 # Get information about the DID: size and did_type
                 metadata = rucio.getMetadata(did)
 
-                # Push corresponding rules to database
-                for database in databases:
-                    if database["type"] == "es":
-                        self.logger.debug("Injecting rules into ES database...")
-                        es = ESRucio(database["uri"], self.logger)
-                        es.pushRulesForDID(
-                            did,
-                            index=database["index"],
-                            baseEntry={
-                                "task_name": taskName,
-                                "file_size": metadata["bytes"],
-                                "type": metadata["did_type"].lower(),
-                                "n_files": 1,
-                                "is_submitted": 1,
-                            },
-                        )
+                for es, database in esDatabases:
+                    self.logger.debug("Injecting rules into ES database...")
+                    es.pushRulesForDID(
+                        did,
+                        index=database["index"],
+                        replicas=replicas,
+                        baseEntry={
+                            "task_name": taskName,
+                            "file_size": metadata["bytes"],
+                            "type": metadata["did_type"].lower(),
+                            "n_files": 1,
+                            "is_submitted": 1,
+                        },
+                    )
 
         self.toc()
         self.logger.info("Finished in {}s".format(round(self.elapsed)))
@@ -1,15 +1,14 @@
-import logging
-from multiprocessing import Pool
+from datetime import datetime
 import os
 import shutil
 import time
 import uuid
 
-from common.es.rucio import Rucio as ESRucio
 from common.rucio.helpers import createCollection
-from common.rucio.wrappers import RucioWrappersCLI
+from common.rucio.wrappers import RucioWrappersAPI, RucioWrappersCLI, RucioWrappersInProcess
 from tasks.task import Task
-from utility import bcolors, generateRandomFilesDir
+from utility import bcolors, generateRandomFilesDir, getRandomFilesDirName
+from workers import WorkerLimit, getESRucio, getLogger
 
 
 def uploadDirReplicate(
@@ -26,39 +25,53 @@ def uploadDirReplicate(
     dirIdx=1,
     nDirs=1,
     namingPrefix="",
+    datasetDID=None,
+    useCLI=False,
+    attachDataset=False,
 ):
     """
     Upload a dir containing <nFiles> of <fileSize> to <rseSrc>, attaching
-    to <datasetDID> and adding replication rules for each of <rsesDst>.
+    to <datasetDID> and adding replication rules for each of <rsesDst>. If
+    <datasetDID> is None, the dataset is created and attached to <parentDID>,
+    as is an existing <datasetDID> if <attachDataset>. Rucio is called via CLI
+    subprocesses if <useCLI>, otherwise in-process.
     """
-    logger = logging.getLogger(loggerName)
+    logger = getLogger(loggerName)
     logger.debug("Uploading directory {} of {}".format(dirIdx, nDirs))
 
     # Instantiate Rucio
     #
-    rucio = RucioWrappersCLI()
+    rucio = RucioWrappersCLI() if useCLI else RucioWrappersInProcess()
 
     logger.info(bcolors.OKBLUE + "RSE (src): {}".format(rseSrc) + bcolors.ENDC)
 
-    # Generate directory of files to be uploaded.
+    # Generate directory of files to be uploaded, named after the dataset if it
+    # has already been created.
     #
-    dirPath = generateRandomFilesDir(
-        nFiles, fileSize, dirId=dirIdx, prefix=namingPrefix
-    )
+    if datasetDID is not None:
+        dirPath = generateRandomFilesDir(
+            nFiles, fileSize, dirId=dirIdx, prefix=namingPrefix, dirName=datasetDID.split(":")[1]
+        )
+    else:
+        dirPath = generateRandomFilesDir(
+            nFiles, fileSize, dirId=dirIdx, prefix=namingPrefix
+        )
 
-    # Create dataset DID based on directory name.
-    #
-    datasetName = os.path.basename(dirPath)
-    datasetDID = createCollection(loggerName, scope, name=datasetName)
+        # Create dataset DID based on directory name.
+        #
+        datasetName = os.path.basename(dirPath)
+        datasetDID = createCollection(loggerName, scope, name=datasetName)
+        attachDataset = True
 
     # Attach directory dataset to parent container DID.
     #
-    logger.debug("Attaching DID {} to {}".format(datasetDID, parentDID))
-    try:
-        rucio.attach(todid=parentDID, dids=datasetDID)
-    except Exception as e:
-        logger.warning(repr(e))
-    logger.debug("Attached DID to collection.")
+    if attachDataset:
+        logger.debug("Attaching DID {} to {}".format(datasetDID, parentDID))
+        try:
+            rucio.attach(todid=parentDID, dids=datasetDID)
+        except Exception as e:
+            logger.warning(repr(e))
+        logger.debug("Attached DID to collection.")
 
     # Upload to <rseSrc>
     #
@@ -104,7 +117,7 @@ def uploadDirReplicate(
             for database in databases:
                 if database["type"] == "es":
                     logger.debug("Injecting upload rules into ES database...")
-                    es = ESRucio(database["uri"], logger)
+                    es = getESRucio(database["uri"], logger)
                     es.pushRulesForDID(
                         datasetDID, index=database["index"], baseEntry=entry)
 
@@ -134,7 +147,7 @@ def uploadDirReplicate(
                 for database in databases:
                     if database["type"] == "es":
                         logger.debug("Injecting replication rules into ES database... ")
-                        es = ESRucio(database["uri"], logger)
+                        es = getESRucio(database["uri"], logger)
                         es.pushRulesForDID(
                             datasetDID,
                             index=database["index"],
@@ -165,7 +178,6 @@ class TestReplicationBulk(Task):
         super().run()
         self.tic()
         try:
-            nWorkers = kwargs["n_workers"]
             nDirs = kwargs["n_dirs"]
             nFiles = kwargs["n_files"]
             fileSize = kwargs["file_size"]
@@ -177,6 +189,8 @@ class TestReplicationBulk(Task):
             namingPrefix = kwargs.get("naming_prefix", "")
             databases = kwargs["databases"]
             taskName = kwargs["task_name"]
+            useCLI = kwargs.get("use_cli", False)
+            nWorkers = kwargs.get("n_workers")
         except KeyError as e:
             self.logger.critical("Could not find necessary kwarg for task.")
             self.logger.critical(repr(e))
@@ -193,7 +207,31 @@ class TestReplicationBulk(Task):
             parentDID = createCollection(
                 loggerName, scope, name=containerName, collectionType="CONTAINER")
 
-        self.logger.debug("Launching pool of {} workers".format(nWorkers))
+        # Create a dataset for each directory and attach them all to <parentDID> in
+        # bulk, rather than one directory at a time in the workers. If the datasets
+        # were created but couldn't be attached, the workers attach them instead.
+        #
+        timestamp = datetime.now()
+        datasetDIDs = [
+            "{}:{}".format(scope, getRandomFilesDirName(
+                nFiles, fileSize, dirId=dirIdx, prefix=namingPrefix, timestamp=timestamp))
+            for dirIdx in range(1, nDirs + 1)
+        ]
+        rucio = RucioWrappersAPI()
+        attachDatasets = False
+        try:
+            rucio.addDIDs(datasetDIDs, "DATASET")
+        except Exception as e:
+            self.logger.warning("Failed to create datasets in bulk, creating per directory: {}".format(repr(e)))
+            datasetDIDs = [None] * nDirs
+        else:
+            try:
+                rucio.attach(todid=parentDID, dids=datasetDIDs)
+            except Exception as e:
+                self.logger.warning("Failed to attach datasets in bulk, attaching per directory: {}".format(repr(e)))
+                attachDatasets = True
+
+        self.logger.debug("Submitting {} directories to pool of workers".format(nDirs))
 
         # Create array of args for each process
         #
@@ -212,15 +250,17 @@ class TestReplicationBulk(Task):
                 dirIdx,
                 nDirs,
                 namingPrefix,
+                datasetDIDs[dirIdx - 1],
+                useCLI,
+                attachDatasets,
             )
             for dirIdx in range(1, nDirs + 1)
         ]
 
-        # Launch pool of worker processes, and join() to wait for all to complete
+        # Submit to the session's pool of worker processes, using no more than
+        # <nWorkers> of them, and wait for all to complete
         #
-        with Pool(processes=nWorkers) as pool:
-            pool.starmap(uploadDirReplicate, args_arr)
-        pool.join()
+        WorkerLimit(nWorkers).starmap(uploadDirReplicate, args_arr)
 
         self.toc()
         self.logger.info("Finished in {}s".format(round(self.elapsed)))
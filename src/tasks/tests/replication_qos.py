@@ -3,7 +3,7 @@ import random
 
 from common.es.rucio import Rucio as ESRucio
 from common.rucio.helpers import createCollection
-from common.rucio.wrappers import RucioWrappersAPI, RucioWrappersCLI
+from common.rucio.wrappers import RucioWrappersAPI, RucioWrappersCLI, RucioWrappersInProcess
 from tasks.task import Task
 from utility import generateRandomFile
 
@@ -25,6 +25,7 @@ class TestReplicationQos(Task):
             databases = kwargs["databases"]
             taskName = kwargs["task_name"]
             namingPrefix = kwargs.get("naming_prefix", "")
+            useCLI = kwargs.get("use_cli", False)
             if len(qos) != len(lifetimes):
                 self.logger.critical(
                     "{} qos and {} lifetimes passed. "
@@ -38,10 +39,11 @@ class TestReplicationQos(Task):
             self.logger.critical(repr(e))
             return False
 
-        # Instantiate RucioWrappers to make Rucio calls
+        # Instantiate RucioWrappers to make Rucio calls, via CLI subprocesses if
+        # <useCLI>, otherwise in-process.
         #
         rucio_api = RucioWrappersAPI()
-        rucio_cli = RucioWrappersCLI()
+        rucio_cli = RucioWrappersCLI() if useCLI else RucioWrappersInProcess()
 
         # Create a dataset to house the data, named with today's date
         # and scope <scope>.
@@ -1,12 +1,11 @@
 from datetime import datetime
 import os
-import time
 
 from common.es.rucio import Rucio as ESRucio
-from common.rucio.helpers import createCollection
+from common.rucio.helpers import AttachmentBuffer, createCollection
 from common.rucio.wrappers import RucioWrappersAPI
 from tasks.task import Task
-from utility import bcolors, generateRandomFile
+from utility import bcolors, chunk, generateRandomFile
 
 
 class TestUpload(Task):
@@ -28,6 +27,9 @@ class TestUpload(Task):
             databases = kwargs["databases"]
             taskName = kwargs["task_name"]
             namingPrefix = kwargs.get("naming_prefix", "")
+            attachBatchSize = kwargs.get("attach_batch_size", 1)
+            nThreads = kwargs.get("n_threads", 1)
+            nThreadsPerRSE = kwargs.get("n_threads_per_rse", 1)
         except KeyError as e:
             self.logger.critical("Could not find necessary kwarg for task.")
             self.logger.critical(repr(e))
@@ -42,84 +44,99 @@ class TestUpload(Task):
         #
         datasetDID = createCollection(self.logger.name, scope)
 
-        # Iteratively upload a file of size from <sizes> to each
-        # RSE, attach to the dataset, add replication rules to the
-        # other listed RSEs.
+        # Attach uploaded files to the dataset in batches of <attachBatchSize>.
         #
-        for rseDst in rses:
-            self.logger.info(
-                bcolors.OKBLUE + "RSE (dst): {}".format(rseDst) + bcolors.ENDC
-            )
-            for protocol in protocols:
-                for size in sizes:
-                    self.logger.debug("File size: {} bytes".format(size))
-                    for idx in range(nFiles):
-                        # Generate random file of size <size>
-                        f = generateRandomFile(size, prefix=namingPrefix)
-                        fileDID = "{}:{}".format(scope, os.path.basename(f.name))
+        attachments = AttachmentBuffer(self.logger, batchSize=attachBatchSize)
 
-                        # Upload to <rseDst>
-                        self.logger.debug(
-                            "Uploading file {} of {} with protocol {}".format(
-                                idx + 1, nFiles, protocol
-                            )
-                        )
+        # Upload a file of each size from <sizes> to each RSE with each protocol,
+        # <nFiles> times, on up to <nThreads> threads with no more than
+        # <nThreadsPerRSE> uploads to any one RSE at a time. Files are generated
+        # and uploaded in rounds so that only a few need to be on disk at once.
+        #
+        self.logger.info(
+            bcolors.OKBLUE + "RSEs (dst): {}".format(", ".join(rses)) + bcolors.ENDC
+        )
+        uploads = [
+            (rseDst, protocol, size)
+            for rseDst in rses for protocol in protocols for size in sizes for idx in range(nFiles)
+        ]
+        for uploadsRound in chunk(uploads, max(1, nThreads) * 4):
+            items = []
+            for rseDst, protocol, size in uploadsRound:
+                # Generate random file of size <size>
+                with self.span("generate", nBytes=size):
+                    f = generateRandomFile(size, prefix=namingPrefix)
+                items.append({
+                    "rse": rseDst,
+                    "scope": scope,
+                    "filePath": f.name,
+                    "lifetime": lifetime,
+                    "forceScheme": protocol,
+                })
+
+            # Upload to each <rseDst>
+            self.logger.debug("Uploading {} files on {} threads".format(len(items), nThreads))
+            with self.span("upload") as span:
+                results = rucio.uploadMany(
+                    items, nThreads=nThreads, nThreadsPerRSE=nThreadsPerRSE, logger=self.logger)
+                span.bytes = sum(result["bytes"] or 0 for result in results)
 
-                        entry = {
-                            "task_name": taskName,
-                            "file_size": size,
-                            "type": "file",
-                            "n_files": 1,
-                            "is_upload_submitted": 1,
-                        }
-                        try:
-                            st = time.time()
-                            rucio.upload(
-                                logger=self.logger,
-                                rse=rseDst,
-                                scope=scope,
-                                filePath=f.name,
-                                lifetime=lifetime,
-                                forceScheme=protocol,
-                            )
-                            entry["upload_duration"] = time.time() - st
-                            entry["state"] = "UPLOAD-SUCCESSFUL"
-                            self.logger.debug("Upload complete")
+            entries = []
+            for (rseDst, protocol, size), result in zip(uploadsRound, results):
+                filePath = result["item"]["filePath"]
+                fileDID = "{}:{}".format(scope, os.path.basename(filePath))
+                entry = {
+                    "task_name": taskName,
+                    "file_size": size,
+                    "type": "file",
+                    "n_files": 1,
+                    "is_upload_submitted": 1,
+                }
+                if result["error"] is None:
+                    entry["upload_duration"] = result["duration"]
+                    entry["state"] = "UPLOAD-SUCCESSFUL"
+                    self.logger.debug("Upload of {} to {} with protocol {} complete".format(
+                        fileDID, rseDst, protocol))
 
-                            # Attach to dataset
-                            self.logger.debug(
-                                "Attaching file {} to {}".format(fileDID, datasetDID)
-                            )
-                            try:
-                                rucio.attach(todid=datasetDID, dids=fileDID)
-                            except Exception as e:
-                                self.logger.warning(repr(e))
-                            self.logger.debug("Attached file to dataset")
-                        except Exception as e:
-                            self.logger.warning("Upload failed: {}".format(e))
-                            now = datetime.now()
-                            entry["created_at"] = now.isoformat() 
-                            entry["scope"] = scope
-                            entry["name"] = os.path.basename(f.name)
-                            entry["from_rse"] = None
-                            entry["to_rse"] = rseDst
-                            entry["error"] = repr(e.__class__.__name__).strip("'")
-                            entry["error_details"] = repr(e).strip("'")
-                            entry["protocol"] = protocol
-                            entry["state"] = "UPLOAD-FAILED"
-                        os.remove(f.name)
+                    # Attach to dataset
+                    self.logger.debug(
+                        "Attaching file {} to {}".format(fileDID, datasetDID)
+                    )
+                    with self.span("attach"):
+                        attachments.add(datasetDID, fileDID)
+                else:
+                    e = result["error"]
+                    self.logger.warning("Upload failed: {}".format(e))
+                    entry["created_at"] = datetime.fromtimestamp(result["started_at"]).isoformat()
+                    entry["scope"] = scope
+                    entry["name"] = os.path.basename(filePath)
+                    entry["from_rse"] = None
+                    entry["to_rse"] = rseDst
+                    entry["error"] = repr(e.__class__.__name__).strip("'")
+                    entry["error_details"] = repr(e).strip("'")
+                    entry["protocol"] = protocol
+                    entry["state"] = "UPLOAD-FAILED"
+                os.remove(filePath)
+                entries.append((fileDID, entry))
 
-                        # Push corresponding rules to database
-                        if databases is not None:
-                            for database in databases:
-                                if database["type"] == "es":
-                                    self.logger.debug(
-                                        "Injecting rules into ES database...")
-                                    es = ESRucio(database["uri"], self.logger)
+            # Push corresponding rules to database, sending the documents for
+            # the round in bulk requests.
+            if databases is not None:
+                for database in databases:
+                    if database["type"] == "es":
+                        self.logger.debug(
+                            "Injecting rules into ES database...")
+                        with self.span("db-push"):
+                            es = ESRucio(database["uri"], self.logger)
+                            with es.bulk():
+                                for fileDID, entry in entries:
                                     es.pushRulesForDID(
                                         fileDID, index=database["index"],
                                         baseEntry=entry
                                     )
 
+        with self.span("attach"):
+            attachments.flush()
+
         self.toc()
         self.logger.info("Finished in {}s".format(round(self.elapsed)))
@@ -3,8 +3,6 @@ import importlib
 import os
 import tempfile
 
-from gfal2 import Gfal2Context
-
 from common.rucio.wrappers import RucioWrappersAPI
 from tasks.task import Task
 
@@ -36,6 +34,8 @@ class TestUploadNondeterministic(Task):
 
         # Set up GFAL2 context and transfer parameters.
         #
+        from gfal2 import Gfal2Context
+
         gfal = Gfal2Context()
         params = gfal.transfer_parameters()
         params.set_checksum = True
@@ -1,7 +1,7 @@
 import os
 
 from common.es.rucio import Rucio as ESRucio
-from common.rucio.helpers import createCollection
+from common.rucio.helpers import AttachmentBuffer, ReplicaResolver, RuleBuffer, createCollection
 from common.rucio.wrappers import RucioWrappersAPI
 from tasks.task import Task
 from utility import bcolors, generateRandomFile
@@ -26,6 +26,8 @@ class TestUploadReplication(Task):
             databases = kwargs["databases"]
             taskName = kwargs["task_name"]
             namingPrefix = kwargs.get("naming_prefix", "")
+            attachBatchSize = kwargs.get("attach_batch_size", 1)
+            ruleBatchSize = kwargs.get("rule_batch_size", 1)
         except KeyError as e:
             self.logger.critical("Could not find necessary kwarg for task.")
             self.logger.critical(repr(e))
@@ -40,6 +42,48 @@ class TestUploadReplication(Task):
         #
         datasetDID = createCollection(self.logger.name, scope)
 
+        # Attach uploaded files to the dataset in batches of <attachBatchSize>.
+        #
+        attachments = AttachmentBuffer(self.logger, batchSize=attachBatchSize)
+
+        # Add replication rules for uploaded files in batches of <ruleBatchSize>
+        # files, pushing the rules of each batch to the databases once added. Files
+        # any of whose rules could not be added are not pushed, so that they are
+        # not counted as submitted.
+        #
+        rules = RuleBuffer(self.logger, batchSize=ruleBatchSize)
+        fileSizes = {}
+
+        def pushRules(fileDIDs):
+            if databases is None:
+                return
+            replicas = ReplicaResolver()
+            try:
+                with self.span("db-push"):
+                    replicas.resolve(fileDIDs)
+            except Exception as e:
+                self.logger.warning("Error listing replicas: {}".format(repr(e)))
+            sizes = {fileDID: fileSizes.pop(fileDID) for fileDID in fileDIDs}
+            for database in databases:
+                if database["type"] == "es":
+                    self.logger.debug("Injecting rules into ES database...")
+                    with self.span("db-push"):
+                        es = ESRucio(database["uri"], self.logger)
+                        with es.bulk():
+                            for fileDID in fileDIDs:
+                                es.pushRulesForDID(
+                                    fileDID,
+                                    index=database["index"],
+                                    replicas=replicas,
+                                    baseEntry={
+                                        "task_name": taskName,
+                                        "file_size": sizes[fileDID],
+                                        "type": "file",
+                                        "n_files": 1,
+                                        "is_submitted": 1,
+                                    },
+                                )
+
         # Iteratively upload a file of size from <sizes> to each
         # RSE, attach to the dataset, add replication rules to the
         # other listed RSEs.
@@ -52,15 +96,17 @@ class TestUploadReplication(Task):
                 self.logger.debug("File size: {} bytes".format(size))
                 for idx in range(nFiles):
                     # Generate random file of size <size>
-                    f = generateRandomFile(size, prefix=namingPrefix)
+                    with self.span("generate", nBytes=size):
+                        f = generateRandomFile(size, prefix=namingPrefix)
                     fileDID = "{}:{}".format(scope, os.path.basename(f.name))
 
                     # Upload to <rseSrc>
                     self.logger.debug("Uploading file {} of {}".format(idx + 1, nFiles))
                     try:
-                        rucio.upload(
-                            logger=self.logger, rse=rseSrc, scope=scope, filePath=f.name, lifetime=lifetime
-                        )
+                        with self.span("upload", nBytes=size):
+                            rucio.upload(
+                                logger=self.logger, rse=rseSrc, scope=scope, filePath=f.name, lifetime=lifetime
+                            )
                     except Exception as e:
                         self.logger.warning(repr(e))
                         os.remove(f.name)
@@ -72,50 +118,25 @@ class TestUploadReplication(Task):
                     self.logger.debug(
                         "Attaching file {} to {}".format(fileDID, datasetDID)
                     )
-                    try:
-                        rucio.attach(todid=datasetDID, dids=fileDID)
-                    except Exception as e:
-                        self.logger.warning(repr(e))
-                        break
-                    self.logger.debug("Attached file to dataset")
+                    with self.span("attach"):
+                        if attachments.add(datasetDID, fileDID):
+                            break
 
                     # Add replication rules for other RSEs
                     self.logger.debug("Adding replication rules...")
-                    for rseDst in rses:
-                        if rseSrc == rseDst:
-                            continue
-                        self.logger.debug(
-                            bcolors.OKGREEN
-                            + "RSE (dst): {}".format(rseDst)
-                            + bcolors.ENDC
+                    fileSizes[fileDID] = size
+                    with self.span("add-rule"):
+                        added = rules.add(
+                            fileDID, 1, [rseDst for rseDst in rses if rseDst != rseSrc],
+                            lifetime=lifetime, activity=activity, src=rseSrc
                         )
-                        try:
-                            rtn = rucio.addRule(
-                                fileDID, 1, rseDst, lifetime=lifetime, src=rseSrc, activity=activity
-                            )
-                            self.logger.debug("Rule ID: {}".format(rtn[0]))
-                        except Exception as e:
-                            self.logger.warning(repr(e))
-                            continue
-                    self.logger.debug("Replication rules added")
-
-                    # Push corresponding rules to database
-                    if databases is not None:
-                        for database in databases:
-                            if database["type"] == "es":
-                                self.logger.debug("Injecting rules into ES database...")
-                                es = ESRucio(database["uri"], self.logger)
-                                es.pushRulesForDID(
-                                    fileDID,
-                                    index=database["index"],
-                                    baseEntry={
-                                        "task_name": taskName,
-                                        "file_size": size,
-                                        "type": "file",
-                                        "n_files": 1,
-                                        "is_submitted": 1,
-                                    },
-                                )
+                    pushRules(added)
+
+        with self.span("attach"):
+            attachments.flush()
+        with self.span("add-rule"):
+            added = rules.flush()
+        pushRules(added)
 
         self.toc()
         self.logger.info("Finished in {}s".format(round(self.elapsed)))
@@ -1,8 +1,12 @@
 import os
 import random
+import resource
+import stat
 import string
 import tempfile
+import uuid
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
 
 
@@ -19,6 +23,52 @@ class bcolors:
     UNDERLINE = "\033[4m"
 
 
+def getCacheDir(name=""):
+    """
+    Get the path to a directory, <name>, under the on-disk cache root, creating it
+    if necessary. The cache root can be set with the RUCIO_ANALYSIS_CACHE_DIR
+    environment variable.
+
+    Raises PermissionError if the root or directory already exists but is not a
+    directory owned by this user that only they can write to, as its contents
+    could then have been planted by someone else.
+
+    Returns the path to the directory.
+    """
+    root = os.environ.get(
+        "RUCIO_ANALYSIS_CACHE_DIR",
+        os.path.join(tempfile.gettempdir(), "rucio-analysis-cache")
+    )
+    path = os.path.join(root, name)
+    for directory in dict.fromkeys((root, path)):
+        Path(directory).mkdir(mode=0o700, parents=True, exist_ok=True)
+        st = os.lstat(directory)
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o022:
+            raise PermissionError(
+                "Cache directory {} must be a directory owned by uid {} and not writable by others".format(
+                    directory, os.getuid()))
+    return path
+
+
+def getRSS():
+    """ Get the current resident set size of this process in bytes. """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, ValueError, IndexError):   # fall back to the peak RSS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def chunk(items, size):
+    """ Split an iterable, <items>, into consecutive lists of at most <size> items. """
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
 def generateRandomFile(size, prefix="", suffix=""):
     """
     Generate a randomly named file of size, <size>, with random contents.
@@ -30,30 +80,45 @@ def generateRandomFile(size, prefix="", suffix=""):
     if suffix:  # add file suffix if set.
         suffix += "_"
     todaysDatetime = datetime.now().strftime("%d%m%yT%H.%M.%S")
-    basename = "{}{}KB_{}{}".format(prefix, size // 1000, todaysDatetime, suffix)
+    basename = "{}{}KB_{}_{}{}".format(prefix, size // 1000, todaysDatetime, uuid.uuid4().hex[:8], suffix)
     absFilename = os.path.join(tempfile.gettempdir(), basename)
     with open(absFilename, "wb") as f:
         f.write(os.urandom(size))
     return f
 
 
-def generateRandomFilesDir(nFiles, size, dirId=1, prefix="", suffix=""):
+def getRandomFilesDirName(nFiles, size, dirId=1, prefix="", suffix="", timestamp=None):
+    """
+    Get the name of a directory generated by generateRandomFilesDir at time,
+    <timestamp> (now if None).
+    """
+    if prefix:  # add file prefix if set.
+        prefix += "_"
+    if suffix:  # add file suffix if set.
+        suffix += "_"
+    todaysDatetime = (timestamp or datetime.now()).strftime("%d%m%yT%H.%M.%S")
+    return "{}{}x{}KB_{}_d{}{}".format(
+        prefix, nFiles, size // 1000, todaysDatetime, dirId, suffix
+    )
+
+
+def generateRandomFilesDir(nFiles, size, dirId=1, prefix="", suffix="", dirName=None):
     """
     Generate a directory of, <nFiles>, of size, <size>, with random contents.
     A directory id, <dirId>, can be passed optionally to avoid naming collisions when
-    load testing.
+    load testing. The directory is named by getRandomFilesDirName unless a name,
+    <dirName>, is given.
 
     Returns the path to the created directory.
     """
+    if dirName is None:
+        dirName = getRandomFilesDirName(nFiles, size, dirId=dirId, prefix=prefix, suffix=suffix)
     if prefix:  # add file prefix if set.
         prefix += "_"
     if suffix:  # add file suffix if set.
         suffix += "_"
     todaysDatetime = datetime.now().strftime("%d%m%yT%H.%M.%S")
     tmpDir = tempfile.gettempdir()
-    dirName = "{}{}x{}KB_{}_d{}{}".format(
-        prefix, nFiles, size // 1000, todaysDatetime, dirId, suffix
-    )
 
     # Create directory structure.
     #
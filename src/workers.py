@@ -0,0 +1,207 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+
+from logger import Logger
+from profiling import getWorkerProfilePrefix
+
+# Modules imported once by the forkserver so that each worker process starts with
+# them already loaded. Modules that are not installed are skipped.
+#
+PRELOAD = [
+    "rucio.client.client",
+    "rucio.client.uploadclient",
+    "elasticsearch",
+    "aiohttp",
+    "gfal2",
+    "common.rucio.wrappers",
+    "common.rucio.aio",
+    "common.es.rucio"
+]
+
+_pool = None
+_shutdown = False
+_nWorkers = os.cpu_count()
+_level = "INFO"
+_lock = threading.Lock()
+
+# Per-worker state.
+#
+_nProfiled = itertools.count()
+
+
+class _Profiled():
+    """
+    Wrapper for a function, <fn>, run by a worker that writes a profile of each
+    call to a separate part, <prefix>-<pid>-<n>.prof.
+    """
+
+    def __init__(self, fn, prefix):
+        self.fn = fn
+        self.prefix = prefix
+
+    def __call__(self, *args, **kwargs):
+        import cProfile
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return self.fn(*args, **kwargs)
+        finally:
+            profile.disable()
+            profile.dump_stats("{}-{}-{}.prof".format(self.prefix, os.getpid(), next(_nProfiled)))
+
+
+def configure(nWorkers=None, level=None):
+    """
+    Set the number of worker processes, <nWorkers>, and log level, <level>, to use
+    when the pool is created.
+    """
+    global _nWorkers, _level
+    if nWorkers is not None:
+        _nWorkers = nWorkers
+    if level is not None:
+        _level = level
+
+
+def getNWorkers():
+    """ Get the number of worker processes the pool is (or will be) created with. """
+    return _nWorkers
+
+
+def _initWorker(level, cacheSettings, esSettings):
+    """ Initialise a worker process. """
+    global _level
+    _level = level
+
+    # Use the same cache of read-mostly Rucio calls (and so the same cache file, if
+    # any) and Elasticsearch client settings as the parent process.
+    #
+    from common.es import clients
+    from common.rucio import cache
+
+    cache.configure(**cacheSettings)
+    clients.configure(**esSettings)
+
+    # Build a Rucio client for this worker's client pool so that authentication
+    # happens here, rather than in the first work item given to each worker.
+    #
+    try:
+        from rucio.client.client import Client
+        from common.rucio.clients import pooledClient
+
+        with pooledClient(Client):
+            pass
+    except Exception as e:
+        getLogger("workers").warning("Could not initialise Rucio client in worker: {}".format(repr(e)))
+
+
+def getPool():
+    """
+    Get the session-wide pool of worker processes, creating it on first use.
+
+    Workers are forked from a forkserver that has preloaded the Rucio client,
+    Elasticsearch and gfal2 modules, so they do not inherit the state of the parent
+    process and do not need to import these modules again.
+
+    Raises RuntimeError once the pool has been shut down, e.g. if called by a task
+    that was abandoned after timing out, so that no pool is left running.
+    """
+    global _pool
+    from common.es import clients
+    from common.rucio import cache
+
+    with _lock:
+        if _shutdown:
+            raise RuntimeError("The worker pool has been shut down.")
+        if _pool is None:
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(PRELOAD)
+            _pool = context.Pool(
+                processes=_nWorkers, initializer=_initWorker,
+                initargs=(_level, cache.getSettings(), clients.getSettings()))
+    return _pool
+
+
+def _wrap(fn):
+    """ Wrap a function, <fn>, for profiling if the calling task is being profiled. """
+    prefix = getWorkerProfilePrefix()
+    return fn if prefix is None else _Profiled(fn, prefix)
+
+
+def starmap(fn, iterable):
+    """ Call <fn> with each tuple of arguments in <iterable> on the pool, returning the results in order. """
+    return getPool().starmap(_wrap(fn), iterable)
+
+
+def applyAsync(fn, args=(), kwds={}, callback=None, errorCallback=None):
+    """
+    Call <fn> with <args> and <kwds> on the pool, returning an AsyncResult. The
+    result, or exception, is passed to <callback>, or <errorCallback>, if given.
+    """
+    return getPool().apply_async(_wrap(fn), args, kwds, callback=callback, error_callback=errorCallback)
+
+
+class WorkerLimit():
+    """
+    Limit on the number of calls a task has in flight on the session-wide pool, so
+    that a task uses no more than the <nWorkers> workers it is configured with,
+    however many the pool has been sized for by other tasks. If <nWorkers> is None,
+    the task may use all of the pool's workers.
+    """
+
+    def __init__(self, nWorkers=None):
+        self.nWorkers = getNWorkers() if nWorkers is None else max(1, min(nWorkers, getNWorkers()))
+        self._slots = threading.BoundedSemaphore(self.nWorkers)
+
+    def applyAsync(self, fn, args=(), kwds={}):
+        """ As applyAsync(), but first waiting until fewer than <nWorkers> calls are in flight. """
+        self._slots.acquire()
+        try:
+            return applyAsync(fn, args, kwds, callback=self._release, errorCallback=self._release)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def starmap(self, fn, iterable):
+        """ As starmap(), but with no more than <nWorkers> calls in flight. """
+        results = [self.applyAsync(fn, args) for args in iterable]
+        return [result.get() for result in results]
+
+    def _release(self, result):
+        self._slots.release()
+
+
+def shutdown(terminate=False):
+    """
+    Wait for outstanding work to complete, or stop it if <terminate> (e.g. as it was
+    submitted by tasks that have been abandoned), and stop the worker processes.
+    No pool can be created afterwards.
+    """
+    global _pool, _shutdown
+    with _lock:
+        _shutdown = True
+        if _pool is not None:
+            if terminate:
+                _pool.terminate()
+            else:
+                _pool.close()
+            _pool.join()
+            _pool = None
+
+
+def getLogger(name):
+    """ Get a logger, <name>, in a worker process, adding a handler on first use. """
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        logger = Logger(name=name, level=_level).get()
+    return logger
+
+
+def getESRucio(uri, logger):
+    """ Get an Elasticsearch wrapper for <uri> that uses this process's client for it. """
+    from common.es.rucio import Rucio as ESRucio
+
+    return ESRucio(uri, logger)